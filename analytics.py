@@ -0,0 +1,113 @@
+from collections import Counter
+from itertools import compress, repeat
+from operator import add, mul
+
+import archive
+
+# History queries over archived draws. An archive never changes once written,
+# so each one is reduced to a fixed-size summary the first time it is asked
+# for; range queries then only add summaries together. All per-number work is
+# done with map() over the archive's columns instead of per-bet Python loops.
+
+
+class DrawSummary:
+    __slots__ = ("date_key", "pnumber", "bets", "stakes", "counts", "volume", "overbuy", "base", "payout")
+
+    def net(self, pnumber=None):
+        # Dealer net for the given result, the same formula DrawRisk uses
+        pnumber = self.pnumber if pnumber is None else pnumber
+        if pnumber is None:
+            return None
+        return self.base - self.payout[pnumber]
+
+
+def _after_com(total, com):
+    # Same rounding as bot.after_com, so archived and live draws settle alike
+    return total - (total * com) // 100
+
+
+_summaries = {}  # {path: DrawSummary}, one per archive ever asked for
+
+
+def summarize_draw(path):
+    summary = _summaries.get(path)
+    if summary is None:
+        summary = _summaries[path] = _summarize(path)
+    return summary
+
+
+def _summarize(path):
+    draw = archive.load_draw(path)
+    meta = draw.meta
+    com = meta.get("com", {})
+    za = meta.get("za", {})
+
+    summary = DrawSummary()
+    summary.date_key = draw.date_key
+    summary.pnumber = meta.get("pnumber")
+    summary.stakes = [0] * 100   # Agent stake per number
+    summary.payout = [0] * 100   # stake * za per number, upstreams included
+    summary.volume = {}          # {agent: total stake}
+    summary.overbuy = 0
+    summary.base = 0
+    for user, index in draw.user_index.items():
+        row = draw.stakes[index * 100:(index + 1) * 100]
+        total = sum(row)
+        summary.base += _after_com(total, com.get(user, 0))
+        summary.payout = list(map(add, summary.payout, map(mul, row, repeat(za.get(user, archive.DEFAULT_ZA)))))
+        if total > 0:
+            summary.volume[user] = total
+            summary.stakes = list(map(add, summary.stakes, row))
+        else:
+            summary.overbuy -= total
+
+    # Bet frequency counts agent bets only; overbuy lots are stored negative
+    counts = Counter(compress(draw.numbers, map((0).__lt__, draw.amounts)))
+    summary.counts = [counts.get(n, 0) for n in range(100)]
+    summary.bets = sum(summary.counts)
+    return summary
+
+
+def number_heat(summaries):
+    stakes = [0] * 100
+    counts = [0] * 100
+    for summary in summaries:
+        stakes = list(map(add, stakes, summary.stakes))
+        counts = list(map(add, counts, summary.counts))
+    return stakes, counts
+
+
+def month_of(date_key):
+    # "dd/mm/YYYY AM" -> "YYYY-mm"
+    day = date_key.split()[0]
+    return f"{day[6:10]}-{day[3:5]}"
+
+
+def agent_volume(summaries):
+    # {agent: {month: total stake}}
+    volume = {}
+    for summary in summaries:
+        month = month_of(summary.date_key)
+        for user, total in summary.volume.items():
+            months = volume.setdefault(user, {})
+            months[month] = months.get(month, 0) + total
+    return volume
+
+
+def dealer_pnl(summaries, pnumbers):
+    # [(date_key, pnumber, net)] per draw and {month: net} for the settled ones
+    draws = []
+    months = {}
+    for summary in summaries:
+        pnumber = pnumbers.get(summary.date_key, summary.pnumber)
+        net = summary.net(pnumber)
+        draws.append((summary.date_key, pnumber, net))
+        if net is not None:
+            month = month_of(summary.date_key)
+            months[month] = months.get(month, 0) + net
+    return draws, months
+
+
+def forget(path):
+    # For a path that is about to be written again; other summaries stay
+    _summaries.pop(path, None)
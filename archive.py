@@ -0,0 +1,224 @@
+import array
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import Counter
+from functools import cached_property
+from itertools import accumulate
+
+# Columnar on-disk format for closed draws. A file holds a small JSON header
+# (users, slips, settlement terms) followed by fixed-width columns, one entry
+# per bet, a per-user 100-slot stake matrix and two lookup indexes:
+#
+#   amount int64[n] | user uint32[n] | slip uint32[n] | number uint8[n] | stakes int64[users * 100]
+#   | by_number uint32[n] | number_offsets uint32[101] | by_user uint32[n] | user_offsets uint32[users + 1]
+#
+# The indexes are bet positions grouped by number and by user (version 2;
+# version 1 files have none and get them built on first use). Each column
+# starts on an 8-byte boundary so it can be read in place through mmap.
+# Overbuy bets are stored negative, the same as in a live draw's bets.
+
+MAGIC = b"KKDRAW\0\0"
+DEFAULT_ZA = 80  # Za for users with none set, live or archived
+CACHE_SIZE = 128
+VERSION = 2
+HEADER = struct.Struct("<8sII")  # magic, version, meta length
+
+
+def _padding(size):
+    return (-size) % 8
+
+
+def write_draw(path, date_key, slips, meta):
+    # slips is [(slip_id, (username, timestamp, [(num, amt)], is_overbuy))]
+    users = {}
+    slip_rows = []
+    amounts = array.array('q')
+    user_col = array.array('I')
+    slip_col = array.array('I')
+    numbers = array.array('B')
+    for index, (slip_id, (username, timestamp, bets, is_overbuy)) in enumerate(slips):
+        user = users.setdefault(username, len(users))
+        slip_rows.append([":".join(str(part) for part in slip_id), user, timestamp, is_overbuy])
+        for num, amt in bets:
+            amounts.append(-amt if is_overbuy else amt)
+            user_col.append(user)
+            slip_col.append(index)
+            numbers.append(num)
+
+    stakes = array.array('q', bytes(8 * 100 * len(users)))
+    for user, num, amt in zip(user_col, numbers, amounts):
+        stakes[user * 100 + num] += amt
+    number_offsets, by_number = _group_rows(numbers, 100)
+    user_offsets, by_user = _group_rows(user_col, len(users))
+
+    header = dict(meta, date_key=date_key, users=list(users), slips=slip_rows, bets=len(amounts))
+    header_bytes = json.dumps(header, ensure_ascii=False).encode()
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * _padding(HEADER.size + len(header_bytes)))
+        for column in (amounts, user_col, slip_col, numbers, stakes,
+                       by_number, array.array('I', number_offsets), by_user, array.array('I', user_offsets)):
+            data = column.tobytes()
+            f.write(data)
+            f.write(b"\0" * _padding(len(data)))
+    os.replace(tmp, path)
+    return len(amounts)
+
+
+class ArchivedDraw:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or not 1 <= version <= VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} draw archive")
+
+        offset = HEADER.size
+        self.meta = json.loads(self._mmap[offset:offset + meta_length].decode())
+        offset += meta_length
+        offset += _padding(offset)
+
+        view = memoryview(self._mmap)
+        count = self.meta["bets"]
+        user_count = len(self.meta["users"])
+        layout = [
+            ("amounts", 'q', 8, count),
+            ("users", 'I', 4, count),
+            ("slips", 'I', 4, count),
+            ("numbers", 'B', 1, count),
+            ("stakes", 'q', 8, user_count * 100),
+        ]
+        if version >= 2:
+            layout += [
+                ("by_number", 'I', 4, count),
+                ("number_offsets", 'I', 4, 101),
+                ("by_user", 'I', 4, count),
+                ("user_offsets", 'I', 4, user_count + 1),
+            ]
+        columns = {}
+        for name, code, width, length in layout:
+            size = width * length
+            columns[name] = view[offset:offset + size].cast(code)
+            offset += size + _padding(size)
+        self.amounts = columns["amounts"]
+        self.user_column = columns["users"]
+        self.slip_column = columns["slips"]
+        self.numbers = columns["numbers"]
+        self.stakes = columns["stakes"]
+        if version >= 2:
+            # Shadow the cached properties that build these for version 1 files
+            self._number_rows = (columns["number_offsets"], columns["by_number"])
+            self._user_rows = (columns["user_offsets"], columns["by_user"])
+        self.user_index = {username: i for i, username in enumerate(self.meta["users"])}
+
+    @property
+    def date_key(self):
+        return self.meta["date_key"]
+
+    @property
+    def usernames(self):
+        return self.meta["users"]
+
+    def user_stakes(self, username):
+        # 100-slot stake row for one user, or None if they did not bet
+        index = self.user_index.get(username)
+        if index is None:
+            return None
+        return self.stakes[index * 100:(index + 1) * 100]
+
+    def user_totals(self):
+        # {username: total stake}, overbuy upstreams negative
+        return {username: sum(self.stakes[i * 100:(i + 1) * 100]) for i, username in enumerate(self.usernames)}
+
+    def iter_bets(self):
+        # (username, num, amt, slip_row) for every bet, in slip order
+        users = self.usernames
+        slips = self.meta["slips"]
+        for user, num, amt, slip in zip(self.user_column, self.numbers, self.amounts, self.slip_column):
+            yield users[user], num, amt, slips[slip]
+
+    @cached_property
+    def _number_rows(self):
+        return _group_rows(self.numbers, 100)
+
+    @cached_property
+    def _user_rows(self):
+        return _group_rows(self.user_column, len(self.usernames))
+
+    def find_rows(self, username=None, number=None):
+        # Bet positions, in slip order, for a user and/or a number
+        if username is not None:
+            user = self.user_index.get(username)
+            if user is None:
+                return []
+            offsets, rows = self._user_rows
+            rows = rows[offsets[user]:offsets[user + 1]]
+            if number is not None:
+                numbers = self.numbers
+                rows = [row for row in rows if numbers[row] == number]
+            return rows
+        if number is not None:
+            offsets, rows = self._number_rows
+            return rows[offsets[number]:offsets[number + 1]]
+        return range(self.meta["bets"])
+
+    def iter_slips(self):
+        # Rebuilds the live slip log entries: (slip_id, (username, timestamp, [(num, amt)], is_overbuy))
+        users = self.usernames
+        slips = self.meta["slips"]
+        bets = []
+        current = None
+        for slip, num, amt in zip(self.slip_column, self.numbers, self.amounts):
+            if slip != current:
+                if bets:
+                    yield self._slip_entry(users, slips[current], bets)
+                current, bets = slip, []
+            bets.append((num, amt))
+        if bets:
+            yield self._slip_entry(users, slips[current], bets)
+
+    @staticmethod
+    def _slip_entry(users, row, bets):
+        slip_id, user, timestamp, is_overbuy = row
+        if is_overbuy:
+            bets = [(num, -amt) for num, amt in bets]
+        return tuple(slip_id.split(":")), (users[user], timestamp, bets, is_overbuy)
+
+
+def _group_rows(column, groups):
+    # Row positions ordered by column value (a stable sort, so slip order is
+    # kept within a value); rows for value v are rows[offsets[v]:offsets[v + 1]]
+    rows = array.array('I', sorted(range(len(column)), key=column.__getitem__))
+    counts = Counter(column)
+    offsets = [0] + list(accumulate(counts.get(v, 0) for v in range(groups)))
+    return offsets, rows
+
+
+_open_draws = {}  # {path: ArchivedDraw}, least recently used first
+_open_lock = threading.Lock()
+
+
+def load_draw(path):
+    # Archives never change once written, so opened files are reused
+    with _open_lock:
+        draw = _open_draws.pop(path, None)
+        if draw is None:
+            draw = ArchivedDraw(path)
+        _open_draws[path] = draw
+        while len(_open_draws) > CACHE_SIZE:
+            del _open_draws[next(iter(_open_draws))]
+    return draw
+
+
+def forget(path):
+    # For a path that is about to be written again
+    with _open_lock:
+        _open_draws.pop(path, None)
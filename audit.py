@@ -0,0 +1,124 @@
+import argparse
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from collections import deque
+from datetime import datetime
+
+# Audit trail of every change to a book, one JSON object per line:
+#
+#   {"ts": 1760000000.5, "event": "slip", "book": 1, "draw": "12/05/2026 PM", ...}
+#
+# Handlers call record(), which only puts the log record on a queue; a
+# listener thread turns it into JSON and writes it to size-rotated files, so
+# neither formatting nor disk I/O ever runs on the event loop. Field values
+# must not be mutated after the call (pass tuples, not live lists).
+
+logger = logging.getLogger("audit")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+EVENTS = ("slip", "slip_edit", "delete", "undo", "overbuy", "pnumber", "break", "comza", "cap", "credit",
+          "dateopen", "dateclose", "datedelete", "archive", "reset", "restore")
+
+_listeners = []
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Audit records have no args or exc_info, so there is nothing to render or
+    # copy before they cross to the listener thread
+    def prepare(self, record):
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "event": record.msg}
+        entry.update(record.audit)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def start(path, max_bytes=10 * 1024 * 1024, backups=10):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    records = queue.SimpleQueue()
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter())
+    listener = logging.handlers.QueueListener(records, file_handler)
+    logger.addHandler(_QueueHandler(records))
+    listener.start()
+    _listeners.append(listener)
+
+
+def stop():
+    # Flushes whatever is still queued
+    while _listeners:
+        _listeners.pop().stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+def record(event, **fields):
+    # makeRecord + handle skips the caller lookup logger.info() would do
+    if logger.handlers:
+        logger.handle(logger.makeRecord(logger.name, logging.INFO, "", 0, event, None, None, extra={"audit": fields}))
+
+
+def log_files(path):
+    # Oldest rotated file first, the live file last
+    rotated = []
+    n = 1
+    while os.path.exists(f"{path}.{n}"):
+        rotated.append(f"{path}.{n}")
+        n += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def query(path, book=None, user=None, event=None, draw=None, since=None, until=None, limit=50):
+    # Newest matching entries first. user matches the agent or upstream the
+    # entry is about, or one of the users of a bulk entry (undo, datedelete);
+    # draw is a draw label or a dd/mm/YYYY prefix of one
+    matches = deque(maxlen=limit)
+    for name in log_files(path):
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if book is not None and entry.get("book") != book:
+                    continue
+                if user is not None and entry.get("user") != user and user not in entry.get("users", ()):
+                    continue
+                if event is not None and entry.get("event") != event:
+                    continue
+                if draw is not None and not str(entry.get("draw", "")).startswith(draw):
+                    continue
+                if since is not None and entry["ts"] < since:
+                    continue
+                if until is not None and entry["ts"] > until:
+                    continue
+                matches.append(entry)
+    return list(reversed(matches))
+
+
+def describe(entry, tz=None):
+    # One readable line per entry for chat replies and the command line
+    stamp = datetime.fromtimestamp(entry["ts"], tz).strftime("%d/%m %H:%M:%S")
+    fields = " ".join(f"{k}={v}" for k, v in entry.items() if k not in ("ts", "event", "book"))
+    return f"{stamp} {entry['event']} {fields}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the bot's audit log")
+    parser.add_argument("path", nargs="?", default=os.getenv("AUDIT_LOG", "audit/audit.jsonl"))
+    parser.add_argument("--book", type=int)
+    parser.add_argument("--user")
+    parser.add_argument("--event")
+    parser.add_argument("--draw", help='draw label or day, e.g. "12/05/2026 PM" or 12/05/2026')
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="print raw JSON lines")
+    args = parser.parse_args()
+    for entry in query(args.path, args.book, args.user, args.event, args.draw, limit=args.limit):
+        print(json.dumps(entry, ensure_ascii=False) if args.json else describe(entry))
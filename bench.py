@@ -0,0 +1,441 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time as _time
+from datetime import datetime
+
+import bot
+import shard
+
+# Offline replay benchmark: drives the real handlers with fake Update/Context
+# objects and a stub bot that records every outgoing call.
+
+HANDLERS = ["handle_message", "confirm_delete", "overbuy_confirm", "total", "dateall_view"]
+DEFAULT_MIX = "plain=5,r=3,htip=1,wheel=1"
+
+
+class StubBot:
+    def __init__(self):
+        self.calls = []
+        self.errors = 0
+        self._message_ids = itertools.count(1_000_000)
+
+    def record(self, method, chat_id, text, reply_markup=None):
+        self.calls.append((method, chat_id, len(text)))
+        if text.startswith("❌"):
+            self.errors += 1
+        return FakeMessage(next(self._message_ids), text, FakeChat(chat_id), None, self)
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        return self.record("sendMessage", chat_id, text, reply_markup)
+
+    async def send_document(self, chat_id, document, filename=None, caption="", **kwargs):
+        document.read()
+        return self.record("sendDocument", chat_id, caption or "")
+
+
+class FakeUser:
+    def __init__(self, user_id, username, book_id=1):
+        self.id = user_id
+        self.username = username
+        self.book_id = book_id
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeMessage:
+    def __init__(self, message_id, text, chat, from_user, stub):
+        self.message_id = message_id
+        self.text = text
+        self.chat = chat
+        self.chat_id = chat.id
+        self.from_user = from_user
+        self.date = datetime.now(bot.MYANMAR_TIMEZONE)
+        self._stub = stub
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return self._stub.record("sendMessage", self.chat_id, text, reply_markup)
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, from_user, message, stub):
+        self.data = data
+        self.from_user = from_user
+        self.message = message
+        self._stub = stub
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        return self._stub.record("editMessageText", self.message.chat_id, text, reply_markup)
+
+
+class FakeUpdate:
+    def __init__(self, user, message=None, callback_query=None):
+        self.effective_user = user
+        self.message = message
+        self.callback_query = callback_query
+        self.effective_chat = message.chat if message else callback_query.message.chat
+
+
+class FakeContext:
+    def __init__(self, stub, args=None, user_data=None):
+        self.bot = stub
+        self.args = args or []
+        self.user_data = user_data if user_data is not None else {}
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(","):
+        kind, _, weight = item.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_range(spec):
+    low, _, high = spec.partition("-")
+    return int(low), int(high or low)
+
+
+def make_line(rng, kind):
+    amount = rng.choice([100, 200, 500, 1000, 1500, 2000, 5000])
+    if kind == "r":
+        nums = "/".join(f"{rng.randrange(100):02d}" for _ in range(rng.randint(1, 3)))
+        if rng.random() < 0.5:
+            return f"{nums}r{amount}"
+        return f"{nums} {amount}r{rng.choice([100, 500, 1000])}"
+    if kind == "htip":
+        return f"{rng.randrange(10)}ထိပ် {amount}"
+    if kind == "wheel":
+        digits = "".join(rng.sample("0123456789", rng.randint(3, 5)))
+        return f"{digits}အခွေ{amount}"
+    nums = "/".join(f"{rng.randrange(100):02d}" for _ in range(rng.randint(1, 4)))
+    return f"{nums}-{amount}"
+
+
+def make_workload(agents, slips, lines_range, mix, seed, books=1):
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    # Book ids double as the admin user ids: 1..books
+    users = [FakeUser(10_000 + i, f"agent{i:03d}", i % books + 1) for i in range(agents)]
+    workload = []
+    for n in range(slips):
+        user = users[n % agents]
+        lines = [make_line(rng, rng.choices(kinds, weights)[0]) for _ in range(rng.randint(*lines_range))]
+        workload.append((user, "\n".join(lines)))
+    return users, workload
+
+
+def reset_state(book_ids, users):
+    bot.books.clear()
+    bot.chat_books.clear()
+    key = bot.get_current_date_key()
+    for book_id in book_ids:
+        book = bot.open_book(book_id, book_id)
+        book.current_working_date = key
+        book.date_control[key] = True
+    for user in users:
+        if user.book_id in bot.books:
+            bot.join_book(bot.books[user.book_id], user.id)
+            bot.books[user.book_id].com_data[user.username] = 10
+            bot.books[user.book_id].za_data[user.username] = 80
+    return key
+
+
+async def timed(samples, name, coro):
+    start = _time.perf_counter()
+    await coro
+    samples[name].append(_time.perf_counter() - start)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def ingest(workload, stub, samples, message_ids):
+    for user, text in workload:
+        message = FakeMessage(next(message_ids), text, FakeChat(user.id), user, stub)
+        await timed(samples, "handle_message", bot.handle_message(FakeUpdate(user, message), FakeContext(stub)))
+
+
+async def run_admin_flow(args, book, key, stub, samples, message_ids, rng):
+    admin = FakeUser(book.admin_id, f"dealer{book.admin_id}", book.admin_id)
+    admin_chat = FakeChat(book.chat_id)
+
+    # Admin deletes a fraction of the slips
+    slips = list(book.message_store.items())
+    for (user_id, message_id), entry in rng.sample(slips, int(len(slips) * args.deletes)):
+        data = f"confirm_delete:{user_id}:{message_id}:{entry[3]}"
+        query = FakeCallbackQuery(data, admin, FakeMessage(entry[0], "", admin_chat, admin, stub), stub)
+        await timed(samples, "confirm_delete", bot.confirm_delete(FakeUpdate(admin, callback_query=query), FakeContext(stub)))
+
+    # Overbuy to a few upstreams, each one at a lower break limit than the last
+    limits = sorted(book.draw_ledger(key).values())
+    for n in range(args.upstreams):
+        book.break_limits[key] = percentile(limits, max(10, 90 - 20 * n)) if limits else 0
+        user_data = {}
+        command = FakeMessage(next(message_ids), f"/overbuy up{n}", admin_chat, admin, stub)
+        await bot.overbuy(FakeUpdate(admin, command), FakeContext(stub, [f"up{n}"], user_data))
+        query = FakeCallbackQuery("overbuy_confirm", admin, command, stub)
+        await timed(samples, "overbuy_confirm", bot.overbuy_confirm(FakeUpdate(admin, callback_query=query), FakeContext(stub, user_data=user_data)))
+
+    # Reports
+    book.pnumber_per_date[key] = rng.randrange(100)
+    for _ in range(args.reports):
+        command = FakeMessage(next(message_ids), "/total", admin_chat, admin, stub)
+        await timed(samples, "total", bot.total(FakeUpdate(admin, command), FakeContext(stub)))
+        query = FakeCallbackQuery("dateall_view", admin, command, stub)
+        user_data = {"dateall_selections": {key: True}}
+        await timed(samples, "dateall_view", bot.dateall_view(FakeUpdate(admin, callback_query=query), FakeContext(stub, user_data=user_data)))
+
+
+def count_bets():
+    return sum(len(entry[1]) for book in bot.books.values() for entry in book.message_store.values())
+
+
+def summarize(args, bets, elapsed, stub_calls, errors, samples):
+    return {
+        "agents": args.agents,
+        "books": args.books,
+        "workers": args.workers,
+        "slips": args.slips,
+        "bets": bets,
+        "bets_per_sec": bets / elapsed if elapsed else 0.0,
+        "outgoing_calls": stub_calls,
+        "errors": errors,
+        "handlers": {
+            name: {
+                "calls": len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+            for name, values in samples.items()
+        },
+    }
+
+
+async def run(args):
+    stub = StubBot()
+    users, workload = make_workload(args.agents, args.slips, parse_range(args.lines), parse_mix(args.mix), args.seed, args.books)
+    key = reset_state(range(1, args.books + 1), users)
+    rng = random.Random(args.seed + 1)
+    samples = {name: [] for name in HANDLERS}
+    message_ids = itertools.count(1)
+
+    ingest_start = _time.perf_counter()
+    await ingest(workload, stub, samples, message_ids)
+    ingest_elapsed = _time.perf_counter() - ingest_start
+    bets = count_bets()
+
+    for book in list(bot.books.values()):
+        await run_admin_flow(args, book, key, stub, samples, message_ids, rng)
+
+    result = summarize(args, bets, ingest_elapsed, len(stub.calls), stub.errors, samples)
+    if args.snapshot:
+        result["snapshot"] = await run_snapshot(bot.books[1])
+    if args.lag:
+        result["lag"] = await run_lag(args, bot.books[1], key, stub, workload, message_ids)
+    return result
+
+
+async def run_lag(args, book, key, stub, workload, message_ids):
+    # Admin reports run while agents keep sending slips; the monitor shows how
+    # long any update had to wait for the loop meanwhile
+    monitor = bot.LoopMonitor(0.005, window=1_000_000)
+    monitor.start()
+    admin = FakeUser(book.admin_id, f"dealer{book.admin_id}", book.admin_id)
+    admin_chat = FakeChat(book.chat_id)
+    stop = asyncio.Event()
+
+    async def agents():
+        sent = 0
+        for user, text in itertools.cycle(workload):
+            if stop.is_set():
+                return sent
+            message = FakeMessage(next(message_ids), text, FakeChat(user.id), user, stub)
+            await bot.handle_message(FakeUpdate(user, message), FakeContext(stub))
+            sent += 1
+            await asyncio.sleep(0.001)
+
+    agent_task = asyncio.create_task(agents())
+    start = _time.perf_counter()
+    for _ in range(args.reports):
+        command = FakeMessage(next(message_ids), "/total", admin_chat, admin, stub)
+        await bot.total(FakeUpdate(admin, command), FakeContext(stub))
+        await bot.tsent(FakeUpdate(admin, command), FakeContext(stub))
+        query = FakeCallbackQuery("dateall_view", admin, command, stub)
+        user_data = {"dateall_selections": {key: True}}
+        await bot.dateall_view(FakeUpdate(admin, callback_query=query), FakeContext(stub, user_data=user_data))
+    elapsed = _time.perf_counter() - start
+    stop.set()
+    slips = await agent_task
+    monitor.task.cancel()
+    p50, p99, worst = monitor.stats()
+    return {
+        "reports_ms": elapsed * 1000,
+        "slips_during": slips,
+        "lag_p50_ms": p50 * 1000,
+        "lag_p99_ms": p99 * 1000,
+        "lag_max_ms": worst * 1000,
+    }
+
+
+async def run_snapshot(book):
+    # Times /backup's write path and /restore's rebuild on the first book
+    fd, path = tempfile.mkstemp(suffix=".kksnap")
+    os.close(fd)
+    staging = tempfile.mkdtemp()
+    try:
+        start = _time.perf_counter()
+        settings, draws, archives = await bot.capture_book(book)
+        captured = _time.perf_counter()
+        size = await asyncio.to_thread(bot.snapshot.write_snapshot, path, bot.snapshot_frames(settings, draws, archives))
+        written = _time.perf_counter()
+        restored, _ = await asyncio.to_thread(bot.restore_book, path, staging)
+        done = _time.perf_counter()
+    finally:
+        os.remove(path)
+        shutil.rmtree(staging)
+    same = all(getattr(restored, name) == getattr(book, name) for name in ("message_store", "pnumber_per_date"))
+    same = same and restored.draws.keys() == book.draws.keys()
+    for k, draw in book.draws.items():
+        copy = restored.draws[k]
+        same = same and all(getattr(copy, name) == getattr(draw, name)
+                            for name in ("bets", "ledger", "slips", "slip_index", "number_index"))
+        same = same and copy.risk.net() == draw.risk.net() and copy.overbuys.lots == draw.overbuys.lots
+    return {
+        "bets": sum(len(bets) for draw in book.draws.values() for bets in draw.bets.values()),
+        "bytes": size,
+        "capture_ms": (captured - start) * 1000,
+        "write_ms": (written - captured) * 1000,
+        "restore_ms": (done - written) * 1000,
+        "identical": same,
+    }
+
+
+# Sharded mode: a front process routes each slip by book to a worker process
+# over a multiprocessing queue, the same way shard.py dispatches live updates.
+
+def shard_worker(index, args, users, inbox, results):
+    logging.getLogger().setLevel(logging.WARNING)
+    book_ids = [b for b in range(1, args.books + 1) if shard.shard_for(b, args.workers) == index]
+    reset_state(book_ids, users)
+    users_by_id = {user.id: user for user in users}
+    stub = StubBot()
+    samples = {name: [] for name in HANDLERS}
+    message_ids = itertools.count(1)
+    results.put(("ready", index))
+
+    async def drain():
+        while True:
+            batch = inbox.get()
+            if batch is None:
+                break
+            await ingest([(users_by_id[user_id], text) for user_id, text in batch], stub, samples, message_ids)
+
+    asyncio.run(drain())
+    results.put(("done", count_bets(), len(stub.calls), stub.errors, samples["handle_message"]))
+
+
+def run_sharded(args):
+    ctx = multiprocessing.get_context("spawn")
+    users, workload = make_workload(args.agents, args.slips, parse_range(args.lines), parse_mix(args.mix), args.seed, args.books)
+    inboxes = [ctx.Queue() for _ in range(args.workers)]
+    results = ctx.Queue()
+    workers = [ctx.Process(target=shard_worker, args=(i, args, users, inboxes[i], results)) for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        results.get()
+
+    # Batch per worker so IPC overhead stays proportional to the work
+    start = _time.perf_counter()
+    batches = [[] for _ in workers]
+    for user, text in workload:
+        index = shard.shard_for(user.book_id, args.workers)
+        batches[index].append((user.id, text))
+        if len(batches[index]) >= args.batch:
+            inboxes[index].put(batches[index])
+            batches[index] = []
+    for index, batch in enumerate(batches):
+        if batch:
+            inboxes[index].put(batch)
+        inboxes[index].put(None)
+
+    bets = calls = errors = 0
+    samples = {name: [] for name in HANDLERS}
+    for _ in workers:
+        _, worker_bets, worker_calls, worker_errors, latencies = results.get()
+        bets += worker_bets
+        calls += worker_calls
+        errors += worker_errors
+        samples["handle_message"].extend(latencies)
+    elapsed = _time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    return summarize(args, bets, elapsed, calls, errors, samples)
+
+
+def print_report(result):
+    print(f"agents={result['agents']} books={result['books']} workers={result['workers']} "
+          f"slips={result['slips']} bets={result['bets']} "
+          f"outgoing={result['outgoing_calls']} errors={result['errors']}")
+    print(f"ingest throughput: {result['bets_per_sec']:.0f} bets/sec")
+    print(f"{'handler':<18}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["handlers"].items():
+        print(f"{name:<18}{stats['calls']:>8}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+    if "snapshot" in result:
+        snap = result["snapshot"]
+        print(f"snapshot: {snap['bets']} bets, {snap['bytes'] / 1024:.0f} KB, capture {snap['capture_ms']:.1f} ms "
+              f"(on loop), write {snap['write_ms']:.1f} ms, restore {snap['restore_ms']:.1f} ms, "
+              f"identical={snap['identical']}")
+    if "lag" in result:
+        lag = result["lag"]
+        print(f"reports under load: {lag['reports_ms']:.0f} ms, {lag['slips_during']} slips taken meanwhile, "
+              f"loop lag p50 {lag['lag_p50_ms']:.1f} / p99 {lag['lag_p99_ms']:.1f} / max {lag['lag_max_ms']:.1f} ms")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline handler benchmark with synthetic agent traffic")
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--slips", type=int, default=2000)
+    parser.add_argument("--lines", default="1-8", help="lines per slip, e.g. 1-8")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="line kind weights: plain, r, htip, wheel")
+    parser.add_argument("--deletes", type=float, default=0.05, help="fraction of slips the admin deletes")
+    parser.add_argument("--upstreams", type=int, default=2)
+    parser.add_argument("--reports", type=int, default=5)
+    parser.add_argument("--books", type=int, default=1, help="independent dealer books")
+    parser.add_argument("--workers", type=int, default=1, help="shard ingest across this many processes")
+    parser.add_argument("--batch", type=int, default=50, help="slips per IPC message in sharded mode")
+    parser.add_argument("--snapshot", action="store_true", help="also time /backup and /restore on book 1")
+    parser.add_argument("--lag", action="store_true", help="measure event loop lag while reports run during ingest")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON for regression tracking")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = run_sharded(args) if args.workers > 1 else asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
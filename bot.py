@@ -1,17 +1,58 @@
 import os
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
     CallbackQueryHandler, ContextTypes, filters
 )
-from datetime import datetime, time, timedelta
+from datetime import datetime, time
 import pytz
 import re
 import calendar
+import shutil
+import csv
+import functools
+import hashlib
+import math
+import sys
+import tempfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import analytics
+import archive
+import audit
+import reports
+import snapshot
+
+try:
+    import openpyxl
+except ImportError:  # XLSX export is optional, CSV always works
+    openpyxl = None
 
 # Environment variable
 TOKEN = os.getenv("BOT_TOKEN")
+ALERT_DEBOUNCE = float(os.getenv("ALERT_DEBOUNCE", "5"))  # Seconds of quiet before a limit alert is sent
+ALERT_MAX_DELAY = float(os.getenv("ALERT_MAX_DELAY", "30"))  # Longest an alert waits during a flood
+BOARD_DEBOUNCE = float(os.getenv("BOARD_DEBOUNCE", "3"))  # Seconds of quiet before the live board is edited
+BOARD_MAX_DELAY = float(os.getenv("BOARD_MAX_DELAY", "15"))  # Longest the board lags the ledger during a flood
+CREDIT_WARN = int(os.getenv("CREDIT_WARN", "80"))  # Percent of a credit limit at which /credit lists an agent
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")  # Closed draws are moved here by /archive
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")  # Automatic snapshots taken before /reset
+# Draw segments as SEGMENT=open-cutoff in Myanmar time; the cutoffs also decide
+# which draw a bet belongs to. ARCHIVE_AT is when closed draws are archived.
+DRAW_SCHEDULE_SPEC = os.getenv("DRAW_SCHEDULE", "AM=06:00-12:00,PM=12:00-16:30")
+ARCHIVE_AT = os.getenv("ARCHIVE_AT", "03:00")
+# Reports are written in the default thread pool, or in this many worker
+# processes when set. LAG_WARN is the event loop delay that gets logged.
+REPORT_PROCESSES = int(os.getenv("REPORT_PROCESSES", "0"))
+LAG_INTERVAL = float(os.getenv("LAG_INTERVAL", "0.1"))
+LAG_WARN = float(os.getenv("LAG_WARN", "0.5"))
+AUDIT_LOG = os.getenv("AUDIT_LOG", "audit/audit.jsonl")  # JSON lines, see audit.py
+AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIT_BACKUPS = int(os.getenv("AUDIT_BACKUPS", "20"))
 
 # Logging
 logging.basicConfig(
@@ -23,97 +64,1309 @@ logger = logging.getLogger(__name__)
 # Timezone setup
 MYANMAR_TIMEZONE = pytz.timezone('Asia/Yangon')
 
-# Globals
-admin_id = None
-user_data = {}  # {username: {date_key: [(num, amt)]}}
-ledger = {}     # {date_key: {number: total_amount}}
-break_limits = {}  # {date_key: limit}
-pnumber_per_date = {}  # {date_key: power_number}
-date_control = {}  # {date_key: True/False}
-overbuy_list = {}  # {date_key: {username: {num: amount}}}
-message_store = {}  # {(user_id, message_id): (sent_message_id, bets, total_amount, date_key)}
-overbuy_selections = {}  # {date_key: {username: {num: amount}}}
-current_working_date = None  # For admin date selection
-
-# Com and Za data
-com_data = {}
-za_data = {}
+DEFAULT_ZA = archive.DEFAULT_ZA  # Same default dateall_view settles with
+
+def after_com(total, com):
+    return total - (total * com) // 100
+
+# Dealer net for all 100 possible results of one draw, kept up to date as bets
+# arrive. Agents have positive stakes, overbuy upstreams negative ones, so the
+# same formula covers both: net[n] = sum(after_com) - sum(stake[n] * za).
+class DrawRisk:
+    def __init__(self):
+        self.stakes = {}  # {username: [stake on 00..99]}
+        self.totals = {}  # {username: total stake}
+        self.base = 0     # Sum of each user's total after com
+        self.payout = [0] * 100  # Sum of stake * za per number
+
+    def add(self, username, num, amt, com, za):
+        stakes = self.stakes.get(username)
+        if stakes is None:
+            stakes = self.stakes[username] = [0] * 100
+        old_total = self.totals.get(username, 0)
+        new_total = old_total + amt
+        self.totals[username] = new_total
+        self.base += after_com(new_total, com) - after_com(old_total, com)
+        stakes[num] += amt
+        self.payout[num] += amt * za
+
+    def change_terms(self, username, old_com, old_za, com, za):
+        stakes = self.stakes.get(username)
+        if stakes is None:
+            return
+        total_amt = self.totals[username]
+        self.base += after_com(total_amt, com) - after_com(total_amt, old_com)
+        if za != old_za:
+            diff = za - old_za
+            payout = self.payout
+            for n, stake in enumerate(stakes):
+                if stake:
+                    payout[n] += stake * diff
+
+    def net(self):
+        base = self.base
+        return [base - p for p in self.payout]
+
+# Every overbuy lot bought for one draw, in purchase order. Each upstream's
+# per-number and overall totals are kept as lots are added, so settling an
+# upstream never walks its lots.
+class OverbuyBook:
+    def __init__(self):
+        self.lots = []    # [(seq, username, timestamp, {num: amount})]
+        self.totals = {}  # {username: {num: amount}} over all of the upstream's lots
+        self.sums = {}    # {username: total amount}
+
+    def add(self, seq, username, timestamp, nums):
+        self.lots.append((seq, username, timestamp, dict(nums)))
+        totals = self.totals.setdefault(username, {})
+        for num, amt in nums.items():
+            totals[num] = totals.get(num, 0) + amt
+        self.sums[username] = self.sums.get(username, 0) + sum(nums.values())
+
+    def settlement(self, pnum):
+        # {username: (total, stake on the power number)}
+        return {user: (total, self.totals[user].get(pnum, 0) if pnum is not None else 0)
+                for user, total in self.sums.items()}
+
+# Cheapest set of overbuys that keeps the dealer's worst result above -max_loss.
+# upstreams is [(name, com, za, cap)], cap being a total stake limit or None.
+# Buying x from an upstream costs x*(100-com)/100 on every result and pays x*za
+# back on its number, so each number is covered from the upstream with the
+# lowest cost per unit of payout first. The total cost itself lowers every
+# result, so the deficits are re-solved with the rounded plan's own cost until
+# hedge_result shows every result at or above -max_loss.
+def plan_hedge(net, upstreams, max_loss):
+    terms = sorted((u for u in upstreams if u[2] > 0), key=lambda u: (100 - u[1]) / u[2])
+    if not terms:
+        return None
+    settle = {name: (com, za) for name, com, za, _ in terms}
+    cost = 0.0
+    for _ in range(100):
+        deficit = [-max_loss - net[n] + cost for n in range(100)]
+        remaining = {name: cap for name, _, _, cap in terms}
+        plan = {name: {} for name, _, _, _ in terms}
+        new_cost = 0.0
+        for n in sorted(range(100), key=lambda n: -deficit[n]):
+            need = deficit[n]
+            if need <= 0:
+                break
+            for name, com, za, cap in terms:
+                stake = need / za
+                if cap is not None:
+                    stake = min(stake, remaining[name])
+                    remaining[name] -= stake
+                if stake <= 0:
+                    continue
+                plan[name][n] = stake
+                need -= stake * za
+                new_cost += stake * (100 - com) / 100
+                if need <= 1e-9:
+                    break
+            if need > 1e-9:
+                return None  # Caps exhausted
+        plan = {name: {n: math.ceil(v) for n, v in sorted(nums.items())} for name, nums in plan.items() if nums}
+        shortfall = -max_loss - min(hedge_result(net, plan, settle))
+        if shortfall <= 0:
+            return plan
+        # Re-solve for what the rounded plan really costs; if that is no more
+        # than was assumed, raise the assumed cost by the shortfall instead
+        paid = -sum(after_com(-sum(nums.values()), settle[name][0]) for name, nums in plan.items())
+        cost = paid if paid > cost else cost + shortfall
+    return None  # Cost keeps growing: too many numbers need cover
+
+def hedge_result(net, plan, terms):
+    # Dealer net per result after the plan, same rounding as DrawRisk
+    result = list(net)
+    for name, nums in plan.items():
+        com, za = terms[name]
+        paid = after_com(-sum(nums.values()), com)
+        for n in range(100):
+            result[n] += paid + nums.get(n, 0) * za
+    return result
+
+def overbuy_candidates(book, date_key, username):
+    # A /hedge plan for this upstream takes precedence over the break limit
+    draw = book.draws.get(date_key)
+    plan = draw.hedge_plans.get(username) if draw else None
+    if plan:
+        return dict(plan)
+    break_limit_val = book.break_limits[date_key]
+    ledger_data = book.draw_ledger(date_key)
+    return {num: amt - break_limit_val for num, amt in ledger_data.items() if amt > break_limit_val}
+
+# Runs callback once pokes have been quiet for `delay` seconds, or at most
+# `max_delay` after the first poke, so a flood of events yields one call.
+class Debouncer:
+    def __init__(self, delay, max_delay, callback):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.callback = callback
+        self.task = None
+        self.first = 0.0
+        self.last = 0.0
+
+    def poke(self):
+        now = asyncio.get_running_loop().time()
+        self.last = now
+        if self.task is None:
+            self.first = now
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                wait = min(self.last + self.delay, self.first + self.max_delay) - loop.time()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            self.task = None
+        try:
+            await self.callback()
+        except Exception as e:
+            logger.error(f"Error in debounced callback: {str(e)}")
+
+# Measures how late the event loop wakes a task that sleeps `interval`; any
+# handler that holds the loop shows up here as lag for every other update.
+class LoopMonitor:
+    def __init__(self, interval, window=600):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - started - self.interval
+            self.samples.append(lag)
+            if lag > LAG_WARN:
+                logger.warning(f"Event loop lag {lag * 1000:.0f} ms")
+
+    def stats(self):
+        # (p50, p99, max) lag in seconds over the window
+        if not self.samples:
+            return 0.0, 0.0, 0.0
+        ordered = sorted(self.samples)
+        return ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], ordered[-1]
+
+loop_monitor = LoopMonitor(LAG_INTERVAL)
+report_executors = {}  # {"process": ProcessPoolExecutor} once REPORT_PROCESSES is used
+
+async def run_report(fn, *args):
+    # Report builders take plain snapshots, so they are safe off the loop
+    executor = None
+    if REPORT_PROCESSES > 0:
+        executor = report_executors.get("process")
+        if executor is None:
+            executor = report_executors["process"] = ProcessPoolExecutor(REPORT_PROCESSES)
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+def deep_size(*roots):
+    # Deep size in bytes of everything reachable from roots, following
+    # containers and the attributes of plain and __slots__ objects
+    seen = set()
+    stack = list(roots)
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__slots__"):
+            stack.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+        elif hasattr(obj, "__dict__"):
+            stack.extend(vars(obj).values())
+    return size
+
+# Everything one live draw owns. Opening, deleting, archiving or snapshotting
+# a draw handles this one object, so none of it walks the book's other draws.
+class DrawBook:
+    __slots__ = ("bets", "ledger", "risk", "slips", "slip_index", "number_index",
+                 "overbuys", "overbuy_selections", "hedge_plans")
+
+    def __init__(self):
+        self.bets = {}  # {username: [(num, amt)]}
+        self.ledger = {}  # {number: total_amount}
+        self.risk = DrawRisk()
+        self.slips = {}  # {slip_id: (username, timestamp, [(num, amt)], is_overbuy)}
+        self.slip_index = {}  # {username: {slip_id: None}} in arrival order
+        self.number_index = {}  # {num: {slip_id: None}} slips that bet the number
+        self.overbuys = OverbuyBook()
+        self.overbuy_selections = {}  # {username: {num: amount}} on the /overbuy keyboard
+        self.hedge_plans = {}  # {username: {num: amount}} from /hedge
+
+    def memory_usage(self):
+        return deep_size(self)
+
+# Books: each dealer (admin) owns an isolated book with its own ledger, users,
+# limits, power numbers and com/za. Updates are routed by chat id in O(1).
+class Book:
+    def __init__(self, admin_id, chat_id):
+        self.admin_id = admin_id
+        self.chat_id = chat_id  # Chat the book was opened from
+        self.draws = {}  # {date_key: DrawBook} for draws that are not archived
+        self.break_limits = {}  # {date_key: limit}
+        self.pnumber_per_date = {}  # {date_key: power_number}
+        self.date_control = {}  # {date_key: True/False}
+        self.message_store = {}  # {(user_id, message_id): (sent_message_id, bets, total_amount, date_key, username)}
+        self.current_working_date = None  # For admin date selection
+        self.com_data = {}
+        self.za_data = {}
+        self.archives = {}  # {date_key: path} for draws moved to the columnar archive
+        self.overbuy_seq = 0  # Slip ids for overbuys are ("ob", seq)
+        self.number_caps = {}  # {date_key: max ledger total per number}
+        self.agent_caps = {}  # {date_key: max stake per agent per number}
+        self.alert_levels = [100]  # Percent of the break limit that triggers an alert
+        self.pending_alerts = {}  # {(date_key, num): (level, total)} waiting to be sent
+        self.chats = {chat_id}  # Chats routed to this book
+        self.auto_schedule = False  # Open/close/archive draws from DRAW_SCHEDULE
+        self.closed_at = {}  # {date_key: timestamp} bets sent before it still count
+        self.credit_limits = {}  # {username: max outstanding stake}
+        self.balances = {}  # {username: outstanding stake across live draws}
+        self.board = None  # (chat_id, message_id) of the pinned /board message
+        self.board_digest = None  # Hash of the text the board last showed
+
+    def draw(self, date_key):
+        # The live draw, created on first use
+        draw = self.draws.get(date_key)
+        if draw is None:
+            draw = self.draws[date_key] = DrawBook()
+        return draw
+
+    def prepare_draw(self, date_key):
+        # Created before the draw opens so the first slips don't pay for it
+        self.draw(date_key)
+
+    def track_risk(self, draw, username, num, amt):
+        draw.risk.add(username, num, amt, self.com_data.get(username, 0), self.za_data.get(username, DEFAULT_ZA))
+        # Every recorded or removed bet passes through here, so the balance stays O(1)
+        self.balances[username] = self.balances.get(username, 0) + amt
+
+    def drop_live_draw(self, date_key):
+        # Frees the draw's bulky state; settings like the power number stay.
+        # Costs the draw's own users and slips, whatever else the book holds
+        draw = self.draws.pop(date_key, None)
+        self.number_caps.pop(date_key, None)
+        self.agent_caps.pop(date_key, None)
+        for alert_key in [k for k in self.pending_alerts if k[0] == date_key]:
+            del self.pending_alerts[alert_key]
+        if draw is None:
+            return None
+        for username, total_amt in draw.risk.totals.items():
+            self.balances[username] = self.balances.get(username, 0) - total_amt
+        for slip_id in draw.slips:
+            self.message_store.pop(slip_id, None)
+        return draw
+
+    def add_slip(self, date_key, slip_id, username, timestamp, bets, is_overbuy=False):
+        draw = self.draw(date_key)
+        # Re-adding an edited slip keeps its place in both dicts
+        old = draw.slips.get(slip_id)
+        draw.slips[slip_id] = (username, timestamp, bets, is_overbuy)
+        draw.slip_index.setdefault(username, {})[slip_id] = None
+        if old is not None:
+            self.unindex_numbers(draw, slip_id, old[2])
+        self.index_numbers(draw, slip_id, bets)
+
+    def index_numbers(self, draw, slip_id, bets):
+        for num in {num for num, _ in bets}:
+            draw.number_index.setdefault(num, {})[slip_id] = None
+
+    def unindex_numbers(self, draw, slip_id, bets):
+        for num in {num for num, _ in bets}:
+            index = draw.number_index.get(num)
+            if index is not None:
+                index.pop(slip_id, None)
+                if not index:
+                    del draw.number_index[num]
+
+    def remove_slip(self, date_key, slip_id):
+        draw = self.draws.get(date_key)
+        if draw is None:
+            return
+        slip = draw.slips.pop(slip_id, None)
+        if slip is not None:
+            index = draw.slip_index.get(slip[0])
+            if index is not None:
+                index.pop(slip_id, None)
+                if not index:
+                    del draw.slip_index[slip[0]]
+            self.unindex_numbers(draw, slip_id, slip[2])
+
+    def remove_slips(self, date_key, slip_ids):
+        # Batched undo of agent slips: the ledger and risk are updated once per
+        # number and each user's bet list is rebuilt once, not once per bet
+        draw = self.draws.get(date_key)
+        if draw is None:
+            return 0, 0
+        removed = {}  # {username: Counter((num, amt))}
+        per_number = {}
+        count = 0
+        total_amt = 0
+        for slip_id in slip_ids:
+            slip = draw.slips.get(slip_id)
+            if slip is None or slip[3]:
+                continue
+            username, _, bets, _ = slip
+            counts = removed.setdefault(username, Counter())
+            for num, amt in bets:
+                counts[(num, amt)] += 1
+                per_number[num] = per_number.get(num, 0) + amt
+                total_amt += amt
+            self.message_store.pop(slip_id, None)
+            self.remove_slip(date_key, slip_id)
+            count += 1
+
+        ledger = draw.ledger
+        for num, amt in per_number.items():
+            if num in ledger:
+                ledger[num] -= amt
+                if ledger[num] <= 0:
+                    del ledger[num]
+
+        for username, counts in removed.items():
+            stakes = {}
+            for (num, amt), n in counts.items():
+                stakes[num] = stakes.get(num, 0) + amt * n
+            for num, amt in stakes.items():
+                self.track_risk(draw, username, num, -amt)
+            if username not in draw.bets:
+                continue
+            kept = []
+            for bet in draw.bets[username]:
+                if counts[bet] > 0:
+                    counts[bet] -= 1
+                else:
+                    kept.append(bet)
+            if kept:
+                draw.bets[username] = kept
+            else:
+                del draw.bets[username]
+        return count, total_amt
+
+    def record_bet(self, date_key, username, num, amt):
+        # Books one accepted agent bet; True if it crossed an alert level
+        draw = self.draw(date_key)
+        old_total = draw.ledger.get(num, 0)
+        draw.ledger[num] = old_total + amt
+        draw.bets.setdefault(username, []).append((num, amt))
+        self.track_risk(draw, username, num, amt)
+        return self.check_limit_alerts(date_key, num, old_total, old_total + amt)
+
+    def record_overbuy(self, date_key, username, nums, timestamp):
+        # Books one overbuy lot: the ledger goes down by it, the upstream's
+        # stakes go negative and the lot joins the draw's overbuy book
+        draw = self.draw(date_key)
+        bets = draw.bets.setdefault(username, [])
+        ledger = draw.ledger
+        for num, amt in nums.items():
+            bets.append((num, -amt))
+            self.track_risk(draw, username, num, -amt)
+            ledger[num] = ledger.get(num, 0) - amt
+            if ledger[num] <= 0:
+                del ledger[num]
+        self.overbuy_seq += 1
+        draw.overbuys.add(self.overbuy_seq, username, timestamp, nums)
+        self.add_slip(date_key, ("ob", self.overbuy_seq), username, timestamp, list(nums.items()), True)
+        return self.overbuy_seq
+
+    def retract_bets(self, date_key, username, counts):
+        # Takes back a Counter((num, amt)) of one user's bets. Matches are looked
+        # for from the newest end, where a recent slip's bets are, so an edit
+        # costs about the size of the slip rather than the user's whole draw
+        draw = self.draw(date_key)
+        ledger = draw.ledger
+        bets = draw.bets.get(username, [])
+        for (num, amt), n in counts.items():
+            self.track_risk(draw, username, num, -amt * n)
+            if num in ledger:
+                ledger[num] -= amt * n
+                if ledger[num] <= 0:
+                    del ledger[num]
+            i = len(bets) - 1
+            while n and i >= 0:
+                if bets[i] == (num, amt):
+                    del bets[i]
+                    n -= 1
+                i -= 1
+        if not bets:
+            draw.bets.pop(username, None)
+
+    def capped_amount(self, date_key, username, num, amt):
+        # How much of a bet fits under the draw's number and per-agent caps
+        allowed = amt
+        draw = self.draws.get(date_key)
+        cap = self.number_caps.get(date_key)
+        if cap is not None:
+            allowed = min(allowed, cap - (draw.ledger.get(num, 0) if draw else 0))
+        cap = self.agent_caps.get(date_key)
+        if cap is not None:
+            stakes = draw.risk.stakes.get(username) if draw else None
+            allowed = min(allowed, cap - (stakes[num] if stakes else 0))
+        return max(allowed, 0)
+
+    def check_limit_alerts(self, date_key, num, old_total, new_total):
+        limit = self.break_limits.get(date_key)
+        if limit is None:
+            return False
+        pending = self.pending_alerts.get((date_key, num))
+        if pending:
+            self.pending_alerts[(date_key, num)] = (pending[0], new_total)
+        crossed = False
+        for level in self.alert_levels:
+            if old_total <= limit * level // 100 < new_total:
+                self.pending_alerts[(date_key, num)] = (level, new_total)
+                crossed = True
+        return crossed
+
+    def draw_ledger(self, date_key):
+        # Read-only view of a draw's ledger, empty if the draw is not live
+        draw = self.draws.get(date_key)
+        return draw.ledger if draw else {}
+
+    def user_draws(self, username):
+        # {date_key: [(num, amt)]} of the user's live bets
+        return {date_key: draw.bets[username] for date_key, draw in self.draws.items() if username in draw.bets}
+
+    def users(self):
+        # Everyone with live bets, in the order they first appear
+        users = {}
+        for draw in self.draws.values():
+            users.update(dict.fromkeys(draw.bets))
+        return list(users)
+
+    def memory_usage(self):
+        # Deep size in bytes of everything the book owns
+        return deep_size(self)
+
+books = {}       # {admin_id: Book}
+chat_books = {}  # {chat_id: Book}
+
+EXPORT_HEADER = ["user", "draw", "number", "amount", "slip_id", "timestamp", "overbuy"]
+
+def parse_day(text):
+    return datetime.strptime(text, "%d/%m/%Y").date()
+
+def export_rows(draws):
+    # draws is [(date_key, [(slip_id, slip)])]; rows are produced one at a time
+    for date_key, slips in draws:
+        for slip_id, (username, timestamp, bets, is_overbuy) in slips:
+            slip_str = ":".join(str(part) for part in slip_id)
+            stamp = datetime.fromtimestamp(timestamp, MYANMAR_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+            for num, amt in bets:
+                yield [username, str(date_key), f"{num:02d}", amt, slip_str, stamp, "yes" if is_overbuy else "no"]
+
+def write_export(path, draws, fmt):
+    # Runs in a worker thread; rows are streamed straight to disk
+    count = 0
+    if fmt == "xlsx":
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet("bets")
+        sheet.append(EXPORT_HEADER)
+        for row in export_rows(draws):
+            sheet.append(row)
+            count += 1
+        workbook.save(path)
+    else:
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_HEADER)
+            for row in export_rows(draws):
+                writer.writerow(row)
+                count += 1
+    return count
+
+alert_debouncers = {}  # {admin_id: Debouncer}, kept off the Book so books stay picklable
+
+def schedule_limit_alerts(book, bot):
+    debouncer = alert_debouncers.get(book.admin_id)
+    if debouncer is None:
+        async def send():
+            await send_limit_alerts(book, bot)
+        debouncer = alert_debouncers[book.admin_id] = Debouncer(ALERT_DEBOUNCE, ALERT_MAX_DELAY, send)
+    debouncer.poke()
+
+async def send_limit_alerts(book, bot):
+    pending, book.pending_alerts = book.pending_alerts, {}
+    if not pending:
+        return
+    msg = []
+    for date_key in sorted({d for d, _ in pending}):
+        limit = book.break_limits.get(date_key)
+        if limit is None:
+            continue
+        for level in sorted(book.alert_levels, reverse=True):
+            nums = sorted(n for (d, n), (lvl, _) in pending.items() if d == date_key and lvl == level)
+            if not nums:
+                continue
+            if level >= 100:
+                msg.append(f"🚨 {date_key} Limit ({limit}) ကျော်ဂဏန်းများ:")
+            else:
+                msg.append(f"⚠️ {date_key} Limit ၏ {level}% ({limit * level // 100}) ကျော်ဂဏန်းများ:")
+            for num in nums:
+                total_amt = book.draw_ledger(date_key).get(num, 0)
+                msg.append(f"{num:02d} ➤ {total_amt} (+{max(total_amt - limit, 0)})")
+    if msg:
+        await bot.send_message(chat_id=book.chat_id, text="\n".join(msg))
+
+def ledger_lines(book, date_key):
+    # Body shared by /ledger and the live board; just the title if nothing is bet
+    lines = [f"📒 {date_key} လက်ကျန်ငွေစာရင်း"]
+    ledger_data = book.draw_ledger(date_key)
+    pnum = book.pnumber_per_date.get(date_key)
+    for i in range(100):
+        total = ledger_data.get(i, 0)
+        if total > 0:
+            if i == pnum:
+                lines.append(f"🔴 {i:02d} ➤ {total} 🔴")
+            else:
+                lines.append(f"{i:02d} ➤ {total}")
+    if len(lines) > 1 and pnum is not None:
+        lines.append(f"\n🔴 Power Number: {pnum:02d} ➤ {ledger_data.get(pnum, 0)}")
+    return lines
+
+def render_board(book):
+    date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+    lines = ledger_lines(book, date_key)
+    if len(lines) == 1:
+        lines.append("ℹ️ လောင်းကြေးမရှိသေးပါ")
+    else:
+        lines.append(f"💵 စုစုပေါင်း: {sum(book.draw_ledger(date_key).values())}")
+    return "📌 Live board\n" + "\n".join(lines)
+
+def board_digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+board_debouncers = {}  # {admin_id: Debouncer}, kept off the Book like alert_debouncers
+
+def schedule_board(book, bot):
+    if book.board is None:
+        return
+    debouncer = board_debouncers.get(book.admin_id)
+    if debouncer is None:
+        async def send():
+            await refresh_board(book, bot)
+        debouncer = board_debouncers[book.admin_id] = Debouncer(BOARD_DEBOUNCE, BOARD_MAX_DELAY, send)
+    debouncer.poke()
+
+async def refresh_board(book, bot):
+    if book.board is None:
+        return
+    text = render_board(book)
+    # Most pokes during a flood land on an unchanged view; those cost no API call
+    digest = board_digest(text)
+    if digest == book.board_digest:
+        return
+    chat_id, message_id = book.board
+    try:
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            # The board message is gone; stop editing it until /board is run again
+            logger.warning(f"Live board for book {book.admin_id} stopped: {str(e)}")
+            book.board = None
+            return
+    book.board_digest = digest
+
+def get_book(update):
+    chat = update.effective_chat
+    return chat_books.get(chat.id) if chat else None
+
+def open_book(admin_id, chat_id):
+    book = books.get(admin_id)
+    if book is None:
+        book = Book(admin_id, chat_id)
+        books[admin_id] = book
+    join_book(book, chat_id)
+    return book
+
+def join_book(book, chat_id):
+    current = chat_books.get(chat_id)
+    if current is not None and current is not book:
+        current.chats.discard(chat_id)
+    book.chats.add(chat_id)
+    chat_books[chat_id] = book
 
 def reverse_number(n):
     s = str(n).zfill(2)
     return int(s[::-1])
 
-def get_time_segment():
-    now = datetime.now(MYANMAR_TIMEZONE).time()
-    return "AM" if now < time(12, 0) else "PM"
-
-def get_current_date_key():
-    now = datetime.now(MYANMAR_TIMEZONE)
-    return f"{now.strftime('%d/%m/%Y')} {get_time_segment()}"
-
-def get_available_dates():
+def parse_schedule(spec):
+    # "AM=06:00-12:00,PM=12:00-16:30" -> [(segment, open, cutoff)] ordered by cutoff
+    schedule = []
+    for part in spec.split(","):
+        segment, _, times = part.strip().partition("=")
+        opens, _, closes = times.partition("-")
+        schedule.append((segment.strip().upper(), time.fromisoformat(opens.strip()), time.fromisoformat(closes.strip())))
+    return sorted(schedule, key=lambda entry: entry[2])
+
+DRAW_SCHEDULE = parse_schedule(DRAW_SCHEDULE_SPEC)
+
+SEGMENTS = [segment for segment, _, _ in DRAW_SCHEDULE]
+CUTOFF_SECONDS = [cutoff.hour * 3600 + cutoff.minute * 60 + cutoff.second + cutoff.microsecond / 1e6
+                  for _, _, cutoff in DRAW_SCHEDULE]
+# Myanmar time has no DST, so local days are plain arithmetic on timestamps
+MYANMAR_OFFSET = MYANMAR_TIMEZONE.utcoffset(datetime(2000, 1, 1)).total_seconds()
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+# Segment slots per day in a draw code, fixed so that adding a segment to
+# DRAW_SCHEDULE leaves the codes of existing draws as they were
+DRAW_SLOTS = 10
+if len(SEGMENTS) > DRAW_SLOTS:
+    raise ValueError(f"DRAW_SCHEDULE has more than {DRAW_SLOTS} segments")
+
+# A draw is one segment of one day, encoded as day ordinal * DRAW_SLOTS +
+# segment index. Being an int it hashes and orders chronologically and fits
+# in callback data; instances are interned so each draw exists once and its
+# day, segment and "dd/mm/YYYY AM" label are only worked out the first time.
+# The index is the segment's place in SEGMENTS, so anything that outlives the
+# process stores draws with their segment table (snapshots) or by day and
+# segment name (pickles, archive file names).
+class Draw(int):
+    _interned = {}
+
+    def __new__(cls, code):
+        draw = cls._interned.get(code)
+        if draw is None:
+            draw = super().__new__(cls, code)
+            ordinal, index = divmod(code, DRAW_SLOTS)
+            draw.day = datetime.fromordinal(ordinal).date()
+            draw.segment = SEGMENTS[index]
+            draw.label = f"{draw.day:%d/%m/%Y} {draw.segment}"
+            cls._interned[code] = draw
+        return draw
+
+    @classmethod
+    def of(cls, day, segment):
+        return cls(day.toordinal() * DRAW_SLOTS + SEGMENTS.index(segment.upper()))
+
+    @classmethod
+    def decode(cls, code, segments, slots=DRAW_SLOTS):
+        # A code written under another segment table, e.g. read from a snapshot
+        ordinal, index = divmod(code, slots)
+        if segments[index] not in SEGMENTS:
+            raise ValueError(f"segment {segments[index]} is not in DRAW_SCHEDULE")
+        return cls.of(datetime.fromordinal(ordinal).date(), segments[index])
+
+    @classmethod
+    def parse(cls, text):
+        # Accepts "dd/mm/YYYY AM" as typed by admins or the int code from callback data
+        text = text.strip()
+        if text.isdigit():
+            return cls(int(text))
+        day, segment = text.split()
+        return cls.of(parse_day(day), segment)
+
+    @classmethod
+    def at(cls, timestamp):
+        days, seconds = divmod(timestamp + MYANMAR_OFFSET, 86400)
+        index = next((i for i, cutoff in enumerate(CUTOFF_SECONDS) if seconds < cutoff), len(SEGMENTS) - 1)
+        return cls((EPOCH_ORDINAL + int(days)) * DRAW_SLOTS + index)
+
+    def with_segment(self, segment):
+        return Draw.of(self.day, segment)
+
+    @property
+    def cutoff(self):
+        # Timestamp at which the draw's segment closes
+        seconds = CUTOFF_SECONDS[SEGMENTS.index(self.segment)]
+        return (self.day.toordinal() - EPOCH_ORDINAL) * 86400 + seconds - MYANMAR_OFFSET
+
+    def __str__(self):
+        return self.label
+
+    def __repr__(self):
+        return f"Draw({self.label})"
+
+    def __format__(self, spec):
+        return format(self.label, spec)
+
+    def __reduce__(self):
+        return draw_of_ordinal, (self.day.toordinal(), self.segment)
+
+    def __setstate__(self, state):
+        # Older pickles carry day and segment as state; the code already has them
+        pass
+
+def draw_of_ordinal(ordinal, segment):
+    return Draw.of(datetime.fromordinal(ordinal).date(), segment)
+
+    def __reduce__(self):
+        # Unpickled draws go back through the intern table
+        return (Draw, (int(self),))
+
+def get_current_date_key(now=None):
+    # now may be any aware datetime, e.g. the Telegram send time of a message
+    return Draw.at(now.timestamp() if now else datetime.now().timestamp())
+
+def draw_is_open(book, date_key, sent_at):
+    # Judged by when the message was sent, so a slip racing the cutoff gets the
+    # same answer whether it is handled before or after the close job runs
+    if date_key in book.archives:
+        return False
+    closed_at = book.closed_at.get(date_key)
+    if closed_at is not None:
+        return sent_at < closed_at
+    if not book.date_control.get(date_key, False):
+        return False
+    if book.auto_schedule:
+        return sent_at < date_key.cutoff
+    return True
+
+def get_available_dates(book):
     dates = set()
-    # Get dates from user data
-    for user_data_dict in user_data.values():
-        dates.update(user_data_dict.keys())
-    # Get dates from ledger
-    dates.update(ledger.keys())
+    # Get dates from live draws
+    dates.update(book.draws.keys())
     # Get dates from break limits
-    dates.update(break_limits.keys())
+    dates.update(book.break_limits.keys())
     # Get dates from pnumber
-    dates.update(pnumber_per_date.keys())
+    dates.update(book.pnumber_per_date.keys())
+    # Get dates from archived draws
+    dates.update(book.archives.keys())
     return sorted(dates, reverse=True)
 
+def history_draws(book, username, only=None):
+    # /posthis input for reports.history_report: live draws, then archived ones
+    draws = []
+    for date_key, bets in book.user_draws(username).items():
+        if only is None or date_key == only:
+            draws.append((str(date_key), book.pnumber_per_date.get(date_key), tuple(bets)))
+    for date_key, path in book.archives.items():
+        if only is None or date_key == only:
+            draws.append((str(date_key), book.pnumber_per_date.get(date_key), path))
+    return draws
+
+def known_users(book):
+    users = dict.fromkeys(book.users())
+    for path in book.archives.values():
+        users.update(dict.fromkeys(archive.load_draw(path).usernames))
+    return list(users)
+
+def draw_overbuy_list(book, date_key):
+    # {upstream: {num: amount}} summed over every lot of the draw
+    if date_key in book.draws:
+        return book.draws[date_key].overbuys.totals
+    if date_key in book.archives:
+        return reports.archived_overbuy_totals(archive.load_draw(book.archives[date_key]))
+    return {}
+
+def archive_path(book, date_key):
+    return os.path.join(ARCHIVE_DIR, str(book.admin_id), f"{date_key.day:%d-%m-%Y}_{date_key.segment}.draw")
+
+# Snapshots store draws as their int codes and only builtin containers; the
+# risk vectors and slip indexes are not stored but rebuilt on restore.
+PER_DRAW_SETTINGS = ["break_limits", "pnumber_per_date", "date_control", "closed_at", "number_caps", "agent_caps"]
+PER_DRAW_STORES = ["ledger", "overbuy_selections", "hedge_plans"]
+
+async def capture_book(book):
+    # Shallow copies taken on the loop one draw at a time; handlers can run in
+    # between, but each draw is copied whole so it is consistent in itself
+    settings = {
+        "admin_id": book.admin_id,
+        "chat_id": book.chat_id,
+        "chats": set(book.chats),
+        "com_data": dict(book.com_data),
+        "za_data": dict(book.za_data),
+        "alert_levels": list(book.alert_levels),
+        "overbuy_seq": book.overbuy_seq,
+        "auto_schedule": book.auto_schedule,
+        "credit_limits": dict(book.credit_limits),
+        "current_working_date": int(book.current_working_date) if book.current_working_date else None,
+        "segments": list(SEGMENTS),
+    }
+    for name in PER_DRAW_SETTINGS:
+        settings[name] = {int(k): v for k, v in getattr(book, name).items()}
+
+    stored = {}
+    for slip_key, (sent_message_id, bets, total_amount, date_key, username) in book.message_store.items():
+        stored.setdefault(date_key, []).append((slip_key, (sent_message_id, bets, total_amount, username)))
+
+    draws = []
+    for date_key in sorted(book.draws):
+        live = book.draws.get(date_key)
+        if live is None:
+            # Dropped while an earlier draw was being copied
+            continue
+        draw = {"draw": int(date_key)}
+        draw["user_data"] = {user: list(bets) for user, bets in live.bets.items()}
+        for name in PER_DRAW_STORES:
+            value = getattr(live, name)
+            if value:
+                draw[name] = {k: dict(v) if isinstance(v, dict) else v for k, v in value.items()}
+        if live.overbuys.lots:
+            draw["overbuy_lots"] = [(seq, user, timestamp, dict(nums)) for seq, user, timestamp, nums in live.overbuys.lots]
+        draw["slips"] = dict(live.slips)
+        draw["message_store"] = stored.get(date_key, [])
+        draws.append(draw)
+        await asyncio.sleep(0)
+    return settings, draws, {int(k): path for k, path in book.archives.items()}
+
+def snapshot_frames(settings, draws, archives):
+    # Runs in a worker thread; archived draws travel inside the snapshot
+    yield ("book", settings)
+    for draw in draws:
+        yield ("draw", draw)
+    for code, path in archives.items():
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                yield ("archive", code, f.read())
+    yield ("end", len(draws), len(archives))
+
+async def write_book_snapshot(book, path):
+    settings, draws, archives = await capture_book(book)
+    size = await asyncio.to_thread(snapshot.write_snapshot, path, snapshot_frames(settings, draws, archives))
+    return size, sum(len(d["slips"]) for d in draws)
+
+def restore_book(path, staging):
+    return build_book(snapshot.read_snapshot(path), staging)
+
+def build_book(frames, staging):
+    # Builds a fresh Book off the loop; the caller swaps it in. Archive files
+    # are only written into staging; install_book moves them to their paths,
+    # so a snapshot that is cut short or not the caller's touches nothing
+    book = None
+    staged = []  # [(staged path, archive path)]
+    complete = False
+    for frame in frames:
+        kind = frame[0]
+        if kind == "book":
+            settings = frame[1]
+            # Codes are read with the segment table they were written under;
+            # snapshots without one used len(SEGMENTS) slots per day
+            if "segments" in settings:
+                decode = functools.partial(Draw.decode, segments=settings["segments"])
+            else:
+                decode = functools.partial(Draw.decode, segments=SEGMENTS, slots=len(SEGMENTS))
+            book = Book(settings["admin_id"], settings["chat_id"])
+            book.chats = set(settings["chats"])
+            book.com_data = settings["com_data"]
+            book.za_data = settings["za_data"]
+            book.alert_levels = settings["alert_levels"]
+            book.overbuy_seq = settings["overbuy_seq"]
+            book.auto_schedule = settings["auto_schedule"]
+            book.credit_limits = settings.get("credit_limits", {})
+            if settings["current_working_date"] is not None:
+                book.current_working_date = decode(settings["current_working_date"])
+            for name in PER_DRAW_SETTINGS:
+                setattr(book, name, {decode(k): v for k, v in settings[name].items()})
+        elif book is None:
+            raise ValueError("snapshot has no book header")
+        elif kind == "draw":
+            draw = frame[1]
+            date_key = decode(draw["draw"])
+            live = book.draw(date_key)
+            for user, bets in draw["user_data"].items():
+                live.bets[user] = bets
+                for num, amt in bets:
+                    book.track_risk(live, user, num, amt)
+            for name in PER_DRAW_STORES:
+                if name in draw:
+                    setattr(live, name, draw[name])
+            if "overbuy_lots" in draw:
+                for seq, user, timestamp, nums in draw["overbuy_lots"]:
+                    live.overbuys.add(seq, user, timestamp, nums)
+            elif draw.get("overbuy_list"):
+                # Older snapshots kept one entry per upstream
+                for user, nums in draw["overbuy_list"].items():
+                    live.overbuys.add(0, user, None, nums)
+            live.slips = draw["slips"]
+            for slip_id, slip in draw["slips"].items():
+                live.slip_index.setdefault(slip[0], {})[slip_id] = None
+                book.index_numbers(live, slip_id, slip[2])
+            for slip_key, (sent_message_id, bets, total_amount, username) in draw["message_store"]:
+                book.message_store[slip_key] = (sent_message_id, bets, total_amount, date_key, username)
+        elif kind == "archive":
+            date_key = decode(frame[1])
+            path = archive_path(book, date_key)
+            staged_path = os.path.join(staging, str(int(date_key)))
+            with open(staged_path, "wb") as f:
+                f.write(frame[2])
+            staged.append((staged_path, path))
+            book.archives[date_key] = path
+        elif kind == "end":
+            complete = True
+    if not complete:
+        raise ValueError("snapshot is incomplete")
+    return book, staged
+
+def install_book(book, staged=()):
+    old = books.get(book.admin_id)
+    if old is not None:
+        for chat_id in old.chats:
+            if chat_books.get(chat_id) is old:
+                del chat_books[chat_id]
+    books[book.admin_id] = book
+    for chat_id in book.chats:
+        join_book(book, chat_id)
+    for staged_path, path in staged:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged_path, path)
+    # Restored archive files replace whatever was at their paths
+    for path in set(book.archives.values()) | set(old.archives.values() if old else ()):
+        archive.forget(path)
+        analytics.forget(path)
+
 async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    book = get_book(update)
     keyboard = []
-    if update.effective_user.id == admin_id:
+    if book and update.effective_user.id == book.admin_id:
         keyboard = [
-            ["/dateopen", "/dateclose"],
-            ["/ledger", "/break"],
-            ["/overbuy", "/pnumber"],
-            ["/comandza", "/total"],
-            ["/tsent", "/alldata"],
+            ["/dateopen", "/dateclose", "/schedule"],
+            ["/ledger", "/board", "/break", "/alert"],
+            ["/undo", "/rollback"],
+            ["/cap", "/agentcap", "/credit"],
+            ["/overbuy", "/hedge", "/pnumber"],
+            ["/comandza", "/total", "/risk"],
+            ["/tsent", "/alldata", "/export"],
             ["/reset", "/posthis", "/dateall"],
-            ["/Cdate", "/Ddate"]
+            ["/Cdate", "/Ddate", "/archive", "/bookinfo"],
+            ["/heat", "/volume", "/pnl", "/find", "/audit"],
+            ["/backup", "/restore"]
         ]
     else:
         keyboard = [
-            ["/posthis"]
+            ["/posthis", "/find"]
         ]
     
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     await update.message.reply_text("မီနူးကိုရွေးချယ်ပါ", reply_markup=reply_markup)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, current_working_date
-    admin_id = update.effective_user.id
-    current_working_date = get_current_date_key()
-    logger.info(f"Admin set to: {admin_id}")
-    await update.message.reply_text("🤖 Bot started. Admin privileges granted!")
+    book = get_book(update)
+    if book and update.effective_user.id != book.admin_id:
+        # Chat already belongs to another dealer's book
+        await show_menu(update, context)
+        return
+        
+    book = open_book(update.effective_user.id, update.effective_chat.id)
+    book.current_working_date = get_current_date_key()
+    logger.info("Admin set to: %s (chat %s)", book.admin_id, update.effective_chat.id)
+    await update.message.reply_text(f"🤖 Bot started. Admin privileges granted!\n📒 Book ID: {book.admin_id}\nAgent များ /join {book.admin_id} ဖြင့်ချိတ်ဆက်နိုင်ပါသည်")
     await show_menu(update, context)
 
+async def join(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if not context.args:
+            await update.message.reply_text("ℹ️ Usage: /join [book id]")
+            return
+            
+        try:
+            book = books.get(int(context.args[0]))
+        except ValueError:
+            book = None
+        if not book:
+            await update.message.reply_text("❌ Book မတွေ့ပါ")
+            return
+            
+        current = get_book(update)
+        if current and current.admin_id == update.effective_user.id and current is not book:
+            await update.message.reply_text("❌ Admin ၏ chat ကို အခြား book သို့မချိတ်နိုင်ပါ")
+            return
+        # A group already bound to a dealer stays with them; only a private chat
+        # can be moved, since its one member is the one asking
+        if current and current is not book and update.effective_chat.type != "private":
+            await update.message.reply_text(f"❌ ဤ chat သည် Book {current.admin_id} နှင့်ချိတ်ထားပြီးဖြစ်သည်")
+            return
+            
+        join_book(book, update.effective_chat.id)
+        logger.info("Chat %s joined book %s", update.effective_chat.id, book.admin_id)
+        await update.message.reply_text(f"✅ Book {book.admin_id} နှင့်ချိတ်ဆက်ပြီးပါပြီ")
+        await show_menu(update, context)
+    except Exception as e:
+        logger.error(f"Error in join: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def bookinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        bets = sum(len(bets) for draw in book.draws.values() for bets in draw.bets.values())
+        lag_p50, lag_p99, lag_max = loop_monitor.stats()
+        draw_lines = "".join(f"   • {date_key}: {draw.memory_usage() / 1024:.1f} KB\n"
+                             for date_key, draw in sorted(book.draws.items()))
+        await update.message.reply_text(
+            f"📒 Book ID: {book.admin_id}\n"
+            f"💬 Chats: {len(book.chats)}\n"
+            f"👥 Users: {len(book.users())}\n"
+            f"📅 Dates: {len(get_available_dates(book))}\n"
+            f"🗄 Archived: {len(book.archives)}\n"
+            f"🎫 Bets: {bets}\n"
+            f"💾 Memory: {book.memory_usage() / 1024:.1f} KB\n"
+            f"{draw_lines}"
+            f"📚 Books in process: {len(books)}\n"
+            f"⏱ Loop lag p50/p99/max: {lag_p50 * 1000:.1f}/{lag_p99 * 1000:.1f}/{lag_max * 1000:.1f} ms"
+        )
+    except Exception as e:
+        logger.error(f"Error in bookinfo: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        if context.args:
+            choice = context.args[0].lower()
+            if choice not in ("on", "off"):
+                await update.message.reply_text("⚠️ Usage: /schedule [on|off]")
+                return
+            book.auto_schedule = choice == "on"
+            
+        msg = [f"⏰ Auto schedule: {'ON' if book.auto_schedule else 'OFF'}"]
+        for segment, opens, cutoff in DRAW_SCHEDULE:
+            msg.append(f"{segment} ➤ {opens.strftime('%H:%M')} ဖွင့် / {cutoff.strftime('%H:%M')} ပိတ်")
+        msg.append(f"🗄 Archive: {ARCHIVE_AT}")
+        await update.message.reply_text("\n".join(msg))
+    except Exception as e:
+        logger.error(f"Error in schedule: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def notify_book(bot, book, text):
+    try:
+        await bot.send_message(chat_id=book.chat_id, text=text)
+    except Exception as e:
+        logger.error(f"Error notifying book {book.admin_id}: {str(e)}")
+
+async def open_scheduled_draws(context: ContextTypes.DEFAULT_TYPE):
+    segment = context.job.data
+    key = Draw.of(datetime.now(MYANMAR_TIMEZONE).date(), segment)
+    for book in list(books.values()):
+        if not book.auto_schedule or book.date_control.get(key) or key in book.archives:
+            continue
+        book.prepare_draw(key)
+        book.date_control[key] = True
+        book.closed_at.pop(key, None)
+        audit.record("dateopen", book=book.admin_id, draw=str(key), by="schedule")
+        logger.info(f"Ledger opened for {key} (book {book.admin_id}, scheduled)")
+        await notify_book(context.bot, book, f"✅ {key} စာရင်းဖွင့်ပြီးပါပြီ (auto)")
+
+async def close_scheduled_draws(context: ContextTypes.DEFAULT_TYPE):
+    segment = context.job.data
+    key = Draw.of(datetime.now(MYANMAR_TIMEZONE).date(), segment)
+    # Closed at the configured cutoff, not whenever this job got to run
+    cutoff = key.cutoff
+    for book in list(books.values()):
+        if not book.auto_schedule or not book.date_control.get(key):
+            continue
+        book.date_control[key] = False
+        book.closed_at[key] = cutoff
+        audit.record("dateclose", book=book.admin_id, draw=str(key), closed_at=cutoff, by="schedule")
+        logger.info(f"Ledger closed for {key} (book {book.admin_id}, scheduled)")
+        await notify_book(context.bot, book, f"✅ {key} စာရင်းပိတ်လိုက်ပါပြီ (auto)")
+
+async def archive_closed_draws(context: ContextTypes.DEFAULT_TYPE):
+    # Off-peak: closed draws go to the archive, empty pre-created ones are dropped
+    for book in list(books.values()):
+        if not book.auto_schedule:
+            continue
+        for date_key in list(book.draws):
+            if book.date_control.get(date_key, False) or date_key in book.archives:
+                continue
+            try:
+                if book.draws[date_key].slips:
+                    await archive_draw(book, date_key)
+                else:
+                    book.drop_live_draw(date_key)
+            except Exception as e:
+                logger.error(f"Error archiving {date_key} for book {book.admin_id}: {str(e)}")
+
+def schedule_draw_jobs(job_queue):
+    for segment, opens, cutoff in DRAW_SCHEDULE:
+        job_queue.run_daily(open_scheduled_draws, opens.replace(tzinfo=MYANMAR_TIMEZONE), data=segment, name=f"open {segment}")
+        job_queue.run_daily(close_scheduled_draws, cutoff.replace(tzinfo=MYANMAR_TIMEZONE), data=segment, name=f"close {segment}")
+    job_queue.run_daily(archive_closed_draws, time.fromisoformat(ARCHIVE_AT).replace(tzinfo=MYANMAR_TIMEZONE), name="archive")
+
 async def dateopen(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
-    if update.effective_user.id != admin_id:
+    book = get_book(update)
+    if not book or update.effective_user.id != book.admin_id:
         await update.message.reply_text("❌ Admin only command")
         return
         
     key = get_current_date_key()
-    date_control[key] = True
+    book.prepare_draw(key)
+    book.date_control[key] = True
+    book.closed_at.pop(key, None)
+    audit.record("dateopen", book=book.admin_id, draw=str(key), by=update.effective_user.id)
     logger.info(f"Ledger opened for {key}")
     await update.message.reply_text(f"✅ {key} စာရင်းဖွင့်ပြီးပါပြီ")
 
 async def dateclose(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
-    if update.effective_user.id != admin_id:
+    book = get_book(update)
+    if not book or update.effective_user.id != book.admin_id:
         await update.message.reply_text("❌ Admin only command")
         return
         
     key = get_current_date_key()
-    date_control[key] = False
+    book.date_control[key] = False
+    book.closed_at[key] = update.message.date.timestamp()
+    audit.record("dateclose", book=book.admin_id, draw=str(key), closed_at=book.closed_at[key], by=update.effective_user.id)
     logger.info(f"Ledger closed for {key}")
     await update.message.reply_text(f"✅ {key} စာရင်းပိတ်လိုက်ပါပြီ")
 
+SPECIAL_SETS = {
+    "အပူး": [0, 11, 22, 33, 44, 55, 66, 77, 88, 99],
+    "ပါဝါ": [5, 16, 27, 38, 49, 50, 61, 72, 83, 94],
+    "နက္ခ": [7, 18, 24, 35, 42, 53, 69, 70, 81, 96],
+    "ညီကို": [1, 12, 23, 34, 45, 56, 67, 78, 89, 90],
+    "ကိုညီ": [9, 10, 21, 32, 43, 54, 65, 76, 87, 98],
+}
+DYNAMIC_TYPES = ("ထိပ်", "ပိတ်", "ဘရိတ်", "အပါ")
+WHEEL_TYPES = ("အပူးပါအခွေ", "အခွေ")
+
+# Every keyword in one alternation, longest first so အပူးပါအခွေ is never read
+# as အပူး; a line is tokenized in a single left-to-right scan. Anything that
+# is not a digit run, a keyword or a standalone r/R is a separator.
+BET_TOKEN = re.compile(
+    r"(?P<num>\d+)|(?P<kw>"
+    + "|".join(sorted(list(SPECIAL_SETS) + list(DYNAMIC_TYPES) + list(WHEEL_TYPES), key=len, reverse=True))
+    + r")|(?<![A-Za-z])(?P<r>[rR])(?![A-Za-z])"
+)
+
+REVERSED = [reverse_number(n) for n in range(100)]
+BET_LABELS = [f"{n:02d}-" for n in range(100)]
+
+def dynamic_numbers(dtype, digit):
+    if dtype == "ထိပ်":
+        return [digit * 10 + j for j in range(10)]
+    if dtype == "ပိတ်":
+        return [j * 10 + digit for j in range(10)]
+    if dtype == "ဘရိတ်":
+        return [n for n in range(100) if (n // 10 + n % 10) % 10 == digit]
+    return sorted({digit * 10 + j for j in range(10)} | {j * 10 + digit for j in range(10)})
+
+@functools.lru_cache(maxsize=1024)
+def wheel_numbers(wtype, base):
+    # Every ordered pair of distinct positions; အပူးပါအခွေ adds the doubles
+    pairs = []
+    for i in range(len(base)):
+        for j in range(len(base)):
+            if i != j:
+                num = int(base[i] + base[j])
+                if num not in pairs:
+                    pairs.append(num)
+    if wtype == "အပူးပါအခွေ":
+        for d in base:
+            if int(d + d) not in pairs:
+                pairs.append(int(d + d))
+    return tuple(pairs)
+
+def expand_group(numbers, amounts, reverse):
+    if not numbers or not amounts:
+        return []
+    if not reverse:
+        return [(num, amounts[0]) for num in numbers]
+    # r/R: the number and its reverse, with a second amount for the reverse if given
+    second = amounts[-1]
+    bets = []
+    for num in numbers:
+        bets.append((num, amounts[0]))
+        bets.append((REVERSED[num], second))
+    return bets
+
+def line_bets(line):
+    # A line is a run of groups: numbers (plain, or from a special set,
+    # ထိပ်/ပိတ်/ဘရိတ်/အပါ or a wheel) followed by an amount of 100 or more,
+    # or by r/R and one or two amounts. A number after the amount starts the
+    # next group, so "5ထိပ် 1000 7ပိတ် 500" is two groups.
+    tokens = [(m.lastgroup, m.group(), m.start(), m.end()) for m in BET_TOKEN.finditer(line)]
+    bets = []
+    numbers = []
+    digits = []  # the group's numbers as typed, for a wheel base
+    amounts = []
+    reverse = False
+    wheel = False  # a wheel's amount is the next number, whatever its size
+
+    for i, (kind, text, start, _) in enumerate(tokens):
+        prev = tokens[i - 1] if i else None
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+
+        if kind == "num":
+            value = int(text)
+            if wheel:
+                if value:
+                    amounts = [value]
+                else:
+                    numbers, digits = [], []
+                wheel = False
+            elif nxt and nxt[1] in WHEEL_TYPES:
+                if amounts:
+                    bets += expand_group(numbers, amounts, reverse)
+                    numbers, digits, amounts, reverse = [], [], [], False
+                digits.append(text)
+            elif value <= 99:
+                if amounts:
+                    bets += expand_group(numbers, amounts, reverse)
+                    numbers, digits, amounts, reverse = [], [], [], False
+                numbers.append(value)
+                digits.append(text)
+            elif not reverse:
+                amounts = [value]
+            elif len(amounts) < 2:
+                amounts.append(value)
+            continue
+
+        if wheel:
+            # A wheel with no amount is skipped
+            numbers, digits, amounts, reverse, wheel = [], [], [], False, False
+
+        if kind == "r":
+            if not numbers:
+                amounts = []
+            elif not (amounts and prev[0] == "num" and prev[3] == start):
+                # "1000r500" keeps the amount before r; otherwise amounts follow r
+                amounts = []
+            reverse = True
+            continue
+
+        if amounts:
+            bets += expand_group(numbers, amounts, reverse)
+            numbers, digits, amounts, reverse = [], [], [], False
+
+        if text in WHEEL_TYPES:
+            numbers = list(wheel_numbers(text, "".join(digits)))
+            digits = []
+            wheel = True
+        elif text in SPECIAL_SETS:
+            numbers += SPECIAL_SETS[text]
+        elif prev and prev[0] == "num" and len(prev[1]) == 1 and digits:
+            # ထိပ်/ပိတ်/ဘရိတ်/အပါ take the single digit just before them
+            digits.pop()
+            numbers += dynamic_numbers(text, numbers.pop())
+        else:
+            # "12ထိပ်" and the like can't be read; drop the group rather than guess
+            numbers, digits = [], []
+
+    if not wheel:
+        bets += expand_group(numbers, amounts, reverse)
+    return bets
+
+def parse_bets(text):
+    # Turns a slip's text into ["NN-amount"] bets and their total
+    all_bets = []
+    total_amount = 0
+    for line in text.split('\n'):
+        for num, amt in line_bets(line):
+            all_bets.append(BET_LABELS[num] + str(amt))
+            total_amount += amt
+    return all_bets, total_amount
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
@@ -123,8 +1376,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ ကျေးဇူးပြု၍ Telegram username သတ်မှတ်ပါ")
             return
 
-        key = get_current_date_key()
-        if not date_control.get(key, False):
+        book = get_book(update)
+        if not book:
+            await update.message.reply_text("❌ Book နှင့်မချိတ်ရသေးပါ။ /join [book id] ဖြင့်ချိတ်ပါ")
+            return
+
+        # The draw is picked by send time, not by when the update reaches us
+        key = get_current_date_key(update.message.date)
+        if not draw_is_open(book, key, update.message.date.timestamp()):
             await update.message.reply_text("❌ စာရင်းပိတ်ထားပါသည်")
             return
 
@@ -132,253 +1391,234 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⚠️ မက်ဆေ့ဂျ်မရှိပါ")
             return
 
-        # Process the message line by line
-        lines = text.split('\n')
-        all_bets = []
-        total_amount = 0
-
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-
-            # Check for wheel cases first (your requested implementation)
-            if 'အခွေ' in line or 'အပူးပါအခွေ' in line:
-                # Extract base numbers and amount
-                if 'အခွေ' in line:
-                    parts = line.split('အခွေ')
-                    base_part = parts[0]
-                    amount_part = parts[1]
-                else:
-                    parts = line.split('အပူးပါအခွေ')
-                    base_part = parts[0]
-                    amount_part = parts[1]
-                
-                # Clean base numbers (remove all non-digits)
-                base_numbers = ''.join([c for c in base_part if c.isdigit()])
-                
-                # Clean amount (remove all non-digits)
-                amount = int(''.join([c for c in amount_part if c.isdigit()]))
-                
-                # Generate all possible pairs
-                pairs = []
-                for i in range(len(base_numbers)):
-                    for j in range(len(base_numbers)):
-                        if i != j:
-                            num = int(base_numbers[i] + base_numbers[j])
-                            if num not in pairs:
-                                pairs.append(num)
-                
-                # If အပူးပါအခွေ, add doubles
-                if 'အပူးပါအခွေ' in line:
-                    for d in base_numbers:
-                        double = int(d + d)
-                        if double not in pairs:
-                            pairs.append(double)
-                
-                # Add all bets
-                for num in pairs:
-                    all_bets.append(f"{num:02d}-{amount}")
-                    total_amount += amount
-                continue
-
-            # Check for special cases
-            special_cases = {
-                "အပူး": [0, 11, 22, 33, 44, 55, 66, 77, 88, 99],
-                "ပါဝါ": [5, 16, 27, 38, 49, 50, 61, 72, 83, 94],
-                "နက္ခ": [7, 18, 24, 35, 42, 53, 69, 70, 81, 96],
-                "ညီကို": [1, 12, 23, 34, 45, 56, 67, 78, 89, 90],
-                "ကိုညီ": [9, 10, 21, 32, 43, 54, 65, 76, 87, 98],
-            }
-
-            dynamic_types = ["ထိပ်", "ပိတ်", "ဘရိတ်", "အပါ"]
-            
-            # Check for special cases
-            found_special = False
-            for case_name, case_numbers in special_cases.items():
-                if line.startswith(case_name):
-                    parts = line.split()
-                    if len(parts) >= 2 and parts[1].isdigit() and int(parts[1]) >= 100:
-                        amt = int(parts[1])
-                        for num in case_numbers:
-                            all_bets.append(f"{num:02d}-{amt}")
-                            total_amount += amt
-                        found_special = True
-                        break
-            
-            if found_special:
-                continue
-
-            # Check for dynamic types
-            for dtype in dynamic_types:
-                if dtype in line:
-                    parts = line.split()
-                    for part in parts:
-                        if dtype in part:
-                            prefix = part.replace(dtype, '')
-                            if prefix.isdigit():
-                                digit_val = int(prefix)
-                                if 0 <= digit_val <= 9:
-                                    numbers = []
-                                    if dtype == "ထိပ်":
-                                        numbers = [digit_val * 10 + j for j in range(10)]
-                                    elif dtype == "ပိတ်":
-                                        numbers = [j * 10 + digit_val for j in range(10)]
-                                    elif dtype == "ဘရိတ်":
-                                        numbers = [n for n in range(100) if (n//10 + n%10) % 10 == digit_val]
-                                    elif dtype == "အပါ":
-                                        tens = [digit_val * 10 + j for j in range(10)]
-                                        units = [j * 10 + digit_val for j in range(10)]
-                                        numbers = list(set(tens + units))
-                                    
-                                    if len(parts) > parts.index(part) + 1 and parts[parts.index(part) + 1].isdigit() and int(parts[parts.index(part) + 1]) >= 100:
-                                        amt = int(parts[parts.index(part) + 1])
-                                        for num in numbers:
-                                            all_bets.append(f"{num:02d}-{amt}")
-                                            total_amount += amt
-                                        found_special = True
-                                    break
-                    if found_special:
-                        break
-            
-            if found_special:
-                continue
-
-            # Process regular number-amount pairs with r/R
-            if 'r' in line.lower():
-                # Split the line into parts
-                parts = re.split(r'[,\s\-+.,=*/\r]', line)
-                parts = [p.strip() for p in parts if p.strip()]
-                
-                # Find the r/R position
-                r_pos = -1
-                for i, part in enumerate(parts):
-                    if 'r' in part.lower():
-                        r_pos = i
-                        break
-                
-                if r_pos == -1:
-                    continue
-                
-                # Get numbers before r/R
-                numbers = []
-                for part in parts[:r_pos]:
-                    if part.isdigit() and 0 <= int(part) <= 99:
-                        numbers.append(int(part))
-                
-                if not numbers:
-                    continue
-                
-                # Get amounts after r/R
-                amounts = []
-                r_part = parts[r_pos]
-                if r_part.lower().startswith('r'):
-                    # Format: r1000 or r500
-                    amount_str = r_part[1:]
-                    if amount_str.isdigit() and int(amount_str) >= 100:
-                        amounts.append(int(amount_str))
-                        # Check if there's another amount after
-                        if len(parts) > r_pos + 1 and parts[r_pos + 1].isdigit() and int(parts[r_pos + 1]) >= 100:
-                            amounts.append(int(parts[r_pos + 1]))
-                else:
-                    # Format: 1000r500
-                    amount_parts = r_part.lower().split('r')
-                    if len(amount_parts) == 2:
-                        if amount_parts[0].isdigit() and int(amount_parts[0]) >= 100:
-                            amounts.append(int(amount_parts[0]))
-                        if amount_parts[1].isdigit() and int(amount_parts[1]) >= 100:
-                            amounts.append(int(amount_parts[1]))
-                
-                if not amounts:
-                    continue
-                
-                # Apply amounts to numbers
-                if len(amounts) == 1:
-                    # Single amount: apply to both base and reverse
-                    for num in numbers:
-                        all_bets.append(f"{num:02d}-{amounts[0]}")
-                        all_bets.append(f"{reverse_number(num):02d}-{amounts[0]}")
-                        total_amount += amounts[0] * 2
-                else:
-                    # Two amounts: first for base, second for reverse
-                    for num in numbers:
-                        all_bets.append(f"{num:02d}-{amounts[0]}")
-                        all_bets.append(f"{reverse_number(num):02d}-{amounts[1]}")
-                        total_amount += amounts[0] + amounts[1]
-                
-                continue
-
-            # Process regular number-amount pairs without r/R
-            parts = re.split(r'[,\s\-+.,=*/\r]', line)
-            parts = [p.strip() for p in parts if p.strip()]
-            
-            numbers = []
-            current_amount = None
-            
-            for part in parts:
-                if part.isdigit():
-                    num = int(part)
-                    if 0 <= num <= 99:
-                        numbers.append(num)
-                    elif num >= 100:
-                        current_amount = num
-            
-            if current_amount and numbers:
-                for num in numbers:
-                    all_bets.append(f"{num:02d}-{current_amount}")
-                    total_amount += current_amount
+        all_bets, total_amount = parse_bets(text)
 
         if not all_bets:
             await update.message.reply_text("⚠️ အချက်အလက်များကိုစစ်ဆေးပါ\nဥပမာ: 12-1000, 12/34r1000, 12/34/56-1500")
             return
 
-        # Update data stores
-        if user.username not in user_data:
-            user_data[user.username] = {}
-        if key not in user_data[user.username]:
-            user_data[user.username][key] = []
-
-        if key not in ledger:
-            ledger[key] = {}
+        # Credit is checked against the slip as sent; caps below can only lower it
+        credit_limit = book.credit_limits.get(user.username)
+        balance = book.balances.get(user.username, 0)
+        if credit_limit is not None and balance + total_amount > credit_limit:
+            await update.message.reply_text(
+                f"🚫 Credit limit ကျော်မည်ဖြစ်၍ လက်မခံပါ\n"
+                f"💳 Limit: {credit_limit}\n"
+                f"💰 လက်ရှိ: {balance}\n"
+                f"🧾 ဤစာရင်း: {total_amount}"
+            )
+            return
 
+        limit_crossed = False
+        accepted_bets = []
+        slip_bets = []
+        trimmed = []
+        rejected = []
+        total_amount = 0
         for bet in all_bets:
             num, amt = bet.split('-')
             num = int(num)
             amt = int(amt)
             
-            # Update ledger
-            if num not in ledger[key]:
-                ledger[key][num] = 0
-            ledger[key][num] += amt
+            # Enforce exposure caps before anything is recorded
+            allowed = book.capped_amount(key, user.username, num, amt)
+            if allowed <= 0:
+                rejected.append(bet)
+                continue
+            if allowed < amt:
+                trimmed.append(f"{bet} ➤ {allowed}")
+                amt = allowed
+            accepted_bets.append(f"{num:02d}-{amt}")
+            slip_bets.append((num, amt))
+            total_amount += amt
             
-            # Update user data
-            user_data[user.username][key].append((num, amt))
+            if book.record_bet(key, user.username, num, amt):
+                limit_crossed = True
+
+        if limit_crossed:
+            schedule_limit_alerts(book, context.bot)
+
+        cap_notes = []
+        if trimmed:
+            cap_notes.append("✂️ Limit ပြည့်၍ လျှော့ထားသည်:\n" + "\n".join(trimmed))
+        if rejected:
+            cap_notes.append("🚫 Limit ပြည့်၍ လက်မခံပါ:\n" + "\n".join(rejected))
+
+        if not accepted_bets:
+            await update.message.reply_text("\n\n".join(cap_notes))
+            return
+        all_bets = accepted_bets
 
         # Send confirmation with delete button
         response = "\n".join(all_bets) + f"\nစုစုပေါင်း {total_amount} ကျပ်"
-        keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user.id}:{update.message.message_id}:{key}")]]
+        if cap_notes:
+            response += "\n\n" + "\n\n".join(cap_notes)
+        keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user.id}:{update.message.message_id}:{int(key)}")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        sent_message = await update.message.reply_text(response, reply_markup=reply_markup)
-        message_store[(user.id, update.message.message_id)] = (sent_message.message_id, all_bets, total_amount, key)
+        
+        # The slip is stored in the same step as its bets, before anything is
+        # awaited; the confirmation's message id is filled in once it is sent
+        slip_id = (user.id, update.message.message_id)
+        book.add_slip(key, slip_id, user.username, update.message.date.timestamp(), slip_bets)
+        book.message_store[slip_id] = (None, all_bets, total_amount, key, user.username)
+        audit.record("slip", book=book.admin_id, draw=str(key), user=user.username, slip=update.message.message_id,
+                     bets=tuple(all_bets), total=total_amount)
+        schedule_board(book, context.bot)
+        try:
+            sent_message = await update.message.reply_text(response, reply_markup=reply_markup)
+        except TelegramError as e:
+            # The slip is booked either way; an error reply would say otherwise
+            logger.warning(f"Slip {slip_id} booked but not confirmed: {str(e)}")
+            return
+        stored = book.message_store.get(slip_id)
+        if stored is not None:
+            book.message_store[slip_id] = (sent_message.message_id,) + stored[1:]
             
     except Exception as e:
         logger.error(f"Error in handle_message: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def show_confirmation(context, edited, sent_message_id, text, reply_markup=None):
+    # Edits the slip's confirmation in place; a slip whose confirmation never
+    # went out gets a new reply instead
+    if sent_message_id is None:
+        return await edited.reply_text(text, reply_markup=reply_markup)
+    return await context.bot.edit_message_text(chat_id=edited.chat_id, message_id=sent_message_id, text=text,
+                                               reply_markup=reply_markup)
+
+async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        edited = update.edited_message
+        user = update.effective_user
+        book = get_book(update)
+        if not book or not user or not edited.text:
+            return
+            
+        # Only slips the bot confirmed can be edited; anything else is ignored
+        slip_id = (user.id, edited.message_id)
+        stored = book.message_store.get(slip_id)
+        if not stored:
+            return
+        sent_message_id, _, old_total, key, username = stored
+        slip = book.draws[key].slips.get(slip_id) if key in book.draws else None
+        if slip is None:
+            return
+            
+        edited_at = (edited.edit_date or edited.date).timestamp()
+        if not draw_is_open(book, key, edited_at):
+            await edited.reply_text("❌ စာရင်းပိတ်ထားပါသည်၊ ပြင်ဆင်မှုကို လက်မခံပါ")
+            return
+            
+        all_bets, _ = parse_bets(edited.text)
+        if not all_bets:
+            await edited.reply_text("⚠️ ပြင်ထားသောစာရင်းကို ဖတ်မရပါ၊ မူလစာရင်းအတိုင်းထားပါသည်")
+            return
+        new_bets = []
+        for bet in all_bets:
+            num, amt = bet.split('-')
+            new_bets.append((int(num), int(amt)))
+            
+        # Only the difference between the stored slip and the edit is booked
+        old_counts = Counter(slip[2])
+        new_counts = Counter(new_bets)
+        removed = old_counts - new_counts
+        added = new_counts - old_counts
+        if not removed and not added:
+            return
+            
+        credit_limit = book.credit_limits.get(username)
+        balance = book.balances.get(username, 0)
+        change = sum(amt * n for (_, amt), n in added.items()) - sum(amt * n for (_, amt), n in removed.items())
+        if credit_limit is not None and change > 0 and balance + change > credit_limit:
+            await edited.reply_text(
+                f"🚫 Credit limit ကျော်မည်ဖြစ်၍ ပြင်ဆင်မှုကို လက်မခံပါ\n"
+                f"💳 Limit: {credit_limit}\n"
+                f"💰 လက်ရှိ: {balance}\n"
+                f"🧾 တိုးမည့်ပမာဏ: {change}"
+            )
+            return
+            
+        book.retract_bets(key, username, removed)
+        
+        kept = old_counts & new_counts
+        limit_crossed = False
+        slip_bets = []
+        accepted_bets = []
+        trimmed = []
+        rejected = []
+        total_amount = 0
+        for num, amt in new_bets:
+            if kept[(num, amt)] > 0:
+                kept[(num, amt)] -= 1
+            else:
+                allowed = book.capped_amount(key, username, num, amt)
+                if allowed <= 0:
+                    rejected.append(f"{num:02d}-{amt}")
+                    continue
+                if allowed < amt:
+                    trimmed.append(f"{num:02d}-{amt} ➤ {allowed}")
+                    amt = allowed
+                if book.record_bet(key, username, num, amt):
+                    limit_crossed = True
+            slip_bets.append((num, amt))
+            accepted_bets.append(f"{num:02d}-{amt}")
+            total_amount += amt
+            
+        if limit_crossed:
+            schedule_limit_alerts(book, context.bot)
+        schedule_board(book, context.bot)
+            
+        cap_notes = []
+        if trimmed:
+            cap_notes.append("✂️ Limit ပြည့်၍ လျှော့ထားသည်:\n" + "\n".join(trimmed))
+        if rejected:
+            cap_notes.append("🚫 Limit ပြည့်၍ လက်မခံပါ:\n" + "\n".join(rejected))
+            
+        audit.record("slip_edit", book=book.admin_id, draw=str(key), user=username, slip=edited.message_id,
+                     removed=tuple(f"{num:02d}-{amt}" for num, amt in removed.elements()), bets=tuple(accepted_bets), total=total_amount, old_total=old_total)
+        if not slip_bets:
+            del book.message_store[slip_id]
+            book.remove_slip(key, slip_id)
+            await show_confirmation(context, edited, sent_message_id, "\n\n".join(["✏️ ပြင်ဆင်ပြီး - လက်ခံသည့်လောင်းကြေးမရှိပါ"] + cap_notes))
+            return
+            
+        # The slip keeps its place and send time; only its bets change
+        book.add_slip(key, slip_id, username, slip[1], slip_bets)
+        book.message_store[slip_id] = (sent_message_id, accepted_bets, total_amount, key, username)
+        
+        response = "\n".join(accepted_bets) + f"\nစုစုပေါင်း {total_amount} ကျပ်"
+        if cap_notes:
+            response += "\n\n" + "\n\n".join(cap_notes)
+        response += f"\n\n✏️ ပြင်ဆင်ပြီး ({old_total} ➤ {total_amount})"
+        keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user.id}:{edited.message_id}:{int(key)}")]]
+        sent_message = await show_confirmation(context, edited, sent_message_id, response, InlineKeyboardMarkup(keyboard))
+        stored = book.message_store.get(slip_id)
+        if sent_message_id is None and stored is not None:
+            book.message_store[slip_id] = (sent_message.message_id,) + stored[1:]
+        
+    except Exception as e:
+        logger.error(f"Error in handle_edited_message: {str(e)}")
+
 async def delete_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     try:
-        _, user_id_str, message_id_str, date_key = query.data.split(':')
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        _, user_id_str, message_id_str, date_str = query.data.split(':')
+        date_key = Draw.parse(date_str)
         user_id = int(user_id_str)
         message_id = int(message_id_str)
         
-        if query.from_user.id != admin_id:
-            if (user_id, message_id) in message_store:
-                sent_message_id, bets, total_amount, _ = message_store[(user_id, message_id)]
+        if query.from_user.id != book.admin_id:
+            if (user_id, message_id) in book.message_store:
+                sent_message_id, bets, total_amount, _, _ = book.message_store[(user_id, message_id)]
                 response = "\n".join(bets) + f"\nစုစုပေါင်း {total_amount} ကျပ်"
-                keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user_id}:{message_id}:{date_key}")]]
+                keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user_id}:{message_id}:{int(date_key)}")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 await query.edit_message_text(
                     text=f"❌ User များမဖျက်နိုင်ပါ၊ Admin ကိုဆက်သွယ်ပါ\n\n{response}",
@@ -389,8 +1629,8 @@ async def delete_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         keyboard = [
-            [InlineKeyboardButton("✅ OK", callback_data=f"confirm_delete:{user_id}:{message_id}:{date_key}")],
-            [InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_delete:{user_id}:{message_id}:{date_key}")]
+            [InlineKeyboardButton("✅ OK", callback_data=f"confirm_delete:{user_id}:{message_id}:{int(date_key)}")],
+            [InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_delete:{user_id}:{message_id}:{int(date_key)}")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text("⚠️ သေချာလား? ဒီလောင်းကြေးကိုဖျက်မှာလား?", reply_markup=reply_markup)
@@ -404,26 +1644,22 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        _, user_id_str, message_id_str, date_key = query.data.split(':')
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        _, user_id_str, message_id_str, date_str = query.data.split(':')
+        date_key = Draw.parse(date_str)
         user_id = int(user_id_str)
         message_id = int(message_id_str)
         
-        if (user_id, message_id) not in message_store:
+        draw = book.draws.get(date_key)
+        if (user_id, message_id) not in book.message_store or draw is None:
             await query.edit_message_text("❌ ဒေတာမတွေ့ပါ")
             return
             
-        sent_message_id, bets, total_amount, _ = message_store[(user_id, message_id)]
-        
-        username = None
-        for uname, data in user_data.items():
-            if date_key in data:
-                for bet in data[date_key]:
-                    num, amt = bet
-                    if f"{num:02d}-{amt}" in bets:
-                        username = uname
-                        break
-                if username:
-                    break
+        sent_message_id, bets, total_amount, _, username = book.message_store[(user_id, message_id)]
         
         if not username:
             await query.edit_message_text("❌ User မတွေ့ပါ")
@@ -434,26 +1670,26 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
             num = int(num)
             amt = int(amt)
             
-            if date_key in ledger and num in ledger[date_key]:
-                ledger[date_key][num] -= amt
-                if ledger[date_key][num] <= 0:
-                    del ledger[date_key][num]
-                # Remove date from ledger if empty
-                if not ledger[date_key]:
-                    del ledger[date_key]
-            
-            if username in user_data and date_key in user_data[username]:
-                user_data[username][date_key] = [
-                    (n, a) for n, a in user_data[username][date_key] 
-                    if not (n == num and a == amt)
-                ]
+            book.track_risk(draw, username, num, -amt)
+            
+            if num in draw.ledger:
+                draw.ledger[num] -= amt
+                if draw.ledger[num] <= 0:
+                    del draw.ledger[num]
+            
+            if username in draw.bets:
+                # Remove one matching bet; identical bets from other slips stay
+                if (num, amt) in draw.bets[username]:
+                    draw.bets[username].remove((num, amt))
                 
-                if not user_data[username][date_key]:
-                    del user_data[username][date_key]
-                    if not user_data[username]:
-                        del user_data[username]
+                if not draw.bets[username]:
+                    del draw.bets[username]
         
-        del message_store[(user_id, message_id)]
+        del book.message_store[(user_id, message_id)]
+        book.remove_slip(date_key, (user_id, message_id))
+        audit.record("delete", book=book.admin_id, draw=str(date_key), user=username, slip=message_id,
+                     bets=tuple(bets), total=total_amount, by=query.from_user.id)
+        schedule_board(book, context.bot)
         
         await query.edit_message_text("✅ လောင်းကြေးဖျက်ပြီးပါပြီ")
         
@@ -461,19 +1697,149 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in confirm_delete: {str(e)}")
         await query.edit_message_text("❌ Error occurred while deleting bet")
 
+def parse_clock(date_key, text):
+    # "HH:MM" on the draw's day, Myanmar time
+    clock = time.fromisoformat(text)
+    return MYANMAR_TIMEZONE.localize(datetime.combine(date_key.day, clock)).timestamp()
+
+async def confirm_undo(update, context, book, date_key, slip_ids, label):
+    slips = book.draws[date_key].slips if date_key in book.draws else {}
+    slip_ids = [slip_id for slip_id in slip_ids if slip_id in slips and not slips[slip_id][3]]
+    if not slip_ids:
+        await update.message.reply_text(f"ℹ️ {date_key} အတွက် {label} ဖျက်စရာ slip မရှိပါ")
+        return
+        
+    users = Counter(slips[slip_id][0] for slip_id in slip_ids)
+    total_amount = sum(amt for slip_id in slip_ids for _, amt in slips[slip_id][2])
+    context.user_data['undo_pending'] = (date_key, slip_ids)
+    
+    msg = [f"🗑 {date_key} - {label}", f"🧾 Slips: {len(slip_ids)}", f"💵 စုစုပေါင်း: {total_amount}"]
+    msg.extend(f"👤 {user}: {n} slips" for user, n in users.most_common())
+    msg.append("\nဖျက်မှာ သေချာပါသလား?")
+    keyboard = [
+        [InlineKeyboardButton("✅ OK", callback_data="undo_confirm")],
+        [InlineKeyboardButton("❌ Cancel", callback_data="undo_cancel")]
+    ]
+    await update.message.reply_text("\n".join(msg), reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def undo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        usage = "⚠️ Usage: /undo [username] [N] သို့မဟုတ် /undo [username|all] [HH:MM-HH:MM]"
+        if not context.args or len(context.args) > 2:
+            await update.message.reply_text(usage)
+            return
+            
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+        username = context.args[0].lstrip("@")
+        spec = context.args[1] if len(context.args) > 1 else "1"
+        
+        if spec.isdigit():
+            # Last N slips of one user, straight from the slip index
+            draw = book.draws.get(date_key)
+            index = draw.slip_index.get(username, {}) if draw else {}
+            slip_ids = list(index)[-int(spec):] if int(spec) else []
+            await confirm_undo(update, context, book, date_key, slip_ids, f"{username} ၏ နောက်ဆုံး {spec} slips")
+            return
+            
+        try:
+            start_str, end_str = spec.split("-")
+            since = parse_clock(date_key, start_str)
+            until = parse_clock(date_key, end_str)
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+            
+        draw = book.draws.get(date_key)
+        slips = draw.slips if draw else {}
+        if username.lower() == "all":
+            candidates = slips
+        else:
+            candidates = draw.slip_index.get(username, {}) if draw else {}
+        slip_ids = [slip_id for slip_id in candidates if since <= slips[slip_id][1] < until]
+        await confirm_undo(update, context, book, date_key, slip_ids, f"{username} {start_str}-{end_str}")
+    except Exception as e:
+        logger.error(f"Error in undo: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def rollback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+        try:
+            since = parse_clock(date_key, context.args[0])
+        except (IndexError, ValueError):
+            await update.message.reply_text("⚠️ Usage: /rollback [HH:MM]")
+            return
+            
+        slips = book.draws[date_key].slips if date_key in book.draws else {}
+        slip_ids = [slip_id for slip_id, slip in slips.items() if slip[1] >= since]
+        await confirm_undo(update, context, book, date_key, slip_ids, f"{context.args[0]} နောက်ပိုင်း အားလုံး")
+    except Exception as e:
+        logger.error(f"Error in rollback: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def undo_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    try:
+        book = get_book(update)
+        if not book or query.from_user.id != book.admin_id:
+            await query.edit_message_text("❌ Admin only command")
+            return
+            
+        pending = context.user_data.pop('undo_pending', None)
+        if not pending:
+            await query.edit_message_text("❌ ဒေတာမတွေ့ပါ")
+            return
+            
+        date_key, slip_ids = pending
+        slips = book.draws[date_key].slips if date_key in book.draws else {}
+        users = tuple(dict.fromkeys(slips[slip_id][0] for slip_id in slip_ids if slip_id in slips and not slips[slip_id][3]))
+        count, total_amount = book.remove_slips(date_key, slip_ids)
+        audit.record("undo", book=book.admin_id, draw=str(date_key), users=users,
+                     slips=tuple(message_id for _, message_id in slip_ids), count=count, total=total_amount,
+                     by=query.from_user.id)
+        schedule_board(book, context.bot)
+        await query.edit_message_text(f"✅ {date_key} မှ slip {count} ခု ({total_amount} ကျပ်) ဖျက်ပြီးပါပြီ")
+    except Exception as e:
+        logger.error(f"Error in undo_confirm: {str(e)}")
+        await query.edit_message_text("❌ Error occurred")
+
+async def undo_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.pop('undo_pending', None)
+    await query.edit_message_text("❌ ဖျက်ခြင်းကို ပယ်ဖျက်လိုက်ပါပြီ")
+
 async def cancel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     try:
-        _, user_id_str, message_id_str, date_key = query.data.split(':')
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        _, user_id_str, message_id_str, date_str = query.data.split(':')
+        date_key = Draw.parse(date_str)
         user_id = int(user_id_str)
         message_id = int(message_id_str)
         
-        if (user_id, message_id) in message_store:
-            sent_message_id, bets, total_amount, _ = message_store[(user_id, message_id)]
+        if (user_id, message_id) in book.message_store:
+            sent_message_id, bets, total_amount, _, _ = book.message_store[(user_id, message_id)]
             response = "\n".join(bets) + f"\nစုစုပေါင်း {total_amount} ကျပ်"
-            keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user_id}:{message_id}:{date_key}")]]
+            keyboard = [[InlineKeyboardButton("🗑 Delete", callback_data=f"delete:{user_id}:{message_id}:{int(date_key)}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.edit_message_text(response, reply_markup=reply_markup)
         else:
@@ -484,68 +1850,84 @@ async def cancel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Error occurred while canceling deletion")
 
 async def ledger_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Determine which date to show
-        date_key = current_working_date if current_working_date else get_current_date_key()
-        
-        if date_key not in ledger:
-            await update.message.reply_text(f"ℹ️ {date_key} အတွက် လက်ရှိတွင် လောင်းကြေးမရှိပါ")
-            return
-            
-        lines = [f"📒 {date_key} လက်ကျန်ငွေစာရင်း"]
-        ledger_data = ledger[date_key]
-        
-        for i in range(100):
-            total = ledger_data.get(i, 0)
-            if total > 0:
-                if date_key in pnumber_per_date and i == pnumber_per_date[date_key]:
-                    lines.append(f"🔴 {i:02d} ➤ {total} 🔴")
-                else:
-                    lines.append(f"{i:02d} ➤ {total}")
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
         
+        lines = ledger_lines(book, date_key)
         if len(lines) == 1:
             await update.message.reply_text(f"ℹ️ {date_key} အတွက် လက်ရှိတွင် လောင်းကြေးမရှိပါ")
         else:
-            if date_key in pnumber_per_date:
-                pnum = pnumber_per_date[date_key]
-                lines.append(f"\n🔴 Power Number: {pnum:02d} ➤ {ledger_data.get(pnum, 0)}")
             await update.message.reply_text("\n".join(lines))
     except Exception as e:
         logger.error(f"Error in ledger: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def board(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        # Only one board per book; starting a new one or /board off retires the old
+        if book.board is not None:
+            old_chat_id, old_message_id = book.board
+            book.board = None
+            try:
+                await context.bot.unpin_chat_message(chat_id=old_chat_id, message_id=old_message_id)
+            except TelegramError:
+                pass
+                
+        if context.args and context.args[0].lower() == "off":
+            await update.message.reply_text("✅ Live board ပိတ်ပြီးပါပြီ")
+            return
+            
+        text = render_board(book)
+        sent_message = await update.message.reply_text(text)
+        book.board = (sent_message.chat_id, sent_message.message_id)
+        book.board_digest = board_digest(text)
+        try:
+            await context.bot.pin_chat_message(chat_id=sent_message.chat_id, message_id=sent_message.message_id, disable_notification=True)
+        except TelegramError as e:
+            await update.message.reply_text(f"⚠️ Pin မလုပ်နိုင်ပါ ({str(e)})၊ board ကိုတော့ ဆက်ပြင်ပေးပါမည်")
+    except Exception as e:
+        logger.error(f"Error in board: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
 async def break_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, break_limits, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Determine which date to work on
-        date_key = current_working_date if current_working_date else get_current_date_key()
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
             
         if not context.args:
-            if date_key in break_limits:
-                await update.message.reply_text(f"ℹ️ Usage: /break [limit]\nℹ️ လက်ရှိတွင် break limit: {break_limits[date_key]}")
+            if date_key in book.break_limits:
+                await update.message.reply_text(f"ℹ️ Usage: /break [limit]\nℹ️ လက်ရှိတွင် break limit: {book.break_limits[date_key]}")
             else:
                 await update.message.reply_text(f"ℹ️ Usage: /break [limit]\nℹ️ {date_key} အတွက် break limit မသတ်မှတ်ရသေးပါ")
             return
             
         try:
             new_limit = int(context.args[0])
-            break_limits[date_key] = new_limit
+            book.break_limits[date_key] = new_limit
+            audit.record("break", book=book.admin_id, draw=str(date_key), limit=new_limit, by=update.effective_user.id)
             await update.message.reply_text(f"✅ {date_key} အတွက် Break limit ကို {new_limit} အဖြစ်သတ်မှတ်ပြီးပါပြီ")
             
-            if date_key not in ledger:
+            ledger_data = book.draw_ledger(date_key)
+            if not ledger_data:
                 await update.message.reply_text(f"ℹ️ {date_key} အတွက် လောင်းကြေးမရှိသေးပါ")
                 return
                 
-            ledger_data = ledger[date_key]
             msg = [f"📌 {date_key} အတွက် Limit ({new_limit}) ကျော်ဂဏန်းများ:"]
             found = False
             
@@ -566,48 +1948,183 @@ async def break_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in break: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def cap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /cap limits every number's ledger total
+    await set_cap(update, context, 'number_caps', "ဂဏန်းတစ်လုံးချင်း")
+
+async def agentcap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /agentcap limits each agent's own stake per number
+    await set_cap(update, context, 'agent_caps', "Agent တစ်ဦးချင်း ဂဏန်းတစ်လုံးချင်း")
+
+async def set_cap(update, context, caps_name, label):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        caps = getattr(book, caps_name)
+        
+        # Determine which date to work on
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+        
+        if not context.args:
+            if date_key in caps:
+                await update.message.reply_text(f"ℹ️ {date_key} အတွက် {label} cap: {caps[date_key]}\nℹ️ ဖြုတ်ရန်: 0")
+            else:
+                await update.message.reply_text(f"ℹ️ {date_key} အတွက် {label} cap မသတ်မှတ်ရသေးပါ")
+            return
+            
+        try:
+            new_cap = int(context.args[0])
+            if new_cap < 0:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text("⚠️ Cap amount ထည့်ပါ (ဥပမာ: /cap 50000)")
+            return
+            
+        audit.record("cap", book=book.admin_id, draw=str(date_key), kind=caps_name, cap=new_cap, by=update.effective_user.id)
+        if new_cap == 0:
+            caps.pop(date_key, None)
+            await update.message.reply_text(f"✅ {date_key} အတွက် {label} cap ဖြုတ်ပြီးပါပြီ")
+        else:
+            caps[date_key] = new_cap
+            await update.message.reply_text(f"✅ {date_key} အတွက် {label} cap ကို {new_cap} အဖြစ်သတ်မှတ်ပြီးပါပြီ")
+    except Exception as e:
+        logger.error(f"Error in set_cap: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def credit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        if context.args:
+            if len(context.args) != 2 or not context.args[1].isdigit():
+                await update.message.reply_text("⚠️ Usage: /credit [username] [limit] (0 = ဖြုတ်ရန်)")
+                return
+            username = context.args[0].lstrip("@")
+            new_limit = int(context.args[1])
+            audit.record("credit", book=book.admin_id, user=username, limit=new_limit, by=update.effective_user.id)
+            if new_limit == 0:
+                book.credit_limits.pop(username, None)
+                await update.message.reply_text(f"✅ {username} ၏ credit limit ဖြုတ်ပြီးပါပြီ")
+            else:
+                book.credit_limits[username] = new_limit
+                await update.message.reply_text(
+                    f"✅ {username} ၏ credit limit ကို {new_limit} အဖြစ်သတ်မှတ်ပြီးပါပြီ\n"
+                    f"💰 လက်ရှိ: {book.balances.get(username, 0)}"
+                )
+            return
+            
+        if not book.credit_limits:
+            await update.message.reply_text("ℹ️ Credit limit သတ်မှတ်ထားသည့် agent မရှိပါ")
+            return
+            
+        # Only agents with a limit are looked at, each one an O(1) balance read
+        usage = sorted(
+            ((book.balances.get(user, 0) * 100 // limit if limit else 100, user, limit)
+             for user, limit in book.credit_limits.items()),
+            reverse=True
+        )
+        near = [entry for entry in usage if entry[0] >= CREDIT_WARN]
+        if not near:
+            await update.message.reply_text(f"✅ Credit limit ၏ {CREDIT_WARN}% ကျော်နေသည့် agent မရှိပါ")
+            return
+            
+        msg = [f"💳 Credit limit ၏ {CREDIT_WARN}% ကျော်နေသည့် agent များ:"]
+        for percent, user, limit in near:
+            mark = "🔴" if percent >= 100 else "🟠"
+            msg.append(f"{mark} {user} ➤ {book.balances.get(user, 0)} / {limit} ({percent}%)")
+        await update.message.reply_text("\n".join(msg))
+    except Exception as e:
+        logger.error(f"Error in credit: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def alert_levels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        if not context.args:
+            levels = ", ".join(f"{level}%" for level in book.alert_levels)
+            await update.message.reply_text(f"ℹ️ Usage: /alert [percent] ...\nℹ️ လက်ရှိ သတိပေးအဆင့်များ: {levels}")
+            return
+            
+        try:
+            levels = sorted({int(arg) for arg in context.args} | {100})
+            if any(level <= 0 or level > 100 for level in levels):
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text("⚠️ 1 နှင့် 100 ကြား ရာခိုင်နှုန်းထည့်ပါ (ဥပမာ: /alert 80 90)")
+            return
+            
+        book.alert_levels = levels
+        await update.message.reply_text(f"✅ Break limit ၏ {', '.join(f'{level}%' for level in levels)} ကျော်လျှင် သတိပေးပါမည်")
+    except Exception as e:
+        logger.error(f"Error in alert_levels: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
 async def overbuy(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, break_limits, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Determine which date to work on
-        date_key = current_working_date if current_working_date else get_current_date_key()
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
             
         if not context.args:
-            await update.message.reply_text("ℹ️ ကာဒိုင်အမည်ထည့်ပါ")
+            draw = book.draws.get(date_key)
+            lots = draw.overbuys if draw else None
+            if not lots or not lots.lots:
+                await update.message.reply_text("ℹ️ ကာဒိုင်အမည်ထည့်ပါ")
+                return
+            # Lots bought so far for the draw, then each upstream's running total
+            msg = [f"📦 {date_key} overbuy lots:"]
+            for seq, name, timestamp, nums in lots.lots:
+                clock = datetime.fromtimestamp(timestamp, MYANMAR_TIMEZONE).strftime("%H:%M") if timestamp else "--:--"
+                msg.append(f"#{seq} {clock} {name}: {len(nums)} ဂဏန်း, {sum(nums.values())} ကျပ်")
+            msg.append("")
+            for name, total_amt in lots.sums.items():
+                msg.append(f"👤 {name} စုစုပေါင်း {total_amt} ကျပ်")
+            msg.append("\nℹ️ ထပ်တင်ရန် /overbuy [ကာဒိုင်အမည်]")
+            await reply_long(update.message, msg)
             return
             
-        if date_key not in break_limits:
+        username = context.args[0]
+        draw = book.draws.get(date_key)
+        has_plan = draw is not None and username in draw.hedge_plans
+        
+        if date_key not in book.break_limits and not has_plan:
             await update.message.reply_text(f"⚠️ {date_key} အတွက် ကျေးဇူးပြု၍ /break [limit] ဖြင့် limit သတ်မှတ်ပါ")
             return
             
-        if date_key not in ledger:
+        if not book.draw_ledger(date_key):
             await update.message.reply_text(f"ℹ️ {date_key} အတွက် လောင်းကြေးမရှိသေးပါ")
             return
             
-        username = context.args[0]
         context.user_data['overbuy_username'] = username
         context.user_data['overbuy_date'] = date_key
         
-        ledger_data = ledger[date_key]
-        break_limit_val = break_limits[date_key]
-        over_numbers = {num: amt - break_limit_val for num, amt in ledger_data.items() if amt > break_limit_val}
+        break_limit_val = book.break_limits.get(date_key, "hedge")
+        over_numbers = overbuy_candidates(book, date_key, username)
         
         if not over_numbers:
             await update.message.reply_text(f"ℹ️ {date_key} အတွက် ဘယ်ဂဏန်းမှ limit ({break_limit_val}) မကျော်ပါ")
             return
             
-        if date_key not in overbuy_selections:
-            overbuy_selections[date_key] = {}
-        overbuy_selections[date_key][username] = over_numbers.copy()
+        selected = draw.overbuy_selections[username] = over_numbers.copy()
         
         msg = [f"{username} ထံမှာတင်ရန်များ (Date: {date_key}, Limit: {break_limit_val}):"]
         buttons = []
         for num, amt in over_numbers.items():
-            buttons.append([InlineKeyboardButton(f"{num:02d} ➤ {amt} {'✅' if num in overbuy_selections[date_key][username] else '⬜'}", 
+            buttons.append([InlineKeyboardButton(f"{num:02d} ➤ {amt} {'✅' if num in selected else '⬜'}", 
                           callback_data=f"overbuy_select:{num}")])
         
         buttons.append([
@@ -620,7 +2137,83 @@ async def overbuy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("\n".join(msg), reply_markup=reply_markup)
         
     except Exception as e:
-        logger.error(f"Error in overbuy: {str(e)}")
+        logger.error(f"Error in overbuy: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def hedge(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        # Determine which date to work on
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+        
+        usage = "ℹ️ Usage: /hedge [max loss] [ကာဒိုင်] [ကာဒိုင်=com/za:cap] ...\nဥပမာ: /hedge 500000 A B=10/85:200000"
+        if len(context.args) < 2:
+            await update.message.reply_text(usage)
+            return
+            
+        draw = book.draws.get(date_key)
+        if draw is None or not draw.risk.totals:
+            await update.message.reply_text(f"ℹ️ {date_key} အတွက် လောင်းကြေးမရှိသေးပါ")
+            return
+            
+        try:
+            max_loss = int(context.args[0])
+            upstreams = []
+            for arg in context.args[1:]:
+                spec, _, cap = arg.partition(':')
+                name, _, terms = spec.partition('=')
+                if terms:
+                    com, za = (int(x) for x in terms.split('/'))
+                    if com < 0 or com > 100 or za < 0:
+                        raise ValueError
+                else:
+                    com, za = book.com_data.get(name, 0), book.za_data.get(name, DEFAULT_ZA)
+                # Terms given here only shape the plan; /comandza sets the ones settled with
+                upstreams.append((name, com, za, int(cap) if cap else None))
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+            
+        net = draw.risk.net()
+        worst_before = min(net)
+        if worst_before >= -max_loss:
+            await update.message.reply_text(f"ℹ️ {date_key} အတွက် အဆိုးဆုံးရလဒ် {worst_before} ဖြစ်၍ ကာရန်မလိုပါ")
+            return
+            
+        plan = plan_hedge(net, upstreams, max_loss)
+        if not plan:
+            await update.message.reply_text(f"⚠️ {max_loss} အောက်ကာရန် မဖြစ်နိုင်ပါ (cap သို့မဟုတ် za မလုံလောက်ပါ)")
+            return
+            
+        terms = {name: (com, za) for name, com, za, _ in upstreams}
+        worst_after = min(hedge_result(net, plan, terms))
+        draw.hedge_plans = plan
+        
+        msg = [f"🛡 {date_key} အတွက် ကာရန်အစီအစဉ် (Max loss: {max_loss})"]
+        for name, nums in plan.items():
+            com, za = terms[name]
+            msg.append(f"👤 {name} (Com {com}%, Za {za}): {len(nums)} ဂဏန်း, စုစုပေါင်း {sum(nums.values())}")
+        msg.append(f"📉 အဆိုးဆုံး: {worst_before} ➤ {worst_after}")
+        unsaved = [name for name in plan if terms[name] != (book.com_data.get(name, 0), book.za_data.get(name, DEFAULT_ZA))]
+        if unsaved:
+            msg.append(f"ℹ️ {', '.join(unsaved)} ၏ Com/Za ကို /comandza ဖြင့် သတ်မှတ်ပါ")
+        
+        # Pre-fill the overbuy keyboard for the first upstream, the rest via /overbuy
+        first = next(iter(plan))
+        others = [name for name in plan if name != first]
+        if others:
+            msg.append("\n" + "\n".join(f"👉 /overbuy {name}" for name in others))
+        await update.message.reply_text("\n".join(msg))
+        
+        context.args = [first]
+        await overbuy(update, context)
+        
+    except Exception as e:
+        logger.error(f"Error in hedge: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 async def overbuy_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -628,6 +2221,11 @@ async def overbuy_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         _, num_str = query.data.split(':')
         num = int(num_str)
         username = context.user_data.get('overbuy_username')
@@ -637,20 +2235,21 @@ async def overbuy_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("❌ Error: User or date not found")
             return
             
-        if date_key not in overbuy_selections or username not in overbuy_selections[date_key]:
+        draw = book.draws.get(date_key)
+        selected = draw.overbuy_selections.get(username) if draw else None
+        if selected is None:
             await query.edit_message_text("❌ Error: Selection data not found")
             return
             
-        if num in overbuy_selections[date_key][username]:
-            del overbuy_selections[date_key][username][num]
+        if num in selected:
+            del selected[num]
         else:
-            break_limit_val = break_limits[date_key]
-            overbuy_selections[date_key][username][num] = ledger[date_key][num] - break_limit_val
+            selected[num] = overbuy_candidates(book, date_key, username)[num]
             
         msg = [f"{username} ထံမှာတင်ရန်များ (Date: {date_key}):"]
         buttons = []
-        for n, amt in overbuy_selections[date_key][username].items():
-            buttons.append([InlineKeyboardButton(f"{n:02d} ➤ {amt} {'✅' if n in overbuy_selections[date_key][username] else '⬜'}", 
+        for n, amt in selected.items():
+            buttons.append([InlineKeyboardButton(f"{n:02d} ➤ {amt} {'✅' if n in selected else '⬜'}", 
                           callback_data=f"overbuy_select:{n}")])
         
         buttons.append([
@@ -671,6 +2270,11 @@ async def overbuy_select_all(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     try:
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         username = context.user_data.get('overbuy_username')
         date_key = context.user_data.get('overbuy_date')
         
@@ -678,20 +2282,16 @@ async def overbuy_select_all(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.edit_message_text("❌ Error: User or date not found")
             return
             
-        if date_key not in overbuy_selections:
-            overbuy_selections[date_key] = {}
+        draw = book.draws.get(date_key)
+        if draw is None:
+            await query.edit_message_text("❌ Error: Selection data not found")
+            return
             
-        break_limit_val = break_limits[date_key]
-        ledger_data = ledger[date_key]
-        overbuy_selections[date_key][username] = {
-            num: amt - break_limit_val 
-            for num, amt in ledger_data.items() 
-            if amt > break_limit_val
-        }
+        selected = draw.overbuy_selections[username] = overbuy_candidates(book, date_key, username)
         
         msg = [f"{username} ထံမှာတင်ရန်များ (Date: {date_key}):"]
         buttons = []
-        for num, amt in overbuy_selections[date_key][username].items():
+        for num, amt in selected.items():
             buttons.append([InlineKeyboardButton(f"{num:02d} ➤ {amt} ✅", 
                           callback_data=f"overbuy_select:{num}")])
         
@@ -713,6 +2313,11 @@ async def overbuy_unselect_all(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     
     try:
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         username = context.user_data.get('overbuy_username')
         date_key = context.user_data.get('overbuy_date')
         
@@ -720,14 +2325,14 @@ async def overbuy_unselect_all(update: Update, context: ContextTypes.DEFAULT_TYP
             await query.edit_message_text("❌ Error: User or date not found")
             return
             
-        if date_key not in overbuy_selections:
-            overbuy_selections[date_key] = {}
+        draw = book.draws.get(date_key)
+        if draw is None:
+            await query.edit_message_text("❌ Error: Selection data not found")
+            return
             
-        overbuy_selections[date_key][username] = {}
+        draw.overbuy_selections[username] = {}
         
-        break_limit_val = break_limits[date_key]
-        ledger_data = ledger[date_key]
-        over_numbers = {num: amt - break_limit_val for num, amt in ledger_data.items() if amt > break_limit_val}
+        over_numbers = overbuy_candidates(book, date_key, username)
         
         msg = [f"{username} ထံမှာတင်ရန်များ (Date: {date_key}):"]
         buttons = []
@@ -753,6 +2358,11 @@ async def overbuy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         username = context.user_data.get('overbuy_username')
         date_key = context.user_data.get('overbuy_date')
         
@@ -760,38 +2370,32 @@ async def overbuy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("❌ Error: User or date not found")
             return
             
-        if date_key not in overbuy_selections or username not in overbuy_selections[date_key]:
+        draw = book.draws.get(date_key)
+        selected_numbers = draw.overbuy_selections.get(username) if draw else None
+        if selected_numbers is None:
             await query.edit_message_text("❌ Error: Selection data not found")
             return
             
-        selected_numbers = overbuy_selections[date_key][username]
         if not selected_numbers:
             await query.edit_message_text("⚠️ ဘာဂဏန်းမှမရွေးထားပါ")
             return
             
-        if username not in user_data:
-            user_data[username] = {}
-        if date_key not in user_data[username]:
-            user_data[username][date_key] = []
-            
-        total_amount = 0
-        bets = []
-        for num, amt in selected_numbers.items():
-            user_data[username][date_key].append((num, -amt))
-            bets.append(f"{num:02d}-{amt}")
-            total_amount += amt
-            
-            # Update ledger
-            ledger[date_key][num] = ledger[date_key].get(num, 0) - amt
-            if ledger[date_key][num] <= 0:
-                del ledger[date_key][num]
+        bets = [f"{num:02d}-{amt}" for num, amt in selected_numbers.items()]
+        total_amount = sum(selected_numbers.values())
+        # Each confirm is a new lot; earlier lots to the same upstream still count
+        seq = book.record_overbuy(date_key, username, selected_numbers.copy(), datetime.now(MYANMAR_TIMEZONE).timestamp())
+        lots = draw.overbuys
         
-        # Initialize overbuy_list for date if needed
-        if date_key not in overbuy_list:
-            overbuy_list[date_key] = {}
-        overbuy_list[date_key][username] = selected_numbers.copy()
+        # A hedge plan is used up once it has been bought
+        draw.hedge_plans.pop(username, None)
+        audit.record("overbuy", book=book.admin_id, draw=str(date_key), user=username, slip=seq,
+                     bets=tuple(bets), total=total_amount, by=query.from_user.id)
+        schedule_board(book, context.bot)
         
         response = f"{username} - {date_key}\n" + "\n".join(bets) + f"\nစုစုပေါင်း {total_amount} ကျပ်"
+        lot_count = sum(1 for lot in lots.lots if lot[1] == username)
+        if lot_count > 1:
+            response += f"\n📦 Lot {lot_count} ခု၊ {username} စုစုပေါင်း {lots.sums[username]} ကျပ်"
         await query.edit_message_text(response)
         
     except Exception as e:
@@ -799,18 +2403,18 @@ async def overbuy_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Error occurred")
 
 async def pnumber(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, pnumber_per_date, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Determine which date to work on
-        date_key = current_working_date if current_working_date else get_current_date_key()
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
             
         if not context.args:
-            if date_key in pnumber_per_date:
-                await update.message.reply_text(f"ℹ️ Usage: /pnumber [number]\nℹ️ {date_key} အတွက် Power Number: {pnumber_per_date[date_key]:02d}")
+            if date_key in book.pnumber_per_date:
+                await update.message.reply_text(f"ℹ️ Usage: /pnumber [number]\nℹ️ {date_key} အတွက် Power Number: {book.pnumber_per_date[date_key]:02d}")
             else:
                 await update.message.reply_text(f"ℹ️ Usage: /pnumber [number]\nℹ️ {date_key} အတွက် Power Number မသတ်မှတ်ရသေးပါ")
             return
@@ -821,22 +2425,24 @@ async def pnumber(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("⚠️ ဂဏန်းကို 0 နှင့် 99 ကြားထည့်ပါ")
                 return
                 
-            pnumber_per_date[date_key] = num
+            book.pnumber_per_date[date_key] = num
+            audit.record("pnumber", book=book.admin_id, draw=str(date_key), number=num, by=update.effective_user.id)
+            schedule_board(book, context.bot)
             await update.message.reply_text(f"✅ {date_key} အတွက် Power Number ကို {num:02d} အဖြစ်သတ်မှတ်ပြီး")
             
             # Show report for this date
             msg = []
             total_power = 0
             
-            for user, records in user_data.items():
-                if date_key in records:
-                    user_total = 0
-                    for bet_num, amt in records[date_key]:
-                        if bet_num == num:
-                            user_total += amt
-                    if user_total > 0:
-                        msg.append(f"{user}: {num:02d} ➤ {user_total}")
-                        total_power += user_total
+            draw = book.draws.get(date_key)
+            for user, bets in (draw.bets.items() if draw else ()):
+                user_total = 0
+                for bet_num, amt in bets:
+                    if bet_num == num:
+                        user_total += amt
+                if user_total > 0:
+                    msg.append(f"{user}: {num:02d} ➤ {user_total}")
+                    total_power += user_total
             
             if msg:
                 msg.append(f"\n🔴 {date_key} အတွက် Power Number စုစုပေါင်း: {total_power}")
@@ -852,17 +2458,17 @@ async def pnumber(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 async def comandza(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
-        if not user_data:
+        users = book.users()
+        if not users:
             await update.message.reply_text("ℹ️ လက်ရှိ user မရှိပါ")
             return
             
-        users = list(user_data.keys())
         keyboard = [[InlineKeyboardButton(u, callback_data=f"comza:{u}")] for u in users]
         await update.message.reply_text("👉 User ကိုရွေးပါ", reply_markup=InlineKeyboardMarkup(keyboard))
     except Exception as e:
@@ -882,7 +2488,8 @@ async def comza_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def comza_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = context.user_data.get('selected_user')
-        if not user:
+        book = get_book(update)
+        if not user or not book or update.effective_user.id != book.admin_id:
             await handle_message(update, context)
             return
             
@@ -899,8 +2506,14 @@ async def comza_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if com < 0 or com > 100 or za < 0:
                     raise ValueError
                     
-                com_data[user] = com
-                za_data[user] = za
+                old_com = book.com_data.get(user, 0)
+                old_za = book.za_data.get(user, DEFAULT_ZA)
+                book.com_data[user] = com
+                book.za_data[user] = za
+                audit.record("comza", book=book.admin_id, user=user, com=com, za=za, old_com=old_com, old_za=old_za,
+                             by=update.effective_user.id)
+                for draw in book.draws.values():
+                    draw.risk.change_terms(user, old_com, old_za, com, za)
                 del context.user_data['selected_user']
                 await update.message.reply_text(f"✅ Com {com}%, Za {za} မှတ်ထားပြီး")
             except:
@@ -911,63 +2524,78 @@ async def comza_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in comza_text: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def risk(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        # Determine which date to work on
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+        
+        draw = book.draws.get(date_key)
+        if draw is None or not draw.risk.totals:
+            await update.message.reply_text(f"ℹ️ {date_key} အတွက် လောင်းကြေးမရှိသေးပါ")
+            return
+            
+        net = draw.risk.net()
+        ranked = sorted(range(100), key=lambda n: net[n])
+        losing = [n for n in ranked if net[n] < 0]
+        
+        msg = [f"🎲 {date_key} အတွက် ပေါက်ဂဏန်းအလိုက် ဒိုင်ရလဒ်"]
+        msg.append(f"💰 Com ပြီး စုစုပေါင်း: {draw.risk.base}")
+        msg.append("\n🔻 အရှုံးအများဆုံး ဂဏန်းများ:")
+        for n in ranked[:10]:
+            msg.append(f"{n:02d} ➤ {net[n]}")
+        msg.append(f"\n📉 အဆိုးဆုံး: {net[ranked[0]]} ({ranked[0]:02d})")
+        msg.append(f"📈 အကောင်းဆုံး: {net[ranked[-1]]} ({ranked[-1]:02d})")
+        msg.append(f"⚖️ ပျမ်းမျှ: {sum(net) // 100}")
+        msg.append(f"🔴 ဒိုင်အရှုံးဖြစ်မည့် ဂဏန်း: {len(losing)}/100")
+        if losing:
+            msg.append(" ".join(f"{n:02d}" for n in sorted(losing)))
+        
+        await update.message.reply_text("\n".join(msg))
+    except Exception as e:
+        logger.error(f"Error in risk: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
 async def total(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Determine which date to work on
-        date_key = current_working_date if current_working_date else get_current_date_key()
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
             
-        if date_key not in pnumber_per_date:
+        if date_key not in book.pnumber_per_date:
             await update.message.reply_text(f"⚠️ {date_key} အတွက် ကျေးဇူးပြု၍ /pnumber [number] ဖြင့် Power Number သတ်မှတ်ပါ")
             return
             
-        if not user_data:
+        draw = book.draws.get(date_key)
+        if draw is None or not draw.bets:
             await update.message.reply_text("ℹ️ လက်ရှိစာရင်းမရှိပါ")
             return
             
-        pnum = pnumber_per_date[date_key]
-        msg = [f"📊 {date_key} အတွက် စုပေါင်းရလဒ်"]
-        total_net = 0
-        
-        for user, records in user_data.items():
-            if date_key in records:
-                user_total_amt = 0
-                user_pamt = 0
-                
-                for num, amt in records[date_key]:
-                    user_total_amt += amt
-                    if num == pnum:
-                        user_pamt += amt
-                
-                com = com_data.get(user, 0)
-                za = za_data.get(user, 0)
-                
-                commission_amt = (user_total_amt * com) // 100
-                after_com = user_total_amt - commission_amt
-                win_amt = user_pamt * za
-                
-                net = after_com - win_amt
-                status = "ဒိုင်ကပေးရမည်" if net < 0 else "ဒိုင်ကရမည်"
-                
-                user_report = (
-                    f"👤 {user}\n"
-                    f"💵 စုစုပေါင်း: {user_total_amt}\n"
-                    f"📊 Com({com}%) ➤ {commission_amt}\n"
-                    f"💰 Com ပြီး: {after_com}\n"
-                    f"🔢 Power Number({pnum:02d}) ➤ {user_pamt}\n"
-                    f"🎯 Za({za}) ➤ {win_amt}\n"
-                    f"📈 ရလဒ်: {abs(net)} ({status})\n"
-                    "-----------------"
-                )
-                msg.append(user_report)
-                total_net += net
-
+        # Each user's total and power number stake are copied here; the report
+        # is written in a worker. Upstreams settle from their overbuy totals
+        pnum = book.pnumber_per_date[date_key]
+        risk = draw.risk
+        overbuys = draw.overbuys.settlement(pnum)
+        users = []
+        for user in draw.bets:
+            com = book.com_data.get(user, 0)
+            za = book.za_data.get(user, 0)
+            ob_total, ob_power = overbuys.get(user, (0, 0))
+            user_total = risk.totals[user] + ob_total
+            if user_total or user not in overbuys:
+                users.append((user, user_total, risk.stakes[user][pnum] + ob_power, com, za))
+            if user in overbuys:
+                users.append((user, -ob_total, -ob_power, com, za))
+        msg = await run_report(reports.total_report, str(date_key), pnum, users)
         if len(msg) > 1:
-            msg.append(f"\n📊 စုစုပေါင်းရလဒ်: {abs(total_net)} ({'ဒိုင်အရှုံး' if total_net < 0 else 'ဒိုင်အမြတ်'})")
             await update.message.reply_text("\n".join(msg))
         else:
             await update.message.reply_text(f"ℹ️ {date_key} အတွက် ဒေတာမရှိပါ")
@@ -976,49 +2604,479 @@ async def total(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 async def tsent(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Determine which date to work on
-        date_key = current_working_date if current_working_date else get_current_date_key()
+        date_key = book.current_working_date if book.current_working_date else get_current_date_key()
             
-        if not user_data:
+        draw = book.draws.get(date_key)
+        if draw is None or not draw.bets:
             await update.message.reply_text("ℹ️ လက်ရှိ user မရှိပါ")
             return
             
-        for user in user_data:
-            if date_key in user_data[user]:
-                user_report = [f"👤 {user} - {date_key}:"]
-                total_amt = 0
-                
-                for num, amt in user_data[user][date_key]:
-                    user_report.append(f"  - {num:02d} ➤ {amt}")
-                    total_amt += amt
-                
-                user_report.append(f"💵 စုစုပေါင်း: {total_amt}")
-                await update.message.reply_text("\n".join(user_report))
+        users = [(user, tuple(bets)) for user, bets in draw.bets.items()]
+        for text in await run_report(reports.tsent_reports, str(date_key), users):
+            await update.message.reply_text(text)
         
         await update.message.reply_text(f"✅ {date_key} အတွက် စာရင်းများအားလုံး ပေးပို့ပြီးပါပြီ")
     except Exception as e:
         logger.error(f"Error in tsent: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        args = list(context.args)
+        fmt = "csv"
+        if args and args[-1].lower() in ("csv", "xlsx"):
+            fmt = args.pop().lower()
+        if fmt == "xlsx" and openpyxl is None:
+            await update.message.reply_text("⚠️ XLSX အတွက် openpyxl မရှိပါ၊ CSV ဖြင့်ပို့ပါမည်")
+            fmt = "csv"
+            
+        # /export, /export dd/mm/YYYY [AM|PM], /export dd/mm/YYYY dd/mm/YYYY
+        try:
+            if not args:
+                date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+                date_keys = [date_key]
+            elif len(args) == 2 and args[1].upper() in SEGMENTS:
+                date_keys = [Draw.parse(f"{args[0]} {args[1]}")]
+            else:
+                start_day = parse_day(args[0])
+                end_day = parse_day(args[1]) if len(args) > 1 else start_day
+                date_keys = sorted(k for k in get_available_dates(book) if start_day <= k.day <= end_day)
+        except (ValueError, IndexError):
+            await update.message.reply_text("⚠️ Usage: /export [dd/mm/YYYY [AM|PM]] [dd/mm/YYYY] [csv|xlsx]")
+            return
+            
+        # Only the slip references are copied here; rows are built in the writer thread
+        draws = []
+        for k in date_keys:
+            if k in book.draws:
+                draws.append((k, list(book.draws[k].slips.items())))
+            elif k in book.archives:
+                draws.append((k, archive.load_draw(book.archives[k]).iter_slips()))
+        if not draws:
+            await update.message.reply_text("ℹ️ ရွေးထားသည့်နေ့ရက်များအတွက် စာရင်းမရှိပါ")
+            return
+            
+        label = str(date_keys[0]) if len(date_keys) == 1 else f"{date_keys[0]}-{date_keys[-1]}"
+        filename = "export_" + label.replace("/", "-").replace(" ", "_") + f".{fmt}"
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+        os.close(fd)
+        try:
+            count = await asyncio.to_thread(write_export, path, draws, fmt)
+            with open(path, "rb") as f:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=f,
+                    filename=filename,
+                    caption=f"📄 {label}: {count} rows"
+                )
+        finally:
+            os.remove(path)
+    except Exception as e:
+        logger.error(f"Error in export: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+def archive_contents(book, date_key, draw):
+    # Copies taken on the loop, so the writer thread never sees a live dict
+    slips = list(draw.slips.items())
+    users = {slip[0] for _, slip in slips}
+    lots = draw.overbuys
+    meta = {
+        "pnumber": book.pnumber_per_date.get(date_key),
+        "break_limit": book.break_limits.get(date_key),
+        "com": {user: book.com_data.get(user, 0) for user in users},
+        "za": {user: book.za_data.get(user, DEFAULT_ZA) for user in users},
+        "overbuy_list": {user: dict(nums) for user, nums in lots.totals.items()},
+        "overbuy_sums": dict(lots.sums),
+    }
+    return slips, meta
+
+async def archive_draw(book, date_key, attempts=3):
+    # Moves a closed draw out of the live book into its columnar file. A delete,
+    # edit or undo can land while the file is written; the draw is only dropped
+    # once the file matches it, otherwise it is written again
+    draw = book.draws[date_key]
+    path = archive_path(book, date_key)
+    for _ in range(attempts):
+        slips, meta = archive_contents(book, date_key, draw)
+        count = await asyncio.to_thread(archive.write_draw, path, str(date_key), slips, meta)
+        if book.draws.get(date_key) is not draw:
+            # Deleted with /Ddate meanwhile; the file must not bring it back
+            os.remove(path)
+            raise RuntimeError(f"{date_key} was deleted while being archived")
+        if archive_contents(book, date_key, draw) == (slips, meta):
+            break
+    else:
+        raise RuntimeError(f"{date_key} kept changing while being archived")
+    book.drop_live_draw(date_key)
+    book.archives[date_key] = path
+    # Only this path can be stale; every other draw's summary stays cached
+    archive.forget(path)
+    analytics.forget(path)
+    # Summarise right away so history queries never pay for this draw again
+    await asyncio.to_thread(analytics.summarize_draw, path)
+    audit.record("archive", book=book.admin_id, draw=str(date_key), bets=count, path=path)
+    logger.info(f"Archived {date_key} for book {book.admin_id}: {count} bets")
+    return count
+
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        if len(context.args) == 2 and context.args[1].upper() in SEGMENTS:
+            date_key = Draw.parse(" ".join(context.args))
+        else:
+            date_key = book.current_working_date if book.current_working_date else get_current_date_key()
+            
+        if book.date_control.get(date_key, False):
+            await update.message.reply_text(f"⚠️ {date_key} စာရင်းဖွင့်ထားဆဲဖြစ်သည်၊ /dateclose ပြီးမှ archive လုပ်ပါ")
+            return
+        if date_key in book.archives:
+            await update.message.reply_text(f"ℹ️ {date_key} ကို archive လုပ်ပြီးသားဖြစ်သည်")
+            return
+        if date_key not in book.draws:
+            await update.message.reply_text(f"ℹ️ {date_key} အတွက် စာရင်းမရှိပါ")
+            return
+            
+        count = await archive_draw(book, date_key)
+        await update.message.reply_text(f"🗄 {date_key} archive ပြီးပါပြီ ({count} bets)")
+    except Exception as e:
+        logger.error(f"Error in archive_command: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def reply_long(message, lines, max_length=4000):
+    # Telegram message limit ထက်မကျော်အောင် စာပိုဒ်ခွဲပို့ခြင်း
+    current_msg = []
+    current_len = 0
+    for line in lines:
+        line_len = len(line) + 1
+        if current_len + line_len > max_length:
+            await message.reply_text("\n".join(current_msg))
+            current_msg = []
+            current_len = 0
+        current_msg.append(line)
+        current_len += line_len
+    if current_msg:
+        await message.reply_text("\n".join(current_msg))
+
+async def archived_summaries(book, args):
+    # Summaries of all archived draws, or those between one or two dd/mm/YYYY days
+    date_keys = sorted(book.archives)
+    if args:
+        start_day = parse_day(args[0])
+        end_day = parse_day(args[1]) if len(args) > 1 else start_day
+        date_keys = [k for k in date_keys if start_day <= k.day <= end_day]
+    paths = [book.archives[k] for k in date_keys]
+    return await asyncio.to_thread(lambda: [analytics.summarize_draw(path) for path in paths])
+
+async def heat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        try:
+            summaries = await archived_summaries(book, context.args)
+        except ValueError:
+            await update.message.reply_text("⚠️ Usage: /heat [dd/mm/YYYY] [dd/mm/YYYY]")
+            return
+        if not summaries:
+            await update.message.reply_text("ℹ️ Archive လုပ်ထားသည့် စာရင်းမရှိပါ")
+            return
+            
+        stakes, counts = analytics.number_heat(summaries)
+        by_stake = sorted(range(100), key=lambda n: -stakes[n])
+        by_count = sorted(range(100), key=lambda n: -counts[n])
+        
+        msg = [f"🔥 ဂဏန်းအလိုက် လောင်းကြေး ({len(summaries)} ပွဲ)"]
+        msg.append("\n💵 လောင်းကြေးအများဆုံး:")
+        for n in by_stake[:10]:
+            msg.append(f"{n:02d} ➤ {stakes[n]} ({counts[n]} ကြိမ်)")
+        msg.append("\n🔁 အကြိမ်အများဆုံး:")
+        for n in by_count[:10]:
+            msg.append(f"{n:02d} ➤ {counts[n]} ကြိမ် ({stakes[n]})")
+        msg.append("\n🧊 လောင်းကြေးအနည်းဆုံး:")
+        for n in by_stake[-5:]:
+            msg.append(f"{n:02d} ➤ {stakes[n]} ({counts[n]} ကြိမ်)")
+        msg.append(f"\n🎫 Bets: {sum(counts)}  💵 စုစုပေါင်း: {sum(stakes)}")
+        
+        await update.message.reply_text("\n".join(msg))
+    except Exception as e:
+        logger.error(f"Error in heat: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def volume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        try:
+            summaries = await archived_summaries(book, context.args)
+        except ValueError:
+            await update.message.reply_text("⚠️ Usage: /volume [dd/mm/YYYY] [dd/mm/YYYY]")
+            return
+        if not summaries:
+            await update.message.reply_text("ℹ️ Archive လုပ်ထားသည့် စာရင်းမရှိပါ")
+            return
+            
+        volumes = analytics.agent_volume(summaries)
+        ranked = sorted(volumes.items(), key=lambda item: -sum(item[1].values()))
+        
+        msg = [f"👥 Agent အလိုက် လောင်းကြေးပမာဏ ({len(summaries)} ပွဲ)"]
+        for user, months in ranked:
+            msg.append(f"\n👤 {user}: {sum(months.values())}")
+            msg.append(" | ".join(f"{month} ➤ {amount}" for month, amount in sorted(months.items())))
+        
+        await reply_long(update.message, msg)
+    except Exception as e:
+        logger.error(f"Error in volume: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def pnl(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        try:
+            summaries = await archived_summaries(book, context.args)
+        except ValueError:
+            await update.message.reply_text("⚠️ Usage: /pnl [dd/mm/YYYY] [dd/mm/YYYY]")
+            return
+        if not summaries:
+            await update.message.reply_text("ℹ️ Archive လုပ်ထားသည့် စာရင်းမရှိပါ")
+            return
+            
+        draws, months = analytics.dealer_pnl(summaries, {str(k): v for k, v in book.pnumber_per_date.items()})
+        
+        msg = [f"📈 ပွဲအလိုက် ဒိုင်ရလဒ် ({len(summaries)} ပွဲ)"]
+        for date_key, pnumber, net in draws:
+            if net is None:
+                msg.append(f"{date_key} ➤ Power Number မသတ်မှတ်ရသေး")
+            else:
+                msg.append(f"{date_key} [P: {pnumber:02d}] ➤ {net}")
+        msg.append("\n📅 လအလိုက်:")
+        for month, net in sorted(months.items()):
+            msg.append(f"{month} ➤ {net}")
+        total_net = sum(months.values())
+        overall_status = "ဒိုင်အရှုံး" if total_net < 0 else "ဒိုင်အမြတ်"
+        msg.append(f"\n📈 စုစုပေါင်းရလဒ်: {abs(total_net)}({overall_status})")
+        
+        await reply_long(update.message, msg)
+    except Exception as e:
+        logger.error(f"Error in pnl: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+FIND_PAGE = 20  # Matches per /find page
+
+def parse_find_args(args):
+    # Filters in any order: user, 2-digit number, one or two dd/mm/YYYY days,
+    # AM/PM and an amount range written MIN-MAX or MIN-
+    query = {"user": None, "num": None, "first": None, "last": None, "segment": None, "amounts": (0, None)}
+    days = []
+    for arg in args:
+        if arg.upper() in SEGMENTS:
+            query["segment"] = arg.upper()
+        elif re.fullmatch(r"\d{1,2}/\d{1,2}/\d{4}", arg):
+            days.append(parse_day(arg))
+        elif re.fullmatch(r"\d{1,2}", arg):
+            query["num"] = int(arg)
+        elif re.fullmatch(r"\d+-\d*", arg):
+            low, high = arg.split("-")
+            query["amounts"] = (int(low), int(high) if high else None)
+        else:
+            query["user"] = arg.lstrip("@")
+    if days:
+        query["first"] = Draw.of(min(days), SEGMENTS[0])
+        query["last"] = Draw.of(max(days), SEGMENTS[-1])
+    return query
+
+def find_draws(book, query):
+    # Newest first; live draws and archived ones never overlap
+    keys = set(book.draws) | set(book.archives)
+    first, last, segment = query["first"], query["last"], query["segment"]
+    return sorted((k for k in keys
+                   if (first is None or k >= first) and (last is None or k <= last)
+                   and (segment is None or k.segment == segment)), reverse=True)
+
+def find_live(book, date_key, query):
+    # Candidate slips come from the user or number index, never a full draw scan
+    user, num = query["user"], query["num"]
+    low, high = query["amounts"]
+    draw = book.draws.get(date_key)
+    if draw is None:
+        return []
+    slips = draw.slips
+    if user is not None:
+        slip_ids = draw.slip_index.get(user, {})
+    elif num is not None:
+        slip_ids = draw.number_index.get(num, {})
+    else:
+        slip_ids = slips
+    rows = []
+    for slip_id in slip_ids:
+        username, timestamp, bets, is_overbuy = slips[slip_id]
+        for n, amt in bets:
+            if (num is None or n == num) and low <= amt and (high is None or amt <= high):
+                rows.append((date_key, timestamp, username, n, amt, is_overbuy))
+    rows.sort(key=lambda row: row[1])
+    return rows
+
+def find_archived(draws, query):
+    # Runs in a worker thread; each archive's number/user index picks the rows
+    low, high = query["amounts"]
+    found = {}
+    for date_key, path in draws:
+        draw = archive.load_draw(path)
+        users = draw.usernames
+        slips = draw.meta["slips"]
+        rows = found[date_key] = []
+        for row in draw.find_rows(query["user"], query["num"]):
+            amt = draw.amounts[row]
+            if low <= abs(amt) and (high is None or abs(amt) <= high):
+                slip = slips[draw.slip_column[row]]
+                rows.append((date_key, slip[2], users[draw.user_column[row]], draw.numbers[row], abs(amt), amt < 0))
+    return found
+
+def find_page(rows, page):
+    pages = max(1, math.ceil(len(rows) / FIND_PAGE))
+    page = min(max(page, 0), pages - 1)
+    lines = [f"🔎 ရှာတွေ့မှု {len(rows)} ခု (စာမျက်နှာ {page + 1}/{pages})"]
+    for date_key, timestamp, username, num, amt, is_overbuy in rows[page * FIND_PAGE:(page + 1) * FIND_PAGE]:
+        clock = datetime.fromtimestamp(timestamp, MYANMAR_TIMEZONE).strftime("%H:%M")
+        lines.append(f"{date_key} {clock} {username} {num:02d}-{amt}" + (" (OB)" if is_overbuy else ""))
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"find_page:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"find_page:{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book:
+            await update.message.reply_text("❌ Book နှင့်မချိတ်ရသေးပါ။ /join [book id] ဖြင့်ချိတ်ပါ")
+            return
+            
+        if not context.args:
+            await update.message.reply_text(
+                "ℹ️ Usage: /find [user] [number] [dd/mm/YYYY] [dd/mm/YYYY] [AM|PM] [min-max]\n"
+                "ဥပမာ: /find agent01 37 12/05/2026 PM"
+            )
+            return
+        try:
+            query = parse_find_args(context.args)
+        except ValueError:
+            await update.message.reply_text("⚠️ နေ့စွဲကို dd/mm/YYYY ပုံစံဖြင့်ထည့်ပါ")
+            return
+        # Agents can only look up their own bets
+        if update.effective_user.id != book.admin_id:
+            if not update.effective_user.username:
+                await update.message.reply_text("❌ ကျေးဇူးပြု၍ Telegram username သတ်မှတ်ပါ")
+                return
+            query["user"] = update.effective_user.username
+            
+        date_keys = find_draws(book, query)
+        archived = [(k, book.archives[k]) for k in date_keys if k in book.archives]
+        found = await asyncio.to_thread(find_archived, archived, query) if archived else {}
+        rows = []
+        for date_key in date_keys:
+            rows.extend(found[date_key] if date_key in found else find_live(book, date_key, query))
+                
+        if not rows:
+            await update.message.reply_text("ℹ️ ကိုက်ညီသည့် လောင်းကြေးမရှိပါ")
+            return
+        context.user_data['find_results'] = rows
+        text, reply_markup = find_page(rows, 0)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Error in find: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def find_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    try:
+        rows = context.user_data.get('find_results')
+        if not rows:
+            await query.edit_message_text("❌ ဒေတာမတွေ့ပါ၊ /find ကိုပြန်ရိုက်ပါ")
+            return
+        text, reply_markup = find_page(rows, int(query.data.split(':')[1]))
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Error in find_page_callback: {str(e)}")
+        await query.edit_message_text("❌ Error occurred")
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        # /audit [user] [event] [dd/mm/YYYY [AM|PM]] [count], in any order
+        user = event = day = segment = None
+        limit = 30
+        for arg in context.args:
+            if arg in audit.EVENTS:
+                event = arg
+            elif re.fullmatch(r"\d{1,2}/\d{1,2}/\d{4}", arg):
+                day = parse_day(arg)
+            elif arg.upper() in SEGMENTS:
+                segment = arg.upper()
+            elif arg.isdigit():
+                limit = min(int(arg), 200)
+            else:
+                user = arg.lstrip("@")
+        draw = None
+        if day is not None:
+            draw = str(Draw.of(day, segment)) if segment else f"{day:%d/%m/%Y}"
+            
+        entries = await asyncio.to_thread(audit.query, AUDIT_LOG, book=book.admin_id, user=user, event=event, draw=draw, limit=limit)
+        if not entries:
+            await update.message.reply_text("ℹ️ ကိုက်ညီသည့် မှတ်တမ်းမရှိပါ\nEvents: " + ", ".join(audit.EVENTS))
+            return
+        lines = [f"🧾 Audit - နောက်ဆုံး {len(entries)} ခု"]
+        lines.extend(audit.describe(entry, MYANMAR_TIMEZONE) for entry in entries)
+        await reply_long(update.message, lines)
+    except Exception as e:
+        logger.error(f"Error in audit_command: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
 async def alldata(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
-        if not user_data:
+        users = book.users()
+        if not users:
             await update.message.reply_text("ℹ️ လက်ရှိစာရင်းမရှိပါ")
             return
             
         msg = ["👥 မှတ်ပုံတင်ထားသော user များ:"]
-        msg.extend([f"• {user}" for user in user_data.keys()])
+        msg.extend([f"• {user}" for user in users])
         
         await update.message.reply_text("\n".join(msg))
     except Exception as e:
@@ -1026,39 +3084,151 @@ async def alldata(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 async def reset_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id, user_data, ledger, za_data, com_data, date_control, overbuy_list, overbuy_selections, break_limits, pnumber_per_date, current_working_date
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
-        user_data = {}
-        ledger = {}
-        za_data = {}
-        com_data = {}
-        date_control = {}
-        overbuy_list = {}
-        overbuy_selections = {}
-        break_limits = {}
-        pnumber_per_date = {}
-        current_working_date = get_current_date_key()
-        
-        await update.message.reply_text("✅ ဒေတာများအားလုံးကို ပြန်လည်သုတ်သင်ပြီး လက်ရှိနေ့သို့ပြန်လည်သတ်မှတ်ပြီးပါပြီ")
+        # Keep a way back: /restore last brings this state back
+        folder = os.path.join(SNAPSHOT_DIR, str(book.admin_id))
+        os.makedirs(folder, exist_ok=True)
+        stamp = datetime.now(MYANMAR_TIMEZONE).strftime("%Y%m%d-%H%M%S")
+        snapshot_path = os.path.join(folder, f"pre-reset-{stamp}.kksnap")
+        await write_book_snapshot(book, snapshot_path)
+        audit.record("reset", book=book.admin_id, snapshot=snapshot_path, by=update.effective_user.id)
+        
+        book.draws = {}
+        book.message_store = {}
+        book.pending_alerts = {}
+        book.za_data = {}
+        book.com_data = {}
+        book.date_control = {}
+        book.break_limits = {}
+        book.pnumber_per_date = {}
+        book.number_caps = {}
+        book.agent_caps = {}
+        book.closed_at = {}
+        book.credit_limits = {}
+        book.balances = {}
+        for path in book.archives.values():
+            if os.path.exists(path):
+                os.remove(path)
+        book.archives = {}
+        book.current_working_date = get_current_date_key()
+        
+        schedule_board(book, context.bot)
+        await update.message.reply_text("✅ ဒေတာများအားလုံးကို ပြန်လည်သုတ်သင်ပြီး လက်ရှိနေ့သို့ပြန်လည်သတ်မှတ်ပြီးပါပြီ\n↩️ ပြန်ယူရန်: /restore last")
     except Exception as e:
         logger.error(f"Error in reset_data: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        fd, path = tempfile.mkstemp(suffix=".kksnap")
+        os.close(fd)
+        try:
+            size, slips = await write_book_snapshot(book, path)
+            stamp = datetime.now(MYANMAR_TIMEZONE).strftime("%Y%m%d-%H%M%S")
+            with open(path, "rb") as f:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=f,
+                    filename=f"book_{book.admin_id}_{stamp}.kksnap",
+                    caption=f"💾 Backup: {slips} slips, {len(book.archives)} archived, {size / 1024:.1f} KB\n↩️ ပြန်ယူရန်: ဤဖိုင်ကို /restore ဖြင့် reply လုပ်ပါ"
+                )
+        finally:
+            os.remove(path)
+    except Exception as e:
+        logger.error(f"Error in backup: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def restore_from(update, context, path):
+    # Staged next to the archives so moving the files in is a rename
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".restore-", dir=ARCHIVE_DIR)
+    try:
+        new_book, staged = await asyncio.to_thread(restore_book, path, staging)
+        if new_book.admin_id != update.effective_user.id:
+            await update.message.reply_text("❌ ဤ backup သည် သင့် book မဟုတ်ပါ")
+            return
+        new_book.chats.add(update.effective_chat.id)
+        install_book(new_book, staged)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    bets = sum(len(bets) for draw in new_book.draws.values() for bets in draw.bets.values())
+    audit.record("restore", book=new_book.admin_id, bets=bets, archived=len(new_book.archives), by=update.effective_user.id)
+    await update.message.reply_text(f"✅ Book {new_book.admin_id} ကို ပြန်ယူပြီးပါပြီ ({bets} bets, {len(new_book.archives)} archived)")
+
+async def restore_document_file(update, context, document):
+    fd, path = tempfile.mkstemp(suffix=".kksnap")
+    os.close(fd)
+    try:
+        file = await context.bot.get_file(document.file_id)
+        await file.download_to_drive(path)
+        await restore_from(update, context, path)
+    finally:
+        os.remove(path)
+
+async def restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = update.effective_user.id
+        book = books.get(user_id)
+        if not book or get_book(update) is not book:
+            await update.message.reply_text("❌ Admin only command")
+            return
+            
+        if context.args and context.args[0].lower() == "last":
+            folder = os.path.join(SNAPSHOT_DIR, str(user_id))
+            names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+            if not names:
+                await update.message.reply_text("ℹ️ သိမ်းထားသည့် snapshot မရှိပါ")
+                return
+            await restore_from(update, context, os.path.join(folder, names[-1]))
+            return
+            
+        replied = update.message.reply_to_message
+        if replied and replied.document:
+            await restore_document_file(update, context, replied.document)
+            return
+            
+        context.user_data['awaiting_restore'] = True
+        await update.message.reply_text("📎 Backup ဖိုင် (.kksnap) ကို ပို့ပါ")
+    except Exception as e:
+        logger.error(f"Error in restore: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
+async def restore_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if not context.user_data.pop('awaiting_restore', False):
+            return
+        await restore_document_file(update, context, update.message.document)
+    except Exception as e:
+        logger.error(f"Error in restore_document: {str(e)}")
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+
 async def posthis(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
-        is_admin = user.id == admin_id
+        book = get_book(update)
+        if not book:
+            await update.message.reply_text("❌ Book နှင့်မချိတ်ရသေးပါ။ /join [book id] ဖြင့်ချိတ်ပါ")
+            return
+            
+        is_admin = user.id == book.admin_id
         
         if is_admin and not context.args:
-            if not user_data:
+            users = known_users(book)
+            if not users:
                 await update.message.reply_text("ℹ️ လက်ရှိ user မရှိပါ")
                 return
                 
-            keyboard = [[InlineKeyboardButton(u, callback_data=f"posthis:{u}")] for u in user_data.keys()]
+            keyboard = [[InlineKeyboardButton(u, callback_data=f"posthis:{u}")] for u in users]
             await update.message.reply_text(
                 "ဘယ် user ရဲ့စာရင်းကိုကြည့်မလဲ?",
                 reply_markup=InlineKeyboardMarkup(keyboard)
@@ -1071,50 +3241,14 @@ async def posthis(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ User မရှိပါ")
             return
             
-        if username not in user_data:
+        # Admin can see all dates, non-admin only the current one
+        draws = history_draws(book, username, None if is_admin else get_current_date_key())
+        if not draws:
             await update.message.reply_text(f"ℹ️ {username} အတွက် စာရင်းမရှိပါ")
             return
             
-        # For non-admin, show current date only
-        date_key = get_current_date_key() if not is_admin else None
-        
-        msg = [f"📊 {username} ရဲ့လောင်းကြေးမှတ်တမ်း"]
-        total_amount = 0
-        pnumber_total = 0
-        
-        if is_admin:
-            # Admin can see all dates
-            for date_key in user_data[username]:
-                pnum = pnumber_per_date.get(date_key, None)
-                pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
-                
-                msg.append(f"\n📅 {date_key}{pnum_str}:")
-                for num, amt in user_data[username][date_key]:
-                    if pnum is not None and num == pnum:
-                        msg.append(f"🔴 {num:02d} ➤ {amt} 🔴")
-                        pnumber_total += amt
-                    else:
-                        msg.append(f"{num:02d} ➤ {amt}")
-                    total_amount += amt
-        else:
-            # Non-admin only sees current date
-            if date_key in user_data[username]:
-                pnum = pnumber_per_date.get(date_key, None)
-                pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
-                
-                msg.append(f"\n📅 {date_key}{pnum_str}:")
-                for num, amt in user_data[username][date_key]:
-                    if pnum is not None and num == pnum:
-                        msg.append(f"🔴 {num:02d} ➤ {amt} 🔴")
-                        pnumber_total += amt
-                    else:
-                        msg.append(f"{num:02d} ➤ {amt}")
-                    total_amount += amt
-        
+        msg = await run_report(reports.history_report, username, draws)
         if len(msg) > 1:
-            msg.append(f"\n💵 စုစုပေါင်း: {total_amount}")
-            if pnumber_total > 0:
-                msg.append(f"🔴 Power Number စုစုပေါင်း: {pnumber_total}")
             await update.message.reply_text("\n".join(msg))
         else:
             await update.message.reply_text(f"ℹ️ {username} အတွက် စာရင်းမရှိပါ")
@@ -1128,29 +3262,16 @@ async def posthis_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        _, username = query.data.split(':')
-        msg = [f"📊 {username} ရဲ့လောင်းကြေးမှတ်တမ်း"]
-        total_amount = 0
-        pnumber_total = 0
-        
-        if username in user_data:
-            for date_key in user_data[username]:
-                pnum = pnumber_per_date.get(date_key, None)
-                pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
-                
-                msg.append(f"\n📅 {date_key}{pnum_str}:")
-                for num, amt in user_data[username][date_key]:
-                    if pnum is not None and num == pnum:
-                        msg.append(f"🔴 {num:02d} ➤ {amt} 🔴")
-                        pnumber_total += amt
-                    else:
-                        msg.append(f"{num:02d} ➤ {amt}")
-                    total_amount += amt
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
             
+        _, username = query.data.split(':')
+        draws = history_draws(book, username)
+        if draws:
+            msg = await run_report(reports.history_report, username, draws)
             if len(msg) > 1:
-                msg.append(f"\n💵 စုစုပေါင်း: {total_amount}")
-                if pnumber_total > 0:
-                    msg.append(f"🔴 Power Number စုစုပေါင်း: {pnumber_total}")
                 await query.edit_message_text("\n".join(msg))
             else:
                 await query.edit_message_text(f"ℹ️ {username} အတွက် စာရင်းမရှိပါ")
@@ -1162,14 +3283,14 @@ async def posthis_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Error occurred")
 
 async def dateall(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
-        # Get all unique dates from user_data
-        all_dates = get_available_dates()
+        # Get all unique dates from live and archived draws
+        all_dates = get_available_dates(book)
         
         if not all_dates:
             await update.message.reply_text("ℹ️ မည်သည့်စာရင်းမှ မရှိသေးပါ")
@@ -1184,12 +3305,12 @@ async def dateall(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = []
         
         for date in all_dates:
-            pnum = pnumber_per_date.get(date, None)
+            pnum = book.pnumber_per_date.get(date, None)
             pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
             
             is_selected = dateall_selections[date]
             button_text = f"{date}{pnum_str} {'✅' if is_selected else '⬜'}"
-            buttons.append([InlineKeyboardButton(button_text, callback_data=f"dateall_toggle:{date}")])
+            buttons.append([InlineKeyboardButton(button_text, callback_data=f"dateall_toggle:{int(date)}")])
         
         buttons.append([InlineKeyboardButton("👁‍🗨 View", callback_data="dateall_view")])
         reply_markup = InlineKeyboardMarkup(buttons)
@@ -1205,7 +3326,13 @@ async def dateall_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        _, date_key = query.data.split(':')
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        _, date_str = query.data.split(':')
+        date_key = Draw.parse(date_str)
         dateall_selections = context.user_data.get('dateall_selections', {})
         
         if date_key not in dateall_selections:
@@ -1221,12 +3348,12 @@ async def dateall_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = []
         
         for date in dateall_selections.keys():
-            pnum = pnumber_per_date.get(date, None)
+            pnum = book.pnumber_per_date.get(date, None)
             pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
             
             is_selected = dateall_selections[date]
             button_text = f"{date}{pnum_str} {'✅' if is_selected else '⬜'}"
-            buttons.append([InlineKeyboardButton(button_text, callback_data=f"dateall_toggle:{date}")])
+            buttons.append([InlineKeyboardButton(button_text, callback_data=f"dateall_toggle:{int(date)}")])
         
         buttons.append([InlineKeyboardButton("👁‍🗨 View", callback_data="dateall_view")])
         reply_markup = InlineKeyboardMarkup(buttons)
@@ -1242,6 +3369,11 @@ async def dateall_view(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         dateall_selections = context.user_data.get('dateall_selections', {})
         selected_dates = [date for date, selected in dateall_selections.items() if selected]
         
@@ -1249,141 +3381,38 @@ async def dateall_view(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("⚠️ မည်သည့်နေ့ရက်ကိုမှ မရွေးချယ်ထားပါ")
             return
             
-        user_reports = []
-        total_bets = 0
-        total_power = 0
-        total_net = 0
-
-        # ရိုးရိုး user များအတွက် တွက်ချက်ခြင်း
-        for user in user_data:
-            user_total = 0
-            user_power = 0
-            
-            for date in selected_dates:
-                if date in user_data[user]:
-                    for num, amt in user_data[user][date]:
-                        user_total += amt
-                        if date in pnumber_per_date and num == pnumber_per_date[date]:
-                            user_power += amt
-            
-            if user_total > 0:
-                com = com_data.get(user, 0)
-                za = za_data.get(user, 80)  # Default Za 80
-                
-                commission = (user_total * com) // 100
-                after_com = user_total - commission
-                win_amount = user_power * za
-                net = after_com - win_amount
-                
-                user_reports.append({
-                    'username': user,
-                    'total': user_total,
-                    'commission': commission,
-                    'after_com': after_com,
-                    'power_total': user_power,
-                    'win_amount': win_amount,
-                    'net': net,
-                    'is_overbuy': False
-                })
-                
-                total_bets += user_total
-                total_power += user_power
-                total_net += net
-
-        # Overbuy user များအတွက် တွက်ချက်ခြင်း
-        for date in selected_dates:
-            if date in overbuy_list:
-                for user, overbuys in overbuy_list[date].items():
-                    user_total = 0
-                    user_power = 0
-                    
-                    for num, amt in overbuys.items():
-                        user_total += abs(amt)
-                        if date in pnumber_per_date and num == pnumber_per_date[date]:
-                            user_power += abs(amt)
-                    
-                    if user_total > 0:
-                        com = com_data.get(user, 0)
-                        za = za_data.get(user, 80)
-                        
-                        commission = (user_total * com) // 100
-                        after_com = user_total - commission
-                        win_amount = user_power * za
-                        net = after_com - win_amount
-                        
-                        user_reports.append({
-                            'username': user,
-                            'total': -user_total,  # Overbuy ဖြစ်ကြောင်း ပြသရန် -
-                            'commission': -commission,
-                            'after_com': -after_com,
-                            'power_total': -user_power,
-                            'win_amount': -win_amount,
-                            'net': net,
-                            'is_overbuy': True
-                        })
-                        
-                        total_bets -= user_total
-                        total_power -= user_power
-                        total_net += net
-
-        # အစီရင်ခံစာတည်ဆောက်ခြင်း
-        msg = [f"📊 ရွေးချယ်ထားသည့် နေ့ရက်များ စုပေါင်းရလဒ်:"]
-        msg.append(f"📅 နေ့ရက်များ: {', '.join(selected_dates)}\n")
-        
-        for report in user_reports:
-            if report['is_overbuy']:
-                msg.append(f"👤 {report['username']}(overbuy အမည်)")
-            else:
-                msg.append(f"👤 {report['username']}:(ရိုးရိုးuser)")
-            
-            msg.append(f"💵 စုစုပေါင်း: {report['total']}")
-            msg.append(f"📊 Com({com_data.get(report['username'], 0)}%) ➤ {report['commission']}")
-            msg.append(f"💰 Com ပြီး: {report['after_com']}")
-            
-            if report['power_total'] != 0:
-                msg.append(f"🔢 Power Number စုစုပေါင်း: {report['power_total']}")
-                msg.append(f"🎯 Za({za_data.get(report['username'], 80)}) ➤ {report['win_amount']}")
-            
-            status = "ဒိုင်ကပေးရမည်" if report['net'] < 0 else "ဒိုင်ကရမည်"
-            msg.append(f"📈 ရလဒ်: {abs(report['net'])} ({status})")
-            msg.append("-----------------")
-
-        # စုစုပေါင်းရလဒ်
-        msg.append("\n📊 စုစုပေါင်း:")
-        msg.append(f"💵 လောင်းကြေးစုစုပေါင်း: {total_bets}")
-        
-        if total_power != 0:
-            msg.append(f"🔴 Power Number စုစုပေါင်း: {total_power}")
-        
-        overall_status = "ဒိုင်အရှုံး" if total_net < 0 else "ဒိုင်အမြတ်"
-        msg.append(f"📈 စုစုပေါင်းရလဒ်: {abs(total_net)}({overall_status})")
-
-
-             # Telegram message limit ထက်မကျော်အောင် စာပိုဒ်ခွဲပို့ခြင်း
-        max_length = 4000
-        current_msg = []
-        current_len = 0
-        
-        for line in msg:
-            line_len = len(line) + 1
-            if current_len + line_len > max_length:
-                await context.bot.send_message(chat_id=query.message.chat_id, text="\n".join(current_msg))
-                current_msg = []
-                current_len = 0
-            current_msg.append(line)
-            current_len += line_len
-        
-        if current_msg:
-            await query.edit_message_text("\n".join(current_msg))
+        # Live draws are copied as per-user (total, power number stake), with
+        # upstreams taken from their overbuy totals; archived ones are read by
+        # the worker, which also writes the report
+        draws = []
+        for date_key in selected_dates:
+            pnum = book.pnumber_per_date.get(date_key)
+            if date_key in book.archives:
+                draws.append((pnum, book.archives[date_key], None))
+                continue
+            draw = book.draws.get(date_key)
+            if draw is None:
+                continue
+            risk = draw.risk
+            overbuys = draw.overbuys.settlement(pnum)
+            rows = {}
+            for user in draw.bets:
+                ob_total, ob_power = overbuys.get(user, (0, 0))
+                power = risk.stakes[user][pnum] + ob_power if pnum is not None else 0
+                rows[user] = (risk.totals[user] + ob_total, power)
+            draws.append((pnum, rows, overbuys))
+        msg = await run_report(reports.dateall_report, [str(k) for k in selected_dates], draws,
+                               dict(book.com_data), dict(book.za_data))
+        await reply_long(query.message, msg)
         
     except Exception as e:
         logger.error(f"Error in dateall_view: {str(e)}")
         await query.edit_message_text("❌ Error occurred")
 
 async def change_working_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
         
@@ -1478,7 +3507,11 @@ async def set_am_pm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        global current_working_date
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         time_segment = "AM" if "am" in query.data else "PM"
         date_str = context.user_data.get('selected_date', '')
         
@@ -1486,20 +3519,25 @@ async def set_am_pm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("❌ Error: Date not selected")
             return
             
-        current_working_date = f"{date_str} {time_segment}"
-        await query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
+        book.current_working_date = Draw.of(parse_day(date_str), time_segment)
+        schedule_board(book, context.bot)
+        await query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {book.current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
         
     except Exception as e:
         logger.error(f"Error in set_am_pm: {str(e)}")
         await query.edit_message_text("❌ Error occurred")
 
 async def set_am(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global current_working_date
     try:
-        if current_working_date:
-            date_part = current_working_date.split()[0]
-            current_working_date = f"{date_part} AM"
-            await update.callback_query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
+        book = get_book(update)
+        if not book:
+            await update.callback_query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        if book.current_working_date:
+            book.current_working_date = book.current_working_date.with_segment("AM")
+            schedule_board(book, context.bot)
+            await update.callback_query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {book.current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
         else:
             await update.callback_query.edit_message_text("❌ လက်ရှိနေ့ရက် သတ်မှတ်ထားခြင်းမရှိပါ")
     except Exception as e:
@@ -1507,12 +3545,16 @@ async def set_am(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.edit_message_text("❌ Error occurred")
 
 async def set_pm(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global current_working_date
     try:
-        if current_working_date:
-            date_part = current_working_date.split()[0]
-            current_working_date = f"{date_part} PM"
-            await update.callback_query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
+        book = get_book(update)
+        if not book:
+            await update.callback_query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        if book.current_working_date:
+            book.current_working_date = book.current_working_date.with_segment("PM")
+            schedule_board(book, context.bot)
+            await update.callback_query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {book.current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
         else:
             await update.callback_query.edit_message_text("❌ လက်ရှိနေ့ရက် သတ်မှတ်ထားခြင်းမရှိပါ")
     except Exception as e:
@@ -1524,9 +3566,14 @@ async def open_current_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        global current_working_date
-        current_working_date = get_current_date_key()
-        await query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        book.current_working_date = get_current_date_key()
+        schedule_board(book, context.bot)
+        await query.edit_message_text(f"✅ လက်ရှိ အလုပ်လုပ်ရမည့်နေ့ရက်ကို {book.current_working_date} အဖြစ်ပြောင်းလိုက်ပါပြီ")
     except Exception as e:
         logger.error(f"Error in open_current_date: {str(e)}")
         await query.edit_message_text("❌ Error occurred")
@@ -1542,14 +3589,14 @@ async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await change_working_date(update, context)
 
 async def delete_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global admin_id
     try:
-        if update.effective_user.id != admin_id:
+        book = get_book(update)
+        if not book or update.effective_user.id != book.admin_id:
             await update.message.reply_text("❌ Admin only command")
             return
             
         # Get all available dates
-        available_dates = get_available_dates()
+        available_dates = get_available_dates(book)
         
         if not available_dates:
             await update.message.reply_text("ℹ️ မည်သည့်စာရင်းမှ မရှိသေးပါ")
@@ -1564,12 +3611,12 @@ async def delete_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = []
         
         for date in available_dates:
-            pnum = pnumber_per_date.get(date, None)
+            pnum = book.pnumber_per_date.get(date, None)
             pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
             
             is_selected = datedelete_selections[date]
             button_text = f"{date}{pnum_str} {'✅' if is_selected else '⬜'}"
-            buttons.append([InlineKeyboardButton(button_text, callback_data=f"datedelete_toggle:{date}")])
+            buttons.append([InlineKeyboardButton(button_text, callback_data=f"datedelete_toggle:{int(date)}")])
         
         buttons.append([InlineKeyboardButton("✅ Delete Selected", callback_data="datedelete_confirm")])
         reply_markup = InlineKeyboardMarkup(buttons)
@@ -1585,7 +3632,13 @@ async def datedelete_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     try:
-        _, date_key = query.data.split(':')
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
+        _, date_str = query.data.split(':')
+        date_key = Draw.parse(date_str)
         datedelete_selections = context.user_data.get('datedelete_selections', {})
         
         if date_key not in datedelete_selections:
@@ -1601,12 +3654,12 @@ async def datedelete_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = []
         
         for date in datedelete_selections.keys():
-            pnum = pnumber_per_date.get(date, None)
+            pnum = book.pnumber_per_date.get(date, None)
             pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
             
             is_selected = datedelete_selections[date]
             button_text = f"{date}{pnum_str} {'✅' if is_selected else '⬜'}"
-            buttons.append([InlineKeyboardButton(button_text, callback_data=f"datedelete_toggle:{date}")])
+            buttons.append([InlineKeyboardButton(button_text, callback_data=f"datedelete_toggle:{int(date)}")])
         
         buttons.append([InlineKeyboardButton("✅ Delete Selected", callback_data="datedelete_confirm")])
         reply_markup = InlineKeyboardMarkup(buttons)
@@ -1622,6 +3675,11 @@ async def datedelete_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     try:
+        book = get_book(update)
+        if not book:
+            await query.edit_message_text("❌ Book မတွေ့ပါ")
+            return
+            
         datedelete_selections = context.user_data.get('datedelete_selections', {})
         
         # Get selected dates
@@ -1633,70 +3691,82 @@ async def datedelete_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE)
             
         # Delete data for selected dates
         for date_key in selected_dates:
-            # Remove from user_data
-            for user in list(user_data.keys()):
-                if date_key in user_data[user]:
-                    del user_data[user][date_key]
-                # Remove user if no dates left
-                if not user_data[user]:
-                    del user_data[user]
-            
-            # Remove from ledger
-            if date_key in ledger:
-                del ledger[date_key]
+            draw = book.drop_live_draw(date_key)
+            users = tuple(draw.bets) if draw else ()
+            bets = sum(len(bets) for bets in draw.bets.values()) if draw else 0
             
             # Remove from break_limits
-            if date_key in break_limits:
-                del break_limits[date_key]
+            if date_key in book.break_limits:
+                del book.break_limits[date_key]
             
             # Remove from pnumber_per_date
-            if date_key in pnumber_per_date:
-                del pnumber_per_date[date_key]
+            if date_key in book.pnumber_per_date:
+                del book.pnumber_per_date[date_key]
             
             # Remove from date_control
-            if date_key in date_control:
-                del date_control[date_key]
-            
-            # Remove from overbuy_list
-            if date_key in overbuy_list:
-                del overbuy_list[date_key]
-            
-            # Remove from overbuy_selections
-            if date_key in overbuy_selections:
-                del overbuy_selections[date_key]
+            if date_key in book.date_control:
+                del book.date_control[date_key]
+            book.closed_at.pop(date_key, None)
+            
+            # Remove the archive file
+            path = book.archives.pop(date_key, None)
+            if path and os.path.exists(path):
+                archived = archive.load_draw(path)
+                users = tuple(archived.meta["users"])
+                bets = len(archived.amounts)
+                archive.forget(path)
+                analytics.forget(path)
+                os.remove(path)
+            audit.record("datedelete", book=book.admin_id, draw=str(date_key), users=users, bets=bets,
+                         archived=path is not None, by=query.from_user.id)
         
         # Clear current working date if it was deleted
-        global current_working_date
-        if current_working_date in selected_dates:
-            current_working_date = None
+        if book.current_working_date in selected_dates:
+            book.current_working_date = None
         
-        await query.edit_message_text(f"✅ အောက်ပါနေ့ရက်များ ဖျက်ပြီးပါပြီ:\n{', '.join(selected_dates)}")
+        await query.edit_message_text(f"✅ အောက်ပါနေ့ရက်များ ဖျက်ပြီးပါပြီ:\n{', '.join(map(str, selected_dates))}")
         
     except Exception as e:
         logger.error(f"Error in datedelete_confirm: {str(e)}")
         await query.edit_message_text("❌ Error occurred")
 
 
-if __name__ == "__main__":
-    if not TOKEN:
-        raise ValueError("❌ BOT_TOKEN environment variable is not set")
-        
-    app = ApplicationBuilder().token(TOKEN).build()
-
+def register_handlers(app):
     # Command handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("menu", show_menu))
+    app.add_handler(CommandHandler("join", join))
+    app.add_handler(CommandHandler("bookinfo", bookinfo))
+    app.add_handler(CommandHandler("schedule", schedule))
     app.add_handler(CommandHandler("dateopen", dateopen))
     app.add_handler(CommandHandler("dateclose", dateclose))
     app.add_handler(CommandHandler("ledger", ledger_summary))
+    app.add_handler(CommandHandler("board", board))
     app.add_handler(CommandHandler("break", break_command))
+    app.add_handler(CommandHandler("alert", alert_levels))
+    app.add_handler(CommandHandler("credit", credit))
+    app.add_handler(CommandHandler("undo", undo))
+    app.add_handler(CommandHandler("rollback", rollback))
+    app.add_handler(CommandHandler("cap", cap_command))
+    app.add_handler(CommandHandler("agentcap", agentcap_command))
     app.add_handler(CommandHandler("overbuy", overbuy))
+    app.add_handler(CommandHandler("hedge", hedge))
     app.add_handler(CommandHandler("pnumber", pnumber))
     app.add_handler(CommandHandler("comandza", comandza))
     app.add_handler(CommandHandler("total", total))
+    app.add_handler(CommandHandler("risk", risk))
     app.add_handler(CommandHandler("tsent", tsent))
     app.add_handler(CommandHandler("alldata", alldata))
+    app.add_handler(CommandHandler("export", export))
+    app.add_handler(CommandHandler("archive", archive_command))
+    app.add_handler(CommandHandler("heat", heat))
+    app.add_handler(CommandHandler("volume", volume))
+    app.add_handler(CommandHandler("pnl", pnl))
+    app.add_handler(CommandHandler("find", find))
+    app.add_handler(CommandHandler("audit", audit_command))
     app.add_handler(CommandHandler("reset", reset_data))
+    app.add_handler(CommandHandler("backup", backup))
+    app.add_handler(CommandHandler("restore", restore))
     app.add_handler(CommandHandler("posthis", posthis))
     app.add_handler(CommandHandler("dateall", dateall))
     app.add_handler(CommandHandler("Cdate", change_working_date))
@@ -1707,6 +3777,9 @@ if __name__ == "__main__":
     app.add_handler(CallbackQueryHandler(delete_bet, pattern=r"^delete:"))
     app.add_handler(CallbackQueryHandler(confirm_delete, pattern=r"^confirm_delete:"))
     app.add_handler(CallbackQueryHandler(cancel_delete, pattern=r"^cancel_delete:"))
+    app.add_handler(CallbackQueryHandler(undo_confirm, pattern=r"^undo_confirm$"))
+    app.add_handler(CallbackQueryHandler(find_page_callback, pattern=r"^find_page:"))
+    app.add_handler(CallbackQueryHandler(undo_cancel, pattern=r"^undo_cancel$"))
     app.add_handler(CallbackQueryHandler(overbuy_select, pattern=r"^overbuy_select:"))
     app.add_handler(CallbackQueryHandler(overbuy_select_all, pattern=r"^overbuy_select_all$"))
     app.add_handler(CallbackQueryHandler(overbuy_unselect_all, pattern=r"^overbuy_unselect_all$"))
@@ -1729,8 +3802,30 @@ if __name__ == "__main__":
     app.add_handler(CallbackQueryHandler(datedelete_confirm, pattern=r"^datedelete_confirm$"))
 
     # Message handlers
+    # Edits must be claimed first: the text filters below match them too
+    app.add_handler(MessageHandler(filters.UpdateType.EDITED_MESSAGE & filters.TEXT & ~filters.COMMAND, handle_edited_message))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, comza_text))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.Document.ALL, restore_document))
+
+    # Scheduled draws need python-telegram-bot[job-queue]
+    if app.job_queue:
+        schedule_draw_jobs(app.job_queue)
+    else:
+        logger.warning("JobQueue not available, draws must be opened and closed by hand")
+
+
+if __name__ == "__main__":
+    if not TOKEN:
+        raise ValueError("❌ BOT_TOKEN environment variable is not set")
+        
+    async def post_init(app):
+        loop_monitor.start()
+        
+    app = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
+    register_handlers(app)
 
+    audit.start(AUDIT_LOG, AUDIT_MAX_BYTES, AUDIT_BACKUPS)
     logger.info("🚀 Bot is starting...")
     app.run_polling()
+    audit.stop()
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import random
+import threading
+import time as _time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from telegram.ext import ApplicationBuilder
+
+import bot
+from bench import make_workload, parse_mix, parse_range, DEFAULT_MIX
+
+# Local stand-in for the Telegram Bot API. getUpdates is served from a scripted
+# traffic generator; sendMessage/editMessageText are accepted with configurable
+# latency and 429 injection. The runner below points the real Application at it.
+
+BOT_USER = {"id": 999_999, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class FakeApiState:
+    def __init__(self, latency=0.0, rate_limit=0.0, retry_after=1, seed=1):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.updates = queue.Queue()
+        self.lock = threading.Lock()
+        self.message_ids = itertools.count(1_000_000)
+        self.update_ids = itertools.count(1)
+        self.delivered = 0
+        self.sent = 0
+        self.edited = 0
+        self.throttled = 0
+
+    def push_message(self, user_id, username, text):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(_time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self.updates.put({"update_id": next(self.update_ids), "message": message})
+
+    def get_updates(self, params):
+        timeout = float(params.get("timeout", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        result = []
+        try:
+            result.append(self.updates.get(timeout=timeout) if timeout else self.updates.get_nowait())
+            while len(result) < limit:
+                result.append(self.updates.get_nowait())
+        except queue.Empty:
+            pass
+        with self.lock:
+            self.delivered += len(result)
+        return result
+
+    def throttle(self):
+        if self.latency:
+            _time.sleep(self.latency)
+        if self.rate_limit and self.rng.random() < self.rate_limit:
+            with self.lock:
+                self.throttled += 1
+            return True
+        return False
+
+    def message_result(self, params):
+        return {
+            "message_id": int(params.get("message_id") or next(self.message_ids)),
+            "date": int(_time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        params = {k: v[0] for k, v in parse_qs(body).items()}
+        state = self.state
+
+        if method in ("sendMessage", "editMessageText") and state.throttle():
+            self.reply({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {state.retry_after}",
+                "parameters": {"retry_after": state.retry_after},
+            }, status=429)
+            return
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = state.get_updates(params)
+        elif method == "sendMessage":
+            with state.lock:
+                state.sent += 1
+            result = state.message_result(params)
+        elif method == "editMessageText":
+            with state.lock:
+                state.edited += 1
+            result = state.message_result(params)
+        else:
+            result = True
+        self.reply({"ok": True, "result": result})
+
+    def reply(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid long-poll, e.g. during shutdown
+            pass
+
+
+def start_server(state, host="127.0.0.1", port=0):
+    handler = type("BoundFakeApiHandler", (FakeApiHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run(args):
+    state = FakeApiState(args.latency / 1000, args.rate_limit, args.retry_after, args.seed)
+    server = start_server(state, port=args.port)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/bot"
+
+    admin_id, admin_name = 1, "dealer"
+    users, workload = make_workload(args.agents, args.slips, parse_range(args.lines), parse_mix(args.mix), args.seed)
+    state.push_message(admin_id, admin_name, "/start")
+    state.push_message(admin_id, admin_name, "/dateopen")
+    for user in users:
+        state.push_message(user.id, user.username, f"/join {admin_id}")
+    for user, text in workload:
+        state.push_message(user.id, user.username, text)
+    expected = state.updates.qsize()
+
+    builder = ApplicationBuilder().token("123456:FAKE").base_url(base_url)
+    if args.concurrent:
+        builder = builder.concurrent_updates(args.concurrent)
+    app = builder.build()
+    bot.register_handlers(app)
+
+    async with app:
+        await app.start()
+        start = _time.perf_counter()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        deadline = start + args.max_seconds
+        # Every update produces at least one outgoing call
+        while _time.perf_counter() < deadline:
+            if state.delivered >= expected and state.sent + state.throttled >= expected and app.update_queue.empty():
+                break
+            await asyncio.sleep(0.01)
+        elapsed = _time.perf_counter() - start
+        await app.updater.stop()
+        await app.stop()
+    server.shutdown()
+
+    bets = sum(len(entry[1]) for entry in bot.books[admin_id].message_store.values())
+    return {
+        "updates": expected,
+        "delivered": state.delivered,
+        "sent": state.sent,
+        "edited": state.edited,
+        "throttled": state.throttled,
+        "bets": bets,
+        "elapsed_s": elapsed,
+        "updates_per_sec": state.delivered / elapsed if elapsed else 0.0,
+        "bets_per_sec": bets / elapsed if elapsed else 0.0,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="End-to-end load test against a local fake Bot API server")
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--slips", type=int, default=1000)
+    parser.add_argument("--lines", default="1-8")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every send/edit")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probability a send/edit gets a 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--concurrent", type=int, default=0, help="concurrent_updates for the Application")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--max-seconds", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"updates={result['updates']} delivered={result['delivered']} sent={result['sent']} "
+              f"edited={result['edited']} throttled={result['throttled']} bets={result['bets']}")
+        print(f"end-to-end: {result['updates_per_sec']:.0f} updates/sec, "
+              f"{result['bets_per_sec']:.0f} bets/sec in {result['elapsed_s']:.2f}s")
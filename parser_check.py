@@ -0,0 +1,225 @@
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import time as _time
+from collections import Counter
+
+import bot
+
+# Regression checks for parse_bets: the golden corpus in parser_corpus.txt, a
+# seeded fuzzer over generated and noisy slip lines, and a throughput run that
+# fails when the parser gets slower than the committed parser_baseline.json.
+# Exits non-zero on any failure, so it can gate a parser change; after a
+# deliberate speed change, refresh the baseline with --save-baseline.
+
+CORPUS = "parser_corpus.txt"
+BASELINE = "parser_baseline.json"
+BET = re.compile(r"(\d\d)-(\d+)")
+
+SPECIAL = {
+    "အပူး": [0, 11, 22, 33, 44, 55, 66, 77, 88, 99],
+    "ပါဝါ": [5, 16, 27, 38, 49, 50, 61, 72, 83, 94],
+    "နက္ခ": [7, 18, 24, 35, 42, 53, 69, 70, 81, 96],
+    "ညီကို": [1, 12, 23, 34, 45, 56, 67, 78, 89, 90],
+    "ကိုညီ": [9, 10, 21, 32, 43, 54, 65, 76, 87, 98],
+}
+DYNAMIC = {
+    "ထိပ်": lambda d: [d * 10 + j for j in range(10)],
+    "ပိတ်": lambda d: [j * 10 + d for j in range(10)],
+    "ဘရိတ်": lambda d: [n for n in range(100) if (n // 10 + n % 10) % 10 == d],
+    "အပါ": lambda d: sorted({d * 10 + j for j in range(10)} | {j * 10 + d for j in range(10)}),
+}
+AMOUNTS = [100, 200, 300, 500, 1000, 1500, 2000, 5000, 10000]
+NUMBER_SEPS = ["/", ",", ".", "-", " ", "+", "*", "="]
+AMOUNT_SEPS = ["-", " ", "=", "*", " - "]
+MYANMAR_DIGITS = str.maketrans("0123456789", "၀၁၂၃၄၅၆၇၈၉")
+NOISE = (list("0123456789၀၁၂၃၄၅၆၇၈၉ /,.-+*=rRabxyz\r") + list(SPECIAL) + list(DYNAMIC)
+         + ["အခွေ", "အပူးပါအခွေ", "100", "1000", "50", "12"])
+
+
+def load_corpus(path):
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, raw in enumerate(f, 1):
+            raw = raw.rstrip("\n")
+            if not raw.strip() or raw.startswith("#"):
+                continue
+            line, _, expected = raw.partition("\t")
+            bets = [] if expected.strip() == "-" else expected.split()
+            cases.append((lineno, line, bets))
+    return cases
+
+
+def check_corpus(path):
+    failures = []
+    cases = load_corpus(path)
+    for lineno, line, expected in cases:
+        try:
+            bets, total = bot.parse_bets(line)
+        except Exception as e:
+            failures.append(f"{path}:{lineno} {line!r} raised {type(e).__name__}: {e}")
+            continue
+        if bets != expected:
+            failures.append(f"{path}:{lineno} {line!r}\n    expected {' '.join(expected) or '-'}\n"
+                            f"    got      {' '.join(bets) or '-'}")
+        elif total != sum(int(bet.split("-")[1]) for bet in bets):
+            failures.append(f"{path}:{lineno} {line!r} total {total} does not match its bets")
+    return len(cases), failures
+
+
+def make_line(rng):
+    # One well-formed construct and the bets it must expand to, in any order
+    kind = rng.choice(["plain", "r", "r2", "special", "dynamic", "wheel", "wheel_doubles"])
+    amount = rng.choice(AMOUNTS)
+    if kind in ("plain", "r", "r2"):
+        nums = [rng.randrange(100) for _ in range(rng.randint(1, 6))]
+        text = rng.choice(NUMBER_SEPS).join(f"{n:02d}" if n < 10 or rng.random() < 0.8 else str(n) for n in nums)
+        if rng.random() < 0.2:
+            text = text.translate(MYANMAR_DIGITS)
+        if kind == "plain":
+            return f"{text}{rng.choice(AMOUNT_SEPS)}{amount}", [(n, amount) for n in nums]
+        if kind == "r":
+            bets = [(n, amount) for n in nums] + [(bot.reverse_number(n), amount) for n in nums]
+            return f"{text} {rng.choice('rR')}{amount}", bets
+        second = rng.choice(AMOUNTS)
+        bets = [(n, amount) for n in nums] + [(bot.reverse_number(n), second) for n in nums]
+        if rng.random() < 0.5:
+            return f"{text} {amount}{rng.choice('rR')}{second}", bets
+        return f"{text} {rng.choice('rR')}{amount}{rng.choice(AMOUNT_SEPS)}{second}", bets
+    if kind == "special":
+        name = rng.choice(list(SPECIAL))
+        return f"{name} {amount}", [(n, amount) for n in SPECIAL[name]]
+    if kind == "dynamic":
+        name = rng.choice(list(DYNAMIC))
+        digit = rng.randrange(10)
+        return f"{digit}{name} {amount}", [(n, amount) for n in DYNAMIC[name](digit)]
+    digits = rng.sample(range(10), rng.randint(2, 5))
+    pairs = [a * 10 + b for a in digits for b in digits if a != b]
+    keyword = "အခွေ"
+    if kind == "wheel_doubles":
+        keyword = "အပူးပါအခွေ"
+        pairs += [d * 11 for d in digits]
+    pad = rng.choice(["", " "])
+    return f"{''.join(map(str, digits))}{pad}{keyword}{pad}{amount}", [(n, amount) for n in pairs]
+
+
+def make_mixed_line(rng):
+    # One to three constructs on a line; each expands as it would alone
+    parts = [make_line(rng) for _ in range(rng.randint(1, 3))]
+    text = rng.choice([" ", "  ", ", ", " / "]).join(line for line, _ in parts)
+    return text, [bet for _, bets in parts for bet in bets]
+
+
+def make_noise(rng):
+    return "".join(rng.choice(NOISE) for _ in range(rng.randint(1, 12)))
+
+
+def parse(line):
+    bets, total = bot.parse_bets(line)
+    parsed = []
+    for bet in bets:
+        match = BET.fullmatch(bet)
+        if not match or not 0 <= int(match.group(1)) <= 99 or int(match.group(2)) <= 0:
+            raise AssertionError(f"malformed bet {bet!r}")
+        parsed.append((int(match.group(1)), int(match.group(2))))
+    if total != sum(amt for _, amt in parsed):
+        raise AssertionError(f"total {total} does not match its bets")
+    return bets, parsed
+
+
+def fuzz(cases, seed):
+    rng = random.Random(seed)
+    failures = []
+    slip = []
+    for i in range(cases):
+        line, expected = make_mixed_line(rng) if i % 2 == 0 else (make_noise(rng), None)
+        try:
+            bets, parsed = parse(line)
+            if expected is not None and Counter(parsed) != Counter(expected):
+                raise AssertionError(f"expected {sorted(expected)}, got {sorted(parsed)}")
+            if parse(f"  {line}\t ")[0] != bets:
+                raise AssertionError("surrounding whitespace changed the result")
+            if parse(line)[0] != bets:
+                raise AssertionError("second parse differed")
+        except Exception as e:
+            failures.append(f"{line!r}: {type(e).__name__}: {e}")
+            continue
+        # Lines of a slip are read independently of each other
+        slip.append((line, bets))
+        if len(slip) == 8:
+            joined = bot.parse_bets(rng.choice(["\n", "\r\n", "\n\n"]).join(text for text, _ in slip))[0]
+            if joined != [bet for _, bets in slip for bet in bets]:
+                failures.append(f"{[text for text, _ in slip]!r}: slip differs from its lines parsed one by one")
+            slip = []
+    return failures
+
+
+def bench(lines, repeats, seed):
+    rng = random.Random(seed)
+    slips = []
+    for _ in range(lines // 5):
+        slips.append("\n".join(make_mixed_line(rng)[0] for _ in range(5)))
+    best = float("inf")
+    for _ in range(repeats):
+        start = _time.perf_counter()
+        for slip in slips:
+            bot.parse_bets(slip)
+        best = min(best, _time.perf_counter() - start)
+    return len(slips) * 5 / best
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Golden corpus, fuzzer and throughput check for parse_bets")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--fuzz", type=int, default=20000, help="generated lines to check, 0 to skip")
+    parser.add_argument("--bench", type=int, default=20000, help="lines to time, 0 to skip")
+    parser.add_argument("--repeats", type=int, default=7, help="timed runs; the best one counts")
+    parser.add_argument("--min-rate", type=float, default=0, help="fail below this many lines/sec")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="JSON file with a saved lines_per_sec to compare against, empty to skip")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run's rate to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    failed = False
+
+    count, failures = check_corpus(args.corpus)
+    print(f"corpus: {count} lines, {len(failures)} failures")
+    for failure in failures:
+        print(f"  {failure}")
+    failed |= bool(failures)
+
+    if args.fuzz:
+        failures = fuzz(args.fuzz, args.seed)
+        print(f"fuzz: {args.fuzz} lines (seed {args.seed}), {len(failures)} failures")
+        for failure in failures[:20]:
+            print(f"  {failure}")
+        failed |= bool(failures)
+
+    if args.bench:
+        rate = bench(args.bench, args.repeats, args.seed)
+        print(f"throughput: {rate:.0f} lines/sec")
+        if args.min_rate and rate < args.min_rate:
+            print(f"  below --min-rate {args.min_rate:.0f}")
+            failed = True
+        if args.baseline and args.save_baseline:
+            with open(args.baseline, "w") as f:
+                json.dump({"lines_per_sec": round(rate)}, f)
+            print(f"  saved to {args.baseline}")
+        elif args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)["lines_per_sec"]
+            print(f"  baseline {baseline:.0f} lines/sec ({rate / baseline - 1:+.0%})")
+            if rate < baseline * (1 - args.tolerance):
+                print(f"  slower than the baseline by more than {args.tolerance:.0%}")
+                failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,222 @@
+import archive
+
+# Report text for /total, /tsent, /posthis and /dateall. The handlers copy
+# what a report needs on the event loop (draw labels as strings, per-user
+# totals and bet lists as tuples, archive paths) and these functions turn that into lines
+# in a worker, so bets keep being taken while a big report is written. Inputs
+# are builtins only, so they can be sent to a worker process as well.
+
+
+def total_report(label, pnum, users):
+    # users is [(username, total stake, stake on pnum, com, za)], overbuy
+    # upstreams with negative stakes
+    msg = [f"📊 {label} အတွက် စုပေါင်းရလဒ်"]
+    total_net = 0
+    for user, user_total_amt, user_pamt, com, za in users:
+
+        commission_amt = (user_total_amt * com) // 100
+        after_com = user_total_amt - commission_amt
+        win_amt = user_pamt * za
+
+        net = after_com - win_amt
+        status = "ဒိုင်ကပေးရမည်" if net < 0 else "ဒိုင်ကရမည်"
+
+        msg.append(
+            f"👤 {user}\n"
+            f"💵 စုစုပေါင်း: {user_total_amt}\n"
+            f"📊 Com({com}%) ➤ {commission_amt}\n"
+            f"💰 Com ပြီး: {after_com}\n"
+            f"🔢 Power Number({pnum:02d}) ➤ {user_pamt}\n"
+            f"🎯 Za({za}) ➤ {win_amt}\n"
+            f"📈 ရလဒ်: {abs(net)} ({status})\n"
+            "-----------------"
+        )
+        total_net += net
+
+    if len(msg) > 1:
+        msg.append(f"\n📊 စုစုပေါင်းရလဒ်: {abs(total_net)} ({'ဒိုင်အရှုံး' if total_net < 0 else 'ဒိုင်အမြတ်'})")
+    return msg
+
+
+def tsent_reports(label, users):
+    # One message per user; users is [(username, bets)]
+    texts = []
+    for user, bets in users:
+        user_report = [f"👤 {user} - {label}:"]
+        total_amt = 0
+        for num, amt in bets:
+            user_report.append(f"  - {num:02d} ➤ {amt}")
+            total_amt += amt
+        user_report.append(f"💵 စုစုပေါင်း: {total_amt}")
+        texts.append("\n".join(user_report))
+    return texts
+
+
+def history_report(username, draws):
+    # draws is [(label, pnum, bets or archive path)]; archived draws show the
+    # user's per-number stakes
+    msg = [f"📊 {username} ရဲ့လောင်းကြေးမှတ်တမ်း"]
+    total_amount = 0
+    pnumber_total = 0
+    for label, pnum, bets in draws:
+        if isinstance(bets, str):
+            stakes = archive.load_draw(bets).user_stakes(username)
+            if stakes is None:
+                continue
+            bets = [(num, amt) for num, amt in enumerate(stakes) if amt]
+        pnum_str = f" [P: {pnum:02d}]" if pnum is not None else ""
+
+        msg.append(f"\n📅 {label}{pnum_str}:")
+        for num, amt in bets:
+            if pnum is not None and num == pnum:
+                msg.append(f"🔴 {num:02d} ➤ {amt} 🔴")
+                pnumber_total += amt
+            else:
+                msg.append(f"{num:02d} ➤ {amt}")
+            total_amount += amt
+
+    if len(msg) > 1:
+        msg.append(f"\n💵 စုစုပေါင်း: {total_amount}")
+        if pnumber_total > 0:
+            msg.append(f"🔴 Power Number စုစုပေါင်း: {pnumber_total}")
+    return msg
+
+
+def archived_overbuy_totals(draw):
+    # {upstream: {num: amount}} over all lots. Archives written before lots
+    # were kept only had each upstream's last lot in their meta, so those are
+    # summed from the overbuy slips instead
+    if "overbuy_sums" in draw.meta:
+        return {user: {int(num): amt for num, amt in nums.items()} for user, nums in draw.meta["overbuy_list"].items()}
+    totals = {}
+    for _, (user, _, bets, is_overbuy) in draw.iter_slips():
+        if is_overbuy:
+            nums = totals.setdefault(user, {})
+            for num, amt in bets:
+                nums[num] = nums.get(num, 0) + amt
+    return totals
+
+
+def archived_overbuys(draw, pnum):
+    # {upstream: (total, stake on pnum)}, the same shape OverbuyBook.settlement gives
+    if "overbuy_sums" in draw.meta:
+        key = str(pnum)
+        totals = draw.meta["overbuy_list"]
+        return {user: (total, totals[user].get(key, 0) if pnum is not None else 0)
+                for user, total in draw.meta["overbuy_sums"].items()}
+    return {user: (sum(nums.values()), nums.get(pnum, 0) if pnum is not None else 0)
+            for user, nums in archived_overbuy_totals(draw).items()}
+
+
+def dateall_report(labels, draws, com_data, za_data):
+    # draws is [(pnum, {username: (total, stake on pnum)} or archive path,
+    # {upstream: (total, stake on pnum)} or None)]. User rows include their
+    # overbuys as negative stakes; the upstream part is settled on its own
+    user_reports = []
+    total_bets = 0
+    total_power = 0
+    total_net = 0
+
+    # ရိုးရိုး user များအတွက် တွက်ချက်ခြင်း
+    user_sums = {}  # {user: [total, power_total]}
+    overbuy_lists = []
+    for pnum, rows, overbuys in draws:
+        if isinstance(rows, str):
+            # Closed draws are summed from the archive's stake matrix
+            draw = archive.load_draw(rows)
+            overbuys = archived_overbuys(draw, pnum)
+            rows = {}
+            for user, user_total in draw.user_totals().items():
+                ob_total, ob_power = overbuys.get(user, (0, 0))
+                power = draw.user_stakes(user)[pnum] + ob_power if pnum is not None else 0
+                rows[user] = (user_total + ob_total, power)
+        for user, (user_total, user_power) in rows.items():
+            sums = user_sums.setdefault(user, [0, 0])
+            sums[0] += user_total
+            sums[1] += user_power
+        overbuy_lists.append((pnum, overbuys))
+
+    for user, (user_total, user_power) in user_sums.items():
+        if user_total > 0:
+            com = com_data.get(user, 0)
+            za = za_data.get(user, archive.DEFAULT_ZA)
+
+            commission = (user_total * com) // 100
+            after_com = user_total - commission
+            win_amount = user_power * za
+            net = after_com - win_amount
+
+            user_reports.append({
+                'username': user,
+                'total': user_total,
+                'commission': commission,
+                'after_com': after_com,
+                'power_total': user_power,
+                'win_amount': win_amount,
+                'net': net,
+                'is_overbuy': False
+            })
+
+            total_bets += user_total
+            total_power += user_power
+            total_net += net
+
+    # Overbuy user များအတွက် တွက်ချက်ခြင်း
+    for pnum, overbuys in overbuy_lists:
+        for user, (user_total, user_power) in overbuys.items():
+            if user_total > 0:
+                com = com_data.get(user, 0)
+                za = za_data.get(user, archive.DEFAULT_ZA)
+
+                commission = (user_total * com) // 100
+                after_com = user_total - commission
+                win_amount = user_power * za
+                net = after_com - win_amount
+
+                user_reports.append({
+                    'username': user,
+                    'total': -user_total,  # Overbuy ဖြစ်ကြောင်း ပြသရန် -
+                    'commission': -commission,
+                    'after_com': -after_com,
+                    'power_total': -user_power,
+                    'win_amount': -win_amount,
+                    'net': net,
+                    'is_overbuy': True
+                })
+
+                total_bets -= user_total
+                total_power -= user_power
+                total_net += net
+
+    # အစီရင်ခံစာတည်ဆောက်ခြင်း
+    msg = ["📊 ရွေးချယ်ထားသည့် နေ့ရက်များ စုပေါင်းရလဒ်:"]
+    msg.append(f"📅 နေ့ရက်များ: {', '.join(labels)}\n")
+
+    for report in user_reports:
+        if report['is_overbuy']:
+            msg.append(f"👤 {report['username']}(overbuy အမည်)")
+        else:
+            msg.append(f"👤 {report['username']}:(ရိုးရိုးuser)")
+
+        msg.append(f"💵 စုစုပေါင်း: {report['total']}")
+        msg.append(f"📊 Com({com_data.get(report['username'], 0)}%) ➤ {report['commission']}")
+        msg.append(f"💰 Com ပြီး: {report['after_com']}")
+
+        if report['power_total'] != 0:
+            msg.append(f"🔢 Power Number စုစုပေါင်း: {report['power_total']}")
+            msg.append(f"🎯 Za({za_data.get(report['username'], archive.DEFAULT_ZA)}) ➤ {report['win_amount']}")
+
+        status = "ဒိုင်ကပေးရမည်" if report['net'] < 0 else "ဒိုင်ကရမည်"
+        msg.append(f"📈 ရလဒ်: {abs(report['net'])} ({status})")
+        msg.append("-----------------")
+
+    # စုစုပေါင်းရလဒ်
+    msg.append("\n📊 စုစုပေါင်း:")
+    msg.append(f"💵 လောင်းကြေးစုစုပေါင်း: {total_bets}")
+
+    if total_power != 0:
+        msg.append(f"🔴 Power Number စုစုပေါင်း: {total_power}")
+
+    overall_status = "ဒိုင်အရှုံး" if total_net < 0 else "ဒိုင်အမြတ်"
+    msg.append(f"📈 စုစုပေါင်းရလဒ်: {abs(total_net)}({overall_status})")
+    return msg
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import time as _time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+import audit
+import bot
+
+# Scale-out mode: a front dispatcher polls Telegram and forwards every update
+# over a multiprocessing queue to the worker that owns its book. Each worker
+# runs the normal handlers on its shard of books and persists that shard.
+
+logger = logging.getLogger(__name__)
+
+TOKEN = os.getenv("BOT_TOKEN")
+
+
+def shard_for(book_id, workers):
+    return book_id % workers
+
+
+class Router:
+    # Mirrors the /start and /join rules of bot.py so the dispatcher knows which
+    # book (and therefore which worker) a chat belongs to without owning state.
+    def __init__(self, path=None):
+        self.path = path
+        self.chat_books = {}  # {chat_id: book_id}
+        self.books = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.chat_books = {int(k): v for k, v in data["chat_books"].items()}
+            self.books = set(data["books"])
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"chat_books": self.chat_books, "books": sorted(self.books)}, f)
+        os.replace(tmp, self.path)
+
+    def learn(self, update):
+        message = update.message
+        if not message or not message.text or not update.effective_user:
+            return
+        chat_id = update.effective_chat.id
+        user_id = update.effective_user.id
+        command, _, rest = message.text.partition(" ")
+        command = command.split("@")[0]
+        current = self.chat_books.get(chat_id)
+
+        if command == "/start" and current in (None, user_id):
+            self.books.add(user_id)
+            self.chat_books[chat_id] = user_id
+            self.save()
+        elif command == "/join" and rest.strip().lstrip("-").isdigit():
+            book_id = int(rest.strip())
+            # Same rule as bot.join: a bound group only stays or re-joins its
+            # own book; private chats can move
+            private = update.effective_chat.type == "private"
+            if book_id in self.books and (current in (None, book_id) or private and current != user_id):
+                self.chat_books[chat_id] = book_id
+                self.save()
+
+    def book_for(self, update):
+        chat = update.effective_chat
+        if chat is None:
+            return 0
+        # Chats without a book still go somewhere consistent so the worker can
+        # answer with the /join hint.
+        return self.chat_books.get(chat.id, chat.id)
+
+
+class _LegacyDraw:
+    # State files from before draws were pickled by day and segment hold bare
+    # codes laid out as ordinal * len(SEGMENTS) + index
+    def __new__(cls, code):
+        return bot.Draw.decode(code, bot.SEGMENTS, len(bot.SEGMENTS))
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) == ("bot", "Draw"):
+            return _LegacyDraw
+        return super().find_class(module, name)
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        state = _StateUnpickler(f).load()
+    if "version" not in state:
+        # Older state files pickled the Book objects themselves
+        bot.books.update(state["books"])
+        bot.chat_books.update(state["chat_books"])
+        return
+    for settings, draws, archives, live in state["books"]:
+        frames = [("book", settings)] + [("draw", draw) for draw in draws] + [("end", len(draws), 0)]
+        book, _ = bot.build_book(frames, None)
+        # Archive files never left this host, so only their paths are kept
+        for code, archive_path in archives.items():
+            book.archives[bot.Draw.decode(code, settings["segments"])] = archive_path
+        # Left out of /backup snapshots but kept across shard restarts
+        book.board, book.board_digest = live["board"], live["board_digest"]
+        book.pending_alerts = {(bot.Draw.decode(code, settings["segments"]), num): alert
+                               for (code, num), alert in live["pending_alerts"].items()}
+        bot.install_book(book)
+
+
+async def save_state(path):
+    # Books are copied on the loop as /backup does; pickling and the write
+    # happen in a thread so other tasks keep running meanwhile
+    captured = []
+    for book in list(bot.books.values()):
+        settings, draws, archives = await bot.capture_book(book)
+        live = {
+            "board": book.board,
+            "board_digest": book.board_digest,
+            "pending_alerts": {(int(k), num): alert for (k, num), alert in book.pending_alerts.items()},
+        }
+        captured.append((settings, draws, archives, live))
+    await asyncio.to_thread(write_state, path, {"version": 2, "books": captured})
+
+
+def write_state(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+async def serve_shard(index, inbox, token, base_url, state_path, save_interval):
+    load_state(state_path)
+    # One audit file per shard: a book lives on one shard, so /audit there
+    # finds all of its entries, and no two processes rotate the same file
+    root, ext = os.path.splitext(bot.AUDIT_LOG)
+    bot.AUDIT_LOG = f"{root}.shard{index}{ext}"
+    audit.start(bot.AUDIT_LOG, bot.AUDIT_MAX_BYTES, bot.AUDIT_BACKUPS)
+    builder = ApplicationBuilder().token(token).updater(None)
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+    bot.register_handlers(app)
+
+    loop = asyncio.get_running_loop()
+    last_save = _time.monotonic()
+    async with app:
+        await app.start()
+        logger.info("Shard %s ready with %s books", index, len(bot.books))
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            await app.process_update(Update.de_json(data, app.bot))
+            if _time.monotonic() - last_save >= save_interval:
+                await save_state(state_path)
+                last_save = _time.monotonic()
+        await app.stop()
+    await save_state(state_path)
+    audit.stop()
+    logger.info("Shard %s stopped", index)
+
+
+def worker_main(index, inbox, token, base_url, state_path, save_interval):
+    logging.basicConfig(
+        format=f'%(asctime)s - shard{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(serve_shard(index, inbox, token, base_url, state_path, save_interval))
+
+
+def run_dispatcher(token, workers, state_dir, base_url=None, save_interval=30.0):
+    os.makedirs(state_dir, exist_ok=True)
+    ctx = multiprocessing.get_context("spawn")
+    inboxes = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(
+            target=worker_main,
+            args=(i, inboxes[i], token, base_url, os.path.join(state_dir, f"shard{i}.pickle"), save_interval),
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    router = Router(os.path.join(state_dir, "router.json"))
+
+    async def forward(update: Update, context):
+        router.learn(update)
+        inboxes[shard_for(router.book_for(update), workers)].put(update.to_dict())
+
+    builder = ApplicationBuilder().token(token)
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+    app.add_handler(TypeHandler(Update, forward))
+
+    logger.info("🚀 Dispatcher starting with %s workers", workers)
+    try:
+        app.run_polling()
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot sharded across worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--state-dir", default="shards")
+    parser.add_argument("--base-url", default=None, help="Bot API base URL, e.g. the fake_api server")
+    parser.add_argument("--save-interval", type=float, default=30.0, help="seconds between shard snapshots")
+    args = parser.parse_args()
+
+    if not TOKEN:
+        raise ValueError("❌ BOT_TOKEN environment variable is not set")
+    run_dispatcher(TOKEN, args.workers, args.state_dir, args.base_url, args.save_interval)
@@ -0,0 +1,51 @@
+import gzip
+import os
+import pickle
+import struct
+
+# Book snapshots: a fixed header followed by one gzip stream of pickled
+# frames. Frames hold builtin types only (dicts, lists, tuples, sets, ints,
+# strs, bytes), so a snapshot loads on any host whatever the bot's classes
+# look like, and the reader refuses anything else. Frames are pickled and
+# compressed one at a time, so neither side holds the whole encoded book.
+
+MAGIC = b"KKSNAP\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sI")  # magic, version
+
+
+class _BuiltinsUnpickler(pickle.Unpickler):
+    # Snapshots arrive as uploaded documents; never import anything from them
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"snapshot frames may not reference {module}.{name}")
+
+
+def write_snapshot(path, frames, level=6):
+    tmp = f"{path}.tmp"
+    size = 0
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION))
+        with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=level, mtime=0) as stream:
+            for frame in frames:
+                pickle.dump(frame, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+
+def read_snapshot(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise ValueError("not a book snapshot")
+        magic, version = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("not a book snapshot")
+        if version > VERSION:
+            raise ValueError(f"snapshot version {version} is newer than this bot supports ({VERSION})")
+        with gzip.GzipFile(fileobj=f, mode="rb") as stream:
+            while True:
+                try:
+                    yield _BuiltinsUnpickler(stream).load()
+                except EOFError:
+                    return